@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+Benchmark of summarization backends on a real corpus
+
+Samples texts from the scraped_messages table (or a small bundled Russian
+corpus) and runs each Summarizer backend at the requested concurrency
+levels. Reports throughput, p50/p95/p99 latency, peak RSS and summary cache
+hit rate as JSON.
+
+Backends are called without the fallbacks the bot uses, so a failing
+backend shows up as errors rather than as fast truncated summaries (the
+router keeps its own fallback, which is part of what it does). Each backend
+and concurrency level runs in a fresh process, so peak RSS is its own.
+
+The "stub" backend runs the real chunking, map-reduce and caching code with
+a fake model that sleeps in proportion to the input size, so the benchmark
+runs on CI without any model or API key. Its context is small enough
+(--stub-n-ctx) that most bundled texts go through map-reduce.
+
+Examples:
+    python benchmark.py
+    python benchmark.py --source db --limit 500 --backends extractive,llama_cpp --concurrency 1,2
+    python benchmark.py --backends llama_cpp --set LLAMA_CPP_N_THREADS=4 --set LLAMA_CPP_N_CTX=2048
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+BUNDLED_CORPUS = [
+    "Центральный банк России сохранил ключевую ставку на уровне 16% годовых. Регулятор отметил, что инфляционное давление остаётся высоким, а кредитная активность замедляется медленнее, чем ожидалось. Следующее заседание совета директоров запланировано на конец следующего месяца.",
+    "В Москве завершилось строительство новой станции метро на Большой кольцевой линии. Станция откроется для пассажиров в ближайшие выходные. По оценкам мэрии, она разгрузит соседние пересадочные узлы на 15 процентов.",
+    "Сборная России по хоккею обыграла команду Финляндии со счётом 3:1 в товарищеском матче. Две шайбы забросил нападающий, вызванный в команду впервые. Тренерский штаб остался доволен игрой в обороне.",
+    "Компания представила новую версию мобильного приложения с поддержкой офлайн-режима. Пользователи смогут сохранять статьи и читать их без подключения к интернету. Обновление уже доступно в магазинах приложений.",
+    "Синоптики предупреждают о сильном ветре и мокром снеге в центральных регионах. Порывы ветра могут достигать 20 метров в секунду. Жителей просят не оставлять автомобили под деревьями и рекламными конструкциями.",
+    "Правительство утвердило программу поддержки малого бизнеса на следующий год. Предприниматели смогут получить льготные кредиты и налоговые каникулы. Общий объём финансирования составит несколько сотен миллиардов рублей.",
+    "Учёные опубликовали результаты исследования о влиянии сна на память. Участники, спавшие не менее семи часов, лучше запоминали новую информацию. Авторы советуют не жертвовать сном ради учёбы перед экзаменами.",
+    "Авиакомпания объявила о запуске прямых рейсов в три новых направления. Полёты начнутся в начале лета и будут выполняться два раза в неделю. Билеты уже поступили в продажу на сайте перевозчика.",
+    "В крупном городе открылась выставка современного искусства. В экспозиции представлены работы более ста художников из разных стран. Выставка продлится до конца сезона, вход для школьников бесплатный.",
+    "Курс рубля укрепился на фоне роста цен на нефть. Аналитики связывают динамику с налоговым периодом и продажей валютной выручки экспортёрами. В ближайшие недели эксперты не ожидают резких колебаний.",
+]
+
+DEFAULT_BACKENDS = "short,extractive,stub"
+
+
+def apply_overrides(pairs):
+    """Apply KEY=VALUE settings to the environment before config is imported"""
+    for pair in pairs or []:
+        key, _, value = pair.partition("=")
+        os.environ[key.strip()] = value.strip()
+
+
+def load_corpus(source: str, limit: int, seed: int):
+    """Sample texts from the database or from the bundled corpus"""
+    rng = random.Random(seed)
+    if source == "db":
+        from database import SessionLocal, ScrapedMessage
+        from sqlalchemy import func
+
+        db = SessionLocal()
+        try:
+            rows = db.query(ScrapedMessage.text).filter(
+                func.length(ScrapedMessage.text) >= 50
+            ).all()
+        finally:
+            db.close()
+        texts = [row.text for row in rows]
+        if not texts:
+            raise SystemExit("scraped_messages has no texts to sample, use --source corpus")
+        rng.shuffle(texts)
+        return texts[:limit]
+
+    # Combine bundled paragraphs into posts of varying length
+    texts = []
+    for _ in range(limit):
+        paragraphs = rng.sample(BUNDLED_CORPUS, rng.randint(1, 4))
+        texts.append("\n\n".join(paragraphs))
+    return texts
+
+
+def percentile(sorted_values, q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def make_summarize(backend: str, stub_latency: float, stub_n_ctx: int):
+    """Fresh Summarizer (with an empty cache) and a summarize(text) that raises on failure"""
+    from summarizer import Summarizer, LLAMA_CPP_SYSTEM_PROMPT
+    from extractive import extractive_summarizer
+
+    summarizer = Summarizer()
+    summarizer.summarization_type = backend
+
+    if backend == "short":
+        return summarizer, lambda text: text[:100].strip() + "..."
+    if backend == "extractive":
+        return summarizer, extractive_summarizer.summarize
+    if backend == "api":
+        return summarizer, summarizer.summarize_api_raw
+    if backend == "llama_cpp":
+        return summarizer, summarizer.summarize_llama_cpp_raw
+    if backend == "gemini":
+        return summarizer, summarizer.summarize_gemini_raw
+    if backend == "router":
+        return summarizer, summarizer._summarize_with_router
+    if backend != "stub":
+        raise SystemExit(f"Unknown backend: {backend}")
+
+    def fake_complete(system_prompt, text):
+        # Roughly a local model: fixed overhead plus time per input token
+        time.sleep(stub_latency * (1 + summarizer._estimate_tokens(text) / 500))
+        return text.split(". ")[0][:200]
+
+    def summarize(text):
+        return summarizer._summarize_chunked(
+            text,
+            backend="stub",
+            complete=fake_complete,
+            count_tokens=summarizer._estimate_tokens,
+            n_ctx=stub_n_ctx,
+            system_prompt=LLAMA_CPP_SYSTEM_PROMPT,
+            max_workers=1
+        )
+
+    return summarizer, summarize
+
+
+def run_backend(backend: str, texts, concurrency: int, passes: int, stub_latency: float, stub_n_ctx: int) -> dict:
+    summarizer, summarize = make_summarize(backend, stub_latency, stub_n_ctx)
+    latencies = []
+    errors = 0
+    first_error = None
+
+    def timed(text):
+        started = time.perf_counter()
+        summarize(text)
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for _ in range(passes):
+            for future in [pool.submit(timed, text) for text in texts]:
+                try:
+                    latencies.append(future.result())
+                except Exception as e:
+                    errors += 1
+                    first_error = first_error or f"{type(e).__name__}: {e}"
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    cache = summarizer.cache.stats()
+    result = {
+        'backend': backend,
+        'concurrency': concurrency,
+        'requests': len(texts) * passes,
+        'errors': errors,
+        'first_error': first_error,
+        'wall_seconds': round(wall, 4),
+        'throughput_per_second': round(len(latencies) / wall, 2) if wall else None,
+        'latency_seconds': {
+            'p50': round(percentile(latencies, 0.50), 5),
+            'p95': round(percentile(latencies, 0.95), 5),
+            'p99': round(percentile(latencies, 0.99), 5),
+            'max': round(latencies[-1], 5) if latencies else 0.0,
+        },
+        'peak_rss_mb': peak_rss_mb(),
+        'cache': cache,
+    }
+    if backend == "stub":
+        from summarizer import LLAMA_CPP_SYSTEM_PROMPT
+        budget = summarizer._input_budget(stub_n_ctx, LLAMA_CPP_SYSTEM_PROMPT, summarizer._estimate_tokens)
+        result['map_reduce_texts'] = sum(summarizer._estimate_tokens(text) > budget for text in texts)
+    return result
+
+
+def run_isolated(*args) -> dict:
+    """run_backend in a fresh process, so peak RSS is not inherited from earlier backends"""
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+        return pool.submit(run_backend, *args).result()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark summarization backends")
+    parser.add_argument("--source", choices=("corpus", "db"), default="corpus",
+                        help="sample texts from the bundled corpus or the scraped_messages table")
+    parser.add_argument("--limit", type=int, default=200, help="number of texts to sample")
+    parser.add_argument("--backends", default=DEFAULT_BACKENDS,
+                        help="comma-separated: short, extractive, api, llama_cpp, gemini, router, stub")
+    parser.add_argument("--concurrency", default="1,4", help="comma-separated concurrency levels")
+    parser.add_argument("--passes", type=int, default=2,
+                        help="passes over the sample; later passes measure cache hits")
+    parser.add_argument("--stub-latency", type=float, default=0.005,
+                        help="base latency of the stub model in seconds")
+    parser.add_argument("--stub-n-ctx", type=int, default=512,
+                        help="context size of the stub model; small enough to force map-reduce")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--set", action="append", metavar="KEY=VALUE",
+                        help="override a config setting, e.g. LLAMA_CPP_N_THREADS=4")
+    parser.add_argument("--output", help="write JSON here instead of stdout")
+    args = parser.parse_args(argv)
+
+    apply_overrides(args.set)
+    texts = load_corpus(args.source, args.limit, args.seed)
+
+    results = []
+    for backend in [b.strip() for b in args.backends.split(",") if b.strip()]:
+        for concurrency in [int(c) for c in args.concurrency.split(",")]:
+            print(f"Running {backend} at concurrency {concurrency}...", file=sys.stderr)
+            results.append(run_isolated(backend, texts, concurrency, args.passes, args.stub_latency, args.stub_n_ctx))
+
+    report = {
+        'source': args.source,
+        'texts': len(texts),
+        'mean_text_chars': round(sum(len(t) for t in texts) / len(texts), 1) if texts else 0,
+        'overrides': args.set or [],
+        'results': results,
+    }
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
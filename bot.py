@@ -1,8 +1,10 @@
 """
 Main Telegram Bot - Handles user interactions and notifications
 """
+import asyncio
 import logging
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest
 from telegram.ext import (
     ApplicationBuilder,
     CommandHandler,
@@ -12,17 +14,42 @@ from telegram.ext import (
     filters
 )
 from datetime import datetime
-from database import SessionLocal, User, Subscription, UserSettings, ScrapedMessage
-from config import BOT_TOKEN
-from summarizer import summarizer
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from database import SessionLocal, User, Subscription, UserSettings, UserFilter, ScrapedMessage, MessageSummary
+from config import (
+    BOT_TOKEN, BOT_MODE, CHANNEL_LIST_TTL_SECONDS, LOG_LEVEL, MESSAGE_FILTERS_PER_USER, MESSAGE_FILTER_MAX_LENGTH
+)
+from summarizer import summarizer, normalize_tier, TIER_LIMITS
+from clustering import story_clusterer
+from summary_queue import summary_queue
+from delivery import delivery_dispatcher, PRIORITY_REPLY, PRIORITY_DIGEST
+from digests import digest_scheduler, get_timezone
+from update_processor import PerChatUpdateProcessor
+from user_cache import user_cache
+from message_filters import (
+    message_filters, validate_regex, INCLUDE as FILTER_INCLUDE, EXCLUDE as FILTER_EXCLUDE,
+    KEYWORD as FILTER_KEYWORD, REGEX as FILTER_REGEX
+)
 
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    #level=logging.INFO
-    level=logging.DEBUG
+    level=LOG_LEVEL
 )
 logger = logging.getLogger(__name__)
 
+# Channels per page of /all_channels
+CHANNELS_PER_PAGE = 8
+
+
+async def reply(update: Update, text: str, priority: int = PRIORITY_REPLY, **kwargs):
+    """Reply to the chat of an update through the rate-limited delivery dispatcher"""
+    if not delivery_dispatcher.running:
+        # bot.py run standalone: no dispatcher, reply directly
+        return await update.message.reply_text(text, **kwargs)
+    return await delivery_dispatcher.send_message(
+        update.effective_chat.id, text, priority=priority, **kwargs
+    )
+
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /start command"""
@@ -31,9 +58,9 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     db = SessionLocal()
     try:
         # Check if user exists
-        db_user = db.query(User).filter(User.telegram_id == user.id).first()
+        entry = user_cache.get(db, user.id)
         
-        if not db_user:
+        if not entry:
             db_user = User(
                 telegram_id=user.id,
                 username=user.username
@@ -45,6 +72,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
             settings = UserSettings(user_id=db_user.id)
             db.add(settings)
             db.commit()
+            digest_scheduler.reschedule(db_user.id, settings.daily_digest, settings.notification_time, settings.timezone)
             
             welcome_text = f"""
 👋 Привет, {user.first_name}!
@@ -68,7 +96,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         else:
             welcome_text = f"С возвращением, {user.first_name}! 👋"
         
-        await update.message.reply_text(welcome_text)
+        await reply(update, welcome_text)
         
     except Exception as e:
         logger.error(f"Error in start command: {e}")
@@ -87,6 +115,8 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 /subscribe - Подписаться на канал
 /unsubscribe - Отписаться от канала
 /settings - Настройки уведомлений
+/timezone - Часовой пояс для ежедневного дайджеста
+/filter - Фильтры постов по словам
 
 /digest - Получить дайджест сейчас
 /help - Показать справку
@@ -107,10 +137,10 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
    Формат: channel_ID
    Пример: /subscribe channel_1315670121
 
-💡 Команда /all_channels покажет все каналы в несколько сообщений
-   (по 20 каналов в каждом сообщении)
+💡 Команда /all_channels покажет все каналы постранично:
+   нажмите на канал, чтобы подписаться или отписаться
 """
-    await update.message.reply_text(help_text)
+    await reply(update, help_text)
 
 
 async def channels_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -119,18 +149,16 @@ async def channels_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     db = SessionLocal()
     try:
-        user = db.query(User).filter(User.telegram_id == telegram_id).first()
-        if not user:
-            await update.message.reply_text("❌ Используйте /start для начала")
+        entry = user_cache.get(db, telegram_id)
+        if not entry:
+            await reply(update, "❌ Используйте /start для начала")
             return
         
-        subscriptions = db.query(Subscription).filter(
-            Subscription.user_id == user.id,
-            Subscription.is_active == True
-        ).all()
+        subscriptions = entry.subscriptions
         
         if not subscriptions:
-            await update.message.reply_text(
+            await reply(
+                update,
                 "📭 Вы ещё не подписаны ни на какие каналы.\n"
                 "Используйте /subscribe @channel_name для подписки"
             )
@@ -140,7 +168,7 @@ async def channels_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         for sub in subscriptions:
             text += f"• {sub.channel_title or sub.channel_id}\n"
         
-        await update.message.reply_text(text)
+        await reply(update, text)
         
     except Exception as e:
         logger.error(f"Error in channels command: {e}")
@@ -148,114 +176,136 @@ async def channels_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         db.close()
 
 
-async def all_channels_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle /all_channels command - show all channels user is subscribed to in Telegram"""
-    telegram_id = update.effective_user.id
-
-    db = SessionLocal()
-    try:
-        user = db.query(User).filter(User.telegram_id == telegram_id).first()
-        if not user:
-            await update.message.reply_text("❌ Используйте /start для начала")
-            return
+def channel_identifier(channel: dict) -> str:
+    """Identifier used by /subscribe for a channel from the Telegram dialog list"""
+    return f"@{channel['username']}" if channel['username'] else f"channel_{channel['id']}"
 
-        # Get user's subscriptions in our system
-        user_subscriptions = db.query(Subscription).filter(
-            Subscription.user_id == user.id,
-            Subscription.is_active == True
-        ).all()
 
-        user_channel_ids = {sub.channel_id for sub in user_subscriptions}
+def render_channels_page(channels: list, subscribed_ids: set, page: int):
+    """
+    Text and inline keyboard of one page of the channel list
 
-        # Get all channels from Telegram using Telethon
-        try:
-            from scheduler import get_scraper
-            scraper = get_scraper()
+    Each channel is a button: ✅ unsubscribes, ➕ subscribes.
+    """
+    total_pages = max(1, (len(channels) + CHANNELS_PER_PAGE - 1) // CHANNELS_PER_PAGE)
+    page = min(max(page, 0), total_pages - 1)
+    chunk = channels[page * CHANNELS_PER_PAGE:(page + 1) * CHANNELS_PER_PAGE]
+
+    text = (
+        f"📋 Ваши каналы в Telegram ({len(channels)} каналов, "
+        f"отслеживается {len(subscribed_ids & {channel_identifier(c) for c in channels})})\n"
+        f"📄 Страница {page + 1}/{total_pages}\n\n"
+        "✅ — отслеживается, нажмите чтобы отписаться\n"
+        "➕ — нажмите чтобы подписаться"
+    )
+
+    keyboard = []
+    for channel in chunk:
+        channel_id = channel_identifier(channel)
+        if channel_id in subscribed_ids:
+            button = InlineKeyboardButton(f"✅ {channel['title']}", callback_data=f"ch_unsub:{page}:{channel_id}")
+        else:
+            button = InlineKeyboardButton(f"➕ {channel['title']}", callback_data=f"ch_sub:{page}:{channel_id}")
+        keyboard.append([button])
 
-            if not scraper:
-                await update.message.reply_text(
-                    "❌ Не удалось подключиться к Telegram. Попробуйте позже."
-                )
-                return
+    navigation = []
+    if page > 0:
+        navigation.append(InlineKeyboardButton("◀️", callback_data=f"ch_page:{page - 1}"))
+    navigation.append(InlineKeyboardButton(f"{page + 1}/{total_pages}", callback_data="ch_noop"))
+    if page < total_pages - 1:
+        navigation.append(InlineKeyboardButton("▶️", callback_data=f"ch_page:{page + 1}"))
+    keyboard.append(navigation)
 
-            await update.message.reply_text("🔍 Получаю список ваших каналов из Telegram...")
+    return text, InlineKeyboardMarkup(keyboard)
 
-            # Get all channels user is subscribed to in Telegram
-            telegram_channels = await scraper.get_user_channels()
 
-            if not telegram_channels:
-                await update.message.reply_text(
-                    "📭 В вашем Telegram нет доступных каналов для отслеживания."
-                )
-                return
+async def get_channel_snapshot():
+    """Channel list of the Telethon account, cached for CHANNEL_LIST_TTL_SECONDS"""
+    from scheduler import get_scraper
+    scraper = get_scraper()
+    if not scraper:
+        return None
+    return await scraper.get_user_channels(max_age=CHANNEL_LIST_TTL_SECONDS)
 
-            # Format the response
-            text = "📋 Ваши каналы в Telegram:\n\n"
 
-            # Group channels
-            subscribed_channels = []  # Channels already in our system
-            other_channels = []  # Other channels
+async def all_channels_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /all_channels command - show all Telegram channels as a paginated keyboard"""
+    telegram_id = update.effective_user.id
 
-            for channel in telegram_channels:
-                channel_id = f"@{channel['username']}" if channel['username'] else f"channel_{channel['id']}"
-                channel_title = channel['title']
+    db = SessionLocal()
+    try:
+        entry = user_cache.get(db, telegram_id)
+        if not entry:
+            await reply(update, "❌ Используйте /start для начала")
+            return
 
-                if channel_id in user_channel_ids:
-                    subscribed_channels.append((channel_id, channel_title, "✅"))
-                else:
-                    other_channels.append((channel_id, channel_title, "➕"))
+        try:
+            telegram_channels = await get_channel_snapshot()
+        except Exception as e:
+            logger.error(f"Error getting Telegram channels: {e}")
+            telegram_channels = None
 
-            # Show subscribed channels first
-            if subscribed_channels:
-                text += "✅ Отслеживаемые каналы:\n"
-                for channel_id, channel_title, status in subscribed_channels:
-                    text += f"{status} {channel_title}\n"
-                text += "\n"
+        if telegram_channels is None:
+            await reply(
+                update,
+                "❌ Не удалось подключиться к Telegram. Попробуйте позже."
+            )
+            return
 
-            # Show other channels with usernames for easy copying - ALL CHANNELS
-            if other_channels:
-                # Send all channels in multiple messages (20 channels per message)
-                channels_per_message = 20
-                total_messages = (len(other_channels) + channels_per_message - 1) // channels_per_message
+        if not telegram_channels:
+            await reply(
+                update,
+                "📭 В вашем Telegram нет доступных каналов для отслеживания."
+            )
+            return
 
-                await update.message.reply_text(
-                    f"📋 Ваши каналы в Telegram ({len(other_channels)} каналов)\n"
-                    f"📄 Будет отправлено {total_messages} сообщений"
-                )
+        text, reply_markup = render_channels_page(telegram_channels, entry.channel_ids, 0)
+        await reply(update, text, reply_markup=reply_markup)
 
-                for i in range(0, len(other_channels), channels_per_message):
-                    chunk = other_channels[i:i + channels_per_message]
-                    page_num = (i // channels_per_message) + 1
+    except Exception as e:
+        logger.error(f"Error in all_channels command: {e}")
+    finally:
+        db.close()
 
-                    text = f"📋 Страница {page_num}/{total_messages}\n\n"
-                    text += "➕ Доступные для отслеживания:\n"
 
-                    for channel_id, channel_title, status in chunk:
-                        # Format as: "Channel Name → @channel_name" for easy copying
-                        text += f"{status} {channel_title} → {channel_id}\n"
+async def handle_channels_callback(query, db, user, callback_data: str):
+    """Page switching and subscribe/unsubscribe buttons of /all_channels"""
+    if callback_data == "ch_noop":
+        return
 
-                    text += "\n💡 Скопируйте @username и используйте: /subscribe @username"
+    action, _, rest = callback_data.partition(":")
+    page_text, _, channel_id = rest.partition(":")
+    try:
+        page = int(page_text)
+    except ValueError:
+        return
 
-                    # Small delay between messages to avoid rate limiting
-                    if i > 0:
-                        import asyncio
-                        await asyncio.sleep(1)
+    channels = await get_channel_snapshot() or []
 
-                    await update.message.reply_text(text)
+    if action in ("ch_sub", "ch_unsub") and channel_id:
+        subscription = db.query(Subscription).filter(
+            Subscription.user_id == user.id,
+            Subscription.channel_id == channel_id
+        ).first()
+        if action == "ch_sub":
+            if subscription:
+                subscription.is_active = True
             else:
-                await update.message.reply_text("🎉 Вы подписаны на все доступные каналы!")
-
-        except Exception as e:
-            logger.error(f"Error getting Telegram channels: {e}")
-            await update.message.reply_text(
-                "❌ Ошибка при получении списка каналов из Telegram. "
-                "Убедитесь, что бот правильно настроен и подключен к Telegram API."
-            )
+                title = next((c['title'] for c in channels if channel_identifier(c) == channel_id), channel_id)
+                db.add(Subscription(user_id=user.id, channel_id=channel_id, channel_title=title))
+        elif subscription:
+            subscription.is_active = False
+        db.commit()
+        user_cache.invalidate(user.telegram_id, subscriptions=True)
 
-    except Exception as e:
-        logger.error(f"Error in all_channels command: {e}")
-    finally:
-        db.close()
+    entry = user_cache.get(db, user.telegram_id)
+    text, reply_markup = render_channels_page(channels, entry.channel_ids if entry else set(), page)
+    try:
+        await query.edit_message_text(text, reply_markup=reply_markup)
+    except BadRequest as e:
+        # Double taps re-render an identical page
+        if "not modified" not in str(e).lower():
+            raise
 
 
 async def subscribe_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -263,7 +313,8 @@ async def subscribe_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     args = context.args
     
     if not args:
-        await update.message.reply_text(
+        await reply(
+            update,
             "❌ Укажите название канала или ID\n\n"
             "📱 Примеры:\n"
             "• /subscribe tproger (канал с username)\n"
@@ -278,10 +329,11 @@ async def subscribe_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     db = SessionLocal()
     try:
         # Get user
-        user = db.query(User).filter(User.telegram_id == user_id).first()
-        if not user:
-            await update.message.reply_text("❌ Пользователь не найден. Используйте /start")
+        entry = user_cache.get(db, user_id)
+        if not entry:
+            await reply(update, "❌ Пользователь не найден. Используйте /start")
             return
+        user = entry.user
         
         # Determine channel format
         if channel_input.startswith('channel_'):
@@ -300,7 +352,7 @@ async def subscribe_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         ).first()
         
         if existing:
-            await update.message.reply_text(f"✅ Вы уже подписаны на {channel_id}")
+            await reply(update, f"✅ Вы уже подписаны на {channel_id}")
             return
         
         # Add subscription
@@ -311,8 +363,10 @@ async def subscribe_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         db.add(subscription)
         db.commit()
+        user_cache.invalidate(user_id, subscriptions=True)
         
-        await update.message.reply_text(
+        await reply(
+            update,
             f"✅ Подписка на {channel_id} добавлена!\n\n"
             f"📢 Бот будет автоматически собирать и суммаризировать "
             f"сообщения из этого канала.\n"
@@ -321,7 +375,7 @@ async def subscribe_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     except Exception as e:
         logger.error(f"Error in subscribe command: {e}")
-        await update.message.reply_text("❌ Ошибка при добавлении подписки")
+        await reply(update, "❌ Ошибка при добавлении подписки")
     finally:
         db.close()
 
@@ -331,7 +385,8 @@ async def unsubscribe_command(update: Update, context: ContextTypes.DEFAULT_TYPE
     args = context.args
     
     if not args:
-        await update.message.reply_text(
+        await reply(
+            update,
             "❌ Укажите название канала или ID\n\n"
             "📱 Примеры:\n"
             "• /unsubscribe tproger (канал с username)\n"
@@ -345,10 +400,11 @@ async def unsubscribe_command(update: Update, context: ContextTypes.DEFAULT_TYPE
     
     db = SessionLocal()
     try:
-        user = db.query(User).filter(User.telegram_id == user_id).first()
-        if not user:
-            await update.message.reply_text("❌ Пользователь не найден. Используйте /start")
+        entry = user_cache.get(db, user_id)
+        if not entry:
+            await reply(update, "❌ Пользователь не найден. Используйте /start")
             return
+        user = entry.user
         
         # Determine channel format
         if channel_input.startswith('channel_'):
@@ -366,9 +422,10 @@ async def unsubscribe_command(update: Update, context: ContextTypes.DEFAULT_TYPE
         if subscription:
             subscription.is_active = False
             db.commit()
-            await update.message.reply_text(f"✅ Отписка от {channel_id} выполнена")
+            user_cache.invalidate(user_id, subscriptions=True)
+            await reply(update, f"✅ Отписка от {channel_id} выполнена")
         else:
-            await update.message.reply_text(f"❌ Вы не были подписаны на {channel_id}")
+            await reply(update, f"❌ Вы не были подписаны на {channel_id}")
 
     except Exception as e:
         logger.error(f"Error in unsubscribe command: {e}")
@@ -382,17 +439,15 @@ async def settings_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     db = SessionLocal()
     try:
-        user = db.query(User).filter(User.telegram_id == telegram_id).first()
-        if not user:
-            await update.message.reply_text("❌ Используйте /start для начала")
+        entry = user_cache.get(db, telegram_id)
+        if not entry:
+            await reply(update, "❌ Используйте /start для начала")
             return
         
-        settings = db.query(UserSettings).filter(
-            UserSettings.user_id == user.id
-        ).first()
+        settings = entry.settings
         
         if not settings:
-            await update.message.reply_text("❌ Настройки не найдены")
+            await reply(update, "❌ Настройки не найдены")
             return
         
         keyboard = [
@@ -412,10 +467,10 @@ async def settings_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 📏 Длина суммаризации: {settings.summary_length}
 🖼️ Включать медиа: {'Да' if settings.include_media else 'Нет'}
 📅 Ежедневный дайджест: {'Включен' if settings.daily_digest else 'Выключен'}
-🔔 Время уведомлений: {settings.notification_time}
+🔔 Время уведомлений: {settings.notification_time} ({get_timezone(settings.timezone)})
 """
         reply_markup = InlineKeyboardMarkup(keyboard)
-        await update.message.reply_text(settings_text, reply_markup=reply_markup)
+        await reply(update, settings_text, reply_markup=reply_markup)
         
     except Exception as e:
         logger.error(f"Error in settings command: {e}")
@@ -423,6 +478,172 @@ async def settings_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         db.close()
 
 
+async def timezone_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /timezone command - set timezone for the daily digest"""
+    telegram_id = update.effective_user.id
+
+    if not context.args:
+        await reply(
+            update,
+            "❌ Укажите часовой пояс\n\n"
+            "Пример: /timezone Europe/Moscow\n"
+            "Пример: /timezone Asia/Yekaterinburg"
+        )
+        return
+
+    tz_name = context.args[0].strip()
+    try:
+        ZoneInfo(tz_name)
+    except (ZoneInfoNotFoundError, ValueError):
+        await reply(update, f"❌ Неизвестный часовой пояс: {tz_name}")
+        return
+
+    db = SessionLocal()
+    try:
+        entry = user_cache.get(db, telegram_id)
+        if not entry:
+            await reply(update, "❌ Используйте /start для начала")
+            return
+        user = entry.user
+
+        settings = db.query(UserSettings).filter(UserSettings.user_id == user.id).first()
+        if not settings:
+            await reply(update, "❌ Настройки не найдены")
+            return
+
+        settings.timezone = tz_name
+        db.commit()
+        user_cache.invalidate(telegram_id)
+        digest_scheduler.reschedule(user.id, settings.daily_digest, settings.notification_time, settings.timezone)
+        await reply(update, f"✅ Часовой пояс: {tz_name}")
+
+    except Exception as e:
+        logger.error(f"Error in timezone command: {e}")
+    finally:
+        db.close()
+
+
+FILTER_USAGE = (
+    "🔎 Фильтры сообщений:\n"
+    "/filter +слово — присылать только посты со словом\n"
+    "/filter -слово — не присылать посты со словом\n"
+    "/filter +/регулярное выражение/ — то же с регулярным выражением\n"
+    "/filter @канал -слово — фильтр только для одного канала\n"
+    "/filter del 2 — удалить фильтр №2\n"
+    "/filter clear — удалить все фильтры\n\n"
+    "💡 Слово ищется как часть текста без учёта регистра: «ставк» найдёт «ставка» и «ставки»"
+)
+
+
+def describe_filter(item) -> str:
+    sign = "➕" if item.kind == FILTER_INCLUDE else "➖"
+    pattern = f"/{item.pattern}/" if item.pattern_type == FILTER_REGEX else item.pattern
+    scope = f" (только {item.channel_id})" if item.channel_id else ""
+    return f"{sign} {pattern}{scope}"
+
+
+def parse_filter(text: str):
+    """
+    Parse '[@channel] +word', '[@channel] -word' or '[@channel] +/regex/'
+
+    Returns:
+        (kind, pattern_type, pattern, channel_id)
+
+    Raises:
+        ValueError: With a message for the user
+    """
+    channel_id = None
+    first, _, rest = text.partition(' ')
+    if first.startswith('@') or first.startswith('channel_'):
+        channel_input = first.lstrip('@')
+        channel_id = channel_input if channel_input.startswith('channel_') else f"@{channel_input}"
+        text = rest.strip()
+
+    if text[:1] not in ('+', '-'):
+        raise ValueError("Начните фильтр с + (присылать) или - (не присылать)")
+    kind = FILTER_INCLUDE if text[0] == '+' else FILTER_EXCLUDE
+    pattern = text[1:].strip()
+
+    if len(pattern) >= 2 and pattern.startswith('/') and pattern.endswith('/'):
+        pattern = pattern[1:-1]
+        try:
+            validate_regex(pattern)
+        except ValueError as e:
+            raise ValueError(f"Неверное регулярное выражение: {e}")
+        return kind, FILTER_REGEX, pattern, channel_id
+
+    if not pattern:
+        raise ValueError("Укажите слово после + или -")
+    if len(pattern) > MESSAGE_FILTER_MAX_LENGTH:
+        raise ValueError(f"Слишком длинный фильтр (максимум {MESSAGE_FILTER_MAX_LENGTH} символов)")
+    return kind, FILTER_KEYWORD, pattern, channel_id
+
+
+async def filter_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /filter command - list, add and remove keyword/regex filters"""
+    telegram_id = update.effective_user.id
+    # The raw text keeps a regex's spacing, which context.args would not
+    text = (update.message.text or "").partition(' ')[2].strip()
+
+    db = SessionLocal()
+    try:
+        entry = user_cache.get(db, telegram_id)
+        if not entry:
+            await reply(update, "❌ Используйте /start для начала")
+            return
+        user = entry.user
+
+        filters = db.query(UserFilter).filter(UserFilter.user_id == user.id).order_by(UserFilter.id).all()
+
+        if not text:
+            if not filters:
+                await reply(update, "📭 Фильтров нет, приходят все посты\n\n" + FILTER_USAGE)
+                return
+            lines = [f"{number}. {describe_filter(item)}" for number, item in enumerate(filters, 1)]
+            await reply(update, "🔎 Ваши фильтры:\n" + "\n".join(lines) + "\n\n" + FILTER_USAGE)
+            return
+
+        command, _, argument = text.partition(' ')
+        if command.lower() == "clear":
+            for item in filters:
+                db.delete(item)
+            result = "✅ Все фильтры удалены"
+        elif command.lower() == "del":
+            number = int(argument) if argument.strip().isdigit() else 0
+            if not 1 <= number <= len(filters):
+                await reply(update, "❌ Укажите номер фильтра из списка /filter")
+                return
+            item = filters[number - 1]
+            db.delete(item)
+            result = f"✅ Фильтр удалён: {describe_filter(item)}"
+        else:
+            try:
+                kind, pattern_type, pattern, channel_id = parse_filter(text)
+            except ValueError as e:
+                await reply(update, f"❌ {e}\n\n{FILTER_USAGE}")
+                return
+            if any((f.kind, f.pattern_type, f.pattern, f.channel_id) == (kind, pattern_type, pattern, channel_id)
+                   for f in filters):
+                await reply(update, "✅ Такой фильтр уже есть")
+                return
+            if len(filters) >= MESSAGE_FILTERS_PER_USER:
+                await reply(update, f"❌ Не больше {MESSAGE_FILTERS_PER_USER} фильтров, удалите ненужные: /filter del N")
+                return
+            item = UserFilter(user_id=user.id, kind=kind, pattern_type=pattern_type, pattern=pattern, channel_id=channel_id)
+            db.add(item)
+            result = f"✅ Фильтр добавлен: {describe_filter(item)}"
+
+        db.commit()
+        message_filters.update_user(db, user.id)
+        await reply(update, result)
+
+    except Exception as e:
+        logger.error(f"Error in filter command: {e}")
+        await reply(update, "❌ Ошибка при изменении фильтров")
+    finally:
+        db.close()
+
+
 async def digest_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /digest command - get immediate digest"""
     telegram_id = update.effective_user.id
@@ -431,34 +652,34 @@ async def digest_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     db = SessionLocal()
     try:
         # Get user by telegram_id first
-        user = db.query(User).filter(User.telegram_id == telegram_id).first()
+        entry = user_cache.get(db, telegram_id)
         
-        if not user:
-            await update.message.reply_text("❌ Используйте /start для начала")
+        if not entry:
+            await reply(update, "❌ Используйте /start для начала")
             return
         
-        subscriptions = db.query(Subscription).filter(
-            Subscription.user_id == user.id,
-            Subscription.is_active == True
-        ).all()
+        subscriptions = entry.subscriptions
         
         logger.info(f"User has {len(subscriptions)} active subscriptions")
 
         if not subscriptions:
-            await update.message.reply_text("📭 Нет активных подписок")
+            await reply(update, "📭 Нет активных подписок")
             return
         
         # Debug: check total messages in DB
         total_messages = db.query(ScrapedMessage).count()
         logger.info(f"Total messages in DB: {total_messages}")
 
-        digest_text = "📰 Срочный дайджест:\n\n"
-        total_messages = 0
+        settings = entry.settings
+        tier = normalize_tier(settings.summary_length if settings else None)
+
+        digest_messages = []
         channels_with_messages = 0
 
         for sub in subscriptions:
+            # Messages are stored once per channel, shared by all its subscribers
             messages = db.query(ScrapedMessage).filter(
-                ScrapedMessage.subscription_id == sub.id
+                ScrapedMessage.channel_id == sub.channel_id
             ).order_by(ScrapedMessage.timestamp.desc()).limit(5).all()
             
             logger.debug(f"Channel '{sub.channel_title}' (sub_id={sub.id}): {len(messages)} messages found")
@@ -468,20 +689,50 @@ async def digest_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
             if messages:
                 channels_with_messages += 1
-                total_messages += len(messages)
-                digest_text += f"📌 {sub.channel_title}:\n"
                 for msg in messages:
-                    summary = msg.summary or msg.processed_text or msg.text
-                    digest_text += f"• {summary[:100]}...\n"
-                digest_text += "\n"
+                    digest_messages.append({
+                        'id': msg.id,
+                        'text': msg.text or "",
+                        'summary': msg.summary or msg.processed_text,
+                        'link': msg.link,
+                        'channel_title': sub.channel_title,
+                        'timestamp': msg.timestamp
+                    })
         
-        logger.info(f"Found {total_messages} messages in {channels_with_messages} channels")
+        logger.info(f"Found {len(digest_messages)} messages in {channels_with_messages} channels")
 
         if not channels_with_messages:
-            await update.message.reply_text("📭 Нет новых сообщений для отображения")
+            await reply(update, "📭 Нет новых сообщений для отображения")
             return
 
-        await update.message.reply_text(digest_text)
+        tier_summaries = {
+            row.scraped_message_id: row.text for row in db.query(MessageSummary).filter(
+                MessageSummary.scraped_message_id.in_([msg['id'] for msg in digest_messages]),
+                MessageSummary.tier == tier
+            ).all()
+        }
+        for msg in digest_messages:
+            msg['summary'] = tier_summaries.get(msg['id']) or msg['summary']
+
+        # Ten channels covering one event become one story with ten sources
+        stories = story_clusterer.group(digest_messages)
+        logger.info(f"Digest for user {telegram_id}: {len(digest_messages)} messages in {len(stories)} stories")
+
+        digest_text = "📰 Срочный дайджест:\n\n"
+        for members in stories:
+            summary = await summary_queue.submit(
+                lambda members=members: summarizer.summarize_story(members, tier),
+                fallback=lambda members=members: members[0]['summary'] or members[0]['text'][:200],
+                interactive=True
+            )
+            digest_text += f"• {summary[:TIER_LIMITS[tier][1]]}...\n"
+            sources = []
+            for msg in members:
+                title = msg['channel_title']
+                sources.append(f"{title}: {msg['link']}" if msg['link'] else title)
+            digest_text += "📌 " + "; ".join(dict.fromkeys(sources)) + "\n\n"
+
+        await reply(update, digest_text, priority=PRIORITY_DIGEST)
         
     except Exception as e:
         logger.error(f"Error in digest command: {e}")
@@ -501,10 +752,15 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     db = SessionLocal()
     
     try:
-        user = db.query(User).filter(User.telegram_id == telegram_id).first()
-        if not user:
+        entry = user_cache.get(db, telegram_id)
+        if not entry:
             await query.edit_message_text("❌ Используйте /start для начала")
             return
+        user = entry.user
+        
+        if callback_data.startswith("ch_"):
+            await handle_channels_callback(query, db, user, callback_data)
+            return
         
         settings = db.query(UserSettings).filter(UserSettings.user_id == user.id).first()
         if not settings:
@@ -516,6 +772,7 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             length = callback_data.replace("len_", "")
             settings.summary_length = length
             db.commit()
+            user_cache.invalidate(telegram_id)
             await query.edit_message_text(f"✅ Длина суммаризации: {length}")
             return
         
@@ -523,6 +780,7 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if callback_data == "setting_media":
             settings.include_media = not settings.include_media
             db.commit()
+            user_cache.invalidate(telegram_id)
             await query.edit_message_text(f"✅ Медиа: {'включено' if settings.include_media else 'выключено'}")
             return
         
@@ -530,6 +788,8 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if callback_data == "setting_digest":
             settings.daily_digest = not settings.daily_digest
             db.commit()
+            user_cache.invalidate(telegram_id)
+            digest_scheduler.reschedule(user.id, settings.daily_digest, settings.notification_time, settings.timezone)
             await query.edit_message_text(f"✅ Ежедневный дайджест: {'включен' if settings.daily_digest else 'выключен'}")
             return
         
@@ -565,7 +825,7 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
 📏 Длина суммаризации: {settings.summary_length}
 🖼️ Включать медиа: {'Да' if settings.include_media else 'Нет'}
 📅 Ежедневный дайджест: {'Включен' if settings.daily_digest else 'Выключен'}
-🔔 Время уведомлений: {settings.notification_time}
+🔔 Время уведомлений: {settings.notification_time} ({get_timezone(settings.timezone)})
 """
             await query.edit_message_text(settings_text, reply_markup=InlineKeyboardMarkup(keyboard))
             return
@@ -600,6 +860,8 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 datetime.strptime(time_value, "%H:%M")
                 settings.notification_time = time_value
                 db.commit()
+                user_cache.invalidate(telegram_id)
+                digest_scheduler.reschedule(user.id, settings.daily_digest, settings.notification_time, settings.timezone)
                 await query.edit_message_text(f"✅ Время уведомлений: {time_value}")
                 return
             except ValueError:
@@ -645,7 +907,7 @@ async def send_summary(bot, user_id: int, channel_title: str, message_text: str,
 
 def main():
     """Main function to run the bot"""
-    application = ApplicationBuilder().token(BOT_TOKEN).build()
+    application = ApplicationBuilder().token(BOT_TOKEN).concurrent_updates(PerChatUpdateProcessor()).build()
     
     # Add handlers
     application.add_handler(CommandHandler('start', start))
@@ -655,11 +917,17 @@ def main():
     application.add_handler(CommandHandler('subscribe', subscribe_command))
     application.add_handler(CommandHandler('unsubscribe', unsubscribe_command))
     application.add_handler(CommandHandler('settings', settings_command))
+    application.add_handler(CommandHandler('timezone', timezone_command))
+    application.add_handler(CommandHandler('filter', filter_command))
     application.add_handler(CommandHandler('digest', digest_command))
     application.add_handler(CallbackQueryHandler(handle_callback))
     
     # Start the bot
-    application.run_polling(poll_interval=10)
+    if BOT_MODE == "webhook":
+        from webhook import run_webhook
+        asyncio.run(run_webhook(application))
+    else:
+        application.run_polling(drop_pending_updates=True)
 
 
 if __name__ == "__main__":
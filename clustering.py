@@ -0,0 +1,182 @@
+"""
+Story clustering for digests
+
+Groups recent messages from different channels that cover the same event.
+Messages are embedded as hashed TF-IDF vectors (signed feature hashing into
+a fixed number of dimensions, document frequencies updated incrementally)
+and assigned online: a new message joins the most similar story centroid
+if the cosine similarity is high enough, otherwise it starts a new story.
+Already assigned messages are never reclustered.
+"""
+import hashlib
+import logging
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from config import STORY_SIMILARITY_THRESHOLD, STORY_WINDOW_HOURS, STORY_HASH_DIM
+from extractive import tokenize
+
+logger = logging.getLogger(__name__)
+
+# Members whose texts are combined when a story is summarized
+STORY_SUMMARY_MEMBERS = 3
+
+
+@dataclass
+class Story:
+    """A group of messages about one event"""
+    id: int
+    centroid: np.ndarray
+    updated_at: datetime
+    member_ids: List[int] = field(default_factory=list)
+
+
+class StoryClusterer:
+    """Incremental clustering of messages into stories"""
+
+    def __init__(
+        self,
+        threshold: float = STORY_SIMILARITY_THRESHOLD,
+        window_hours: int = STORY_WINDOW_HOURS,
+        dim: int = STORY_HASH_DIM
+    ):
+        self.threshold = threshold
+        self.window = timedelta(hours=window_hours)
+        self.dim = dim
+        self._df = np.zeros(dim, dtype=np.float32)
+        self._documents = 0
+        self._stories: Dict[int, Story] = {}
+        self._story_ids: List[int] = []
+        self._centroids = np.zeros((0, dim), dtype=np.float32)
+        self._message_story: Dict[int, int] = {}
+        self._next_id = 1
+        # Newest message timestamp seen; the window is measured back from it, not from the clock
+        self._latest: Optional[datetime] = None
+
+    def _hash_features(self, text: str):
+        """Map tokens to (bucket, sign) pairs"""
+        indices = []
+        signs = []
+        for token in tokenize(text or ""):
+            value = int.from_bytes(hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest(), 'little')
+            indices.append(value % self.dim)
+            signs.append(1.0 if (value >> 63) & 1 else -1.0)
+        return np.asarray(indices, dtype=np.int64), np.asarray(signs, dtype=np.float32)
+
+    def vectorize(self, text: str, update_df: bool = True) -> Optional[np.ndarray]:
+        """Hashed TF-IDF vector, L2-normalized; None if the text has no terms"""
+        indices, signs = self._hash_features(text)
+        if indices.size == 0:
+            return None
+
+        counts = np.zeros(self.dim, dtype=np.float32)
+        # Signed hashing: colliding tokens cancel out instead of always adding up
+        np.add.at(counts, indices, signs)
+        magnitude = np.abs(counts)
+        if update_df:
+            self._df[magnitude > 0] += 1
+            self._documents += 1
+
+        idf = np.log((1.0 + self._documents) / (1.0 + self._df)) + 1.0
+        vector = np.sign(counts) * np.log1p(magnitude) * idf
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+
+    def _expire(self, now: datetime):
+        cutoff = now - self.window
+        expired = [sid for sid in self._story_ids if self._stories[sid].updated_at < cutoff]
+        if not expired:
+            return
+        for sid in expired:
+            story = self._stories.pop(sid)
+            for message_id in story.member_ids:
+                self._message_story.pop(message_id, None)
+        keep = [i for i, sid in enumerate(self._story_ids) if sid in self._stories]
+        self._story_ids = [self._story_ids[i] for i in keep]
+        self._centroids = self._centroids[keep]
+
+    def assign(
+        self,
+        message_id: int,
+        text: str,
+        timestamp: Optional[datetime] = None,
+        expire: bool = True
+    ) -> Optional[Story]:
+        """
+        Put a message into a story, creating a new one if nothing is similar
+
+        Messages seen before keep their story, so repeated calls are cheap.
+        Stories expire STORY_WINDOW_HOURS before the newest message seen, so
+        old messages still cluster with each other; expire=False keeps every
+        story while a batch of messages is grouped.
+        """
+        story_id = self._message_story.get(message_id)
+        if story_id is not None:
+            return self._stories.get(story_id)
+
+        now = timestamp or datetime.now(timezone.utc)
+        if now.tzinfo is None:
+            now = now.replace(tzinfo=timezone.utc)
+        if self._latest is None or now > self._latest:
+            self._latest = now
+        if expire:
+            self._expire(self._latest)
+
+        vector = self.vectorize(text)
+        if vector is None:
+            return None
+
+        if self._story_ids:
+            similarities = self._centroids @ vector
+            best = int(np.argmax(similarities))
+            if similarities[best] >= self.threshold:
+                story = self._stories[self._story_ids[best]]
+                size = len(story.member_ids)
+                centroid = (story.centroid * size + vector) / (size + 1)
+                norm = np.linalg.norm(centroid)
+                story.centroid = centroid / norm if norm else centroid
+                self._centroids[best] = story.centroid
+                story.member_ids.append(message_id)
+                story.updated_at = max(story.updated_at, now)
+                self._message_story[message_id] = story.id
+                return story
+
+        story = Story(id=self._next_id, centroid=vector, updated_at=now, member_ids=[message_id])
+        self._next_id += 1
+        self._stories[story.id] = story
+        self._story_ids.append(story.id)
+        self._centroids = np.vstack([self._centroids, vector[np.newaxis, :]])
+        self._message_story[message_id] = story.id
+        return story
+
+    def story_of(self, message_id: int) -> Optional[Story]:
+        story_id = self._message_story.get(message_id)
+        return self._stories.get(story_id) if story_id is not None else None
+
+    def group(self, messages: List[dict]) -> List[List[dict]]:
+        """
+        Group message dicts (with 'id', 'text' and optional 'timestamp') into stories
+
+        Nothing expires during the call, so a digest spanning more than the
+        story window (quiet channels) is still grouped as a whole.
+
+        Returns:
+            Lists of messages, one per story, in order of first appearance
+        """
+        groups: Dict[object, List[dict]] = {}
+        for msg in messages:
+            story = self.assign(msg['id'], msg.get('text') or "", msg.get('timestamp'), expire=False)
+            key = story.id if story else ('single', msg['id'])
+            groups.setdefault(key, []).append(msg)
+        return list(groups.values())
+
+    def story_text(self, members: List[dict]) -> str:
+        """Text a multi-message story is summarized from"""
+        longest_first = sorted(members, key=lambda m: len(m.get('text') or ""), reverse=True)
+        return "\n\n".join(m.get('text') or "" for m in longest_first[:STORY_SUMMARY_MEMBERS])
+
+
+story_clusterer = StoryClusterer()
@@ -13,6 +13,37 @@ load_dotenv()
 # Получите: https://t.me/BotFather -> /newbot
 BOT_TOKEN = os.getenv("BOT_TOKEN", "your_bot_token_here")
 
+# Сколько апдейтов (команд) обрабатывать одновременно
+# Апдейты одного чата всё равно обрабатываются по очереди
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "16"))
+
+# Способ получения апдейтов: polling (getUpdates) или webhook (встроенный HTTP-сервер)
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+
+# ============== LOGGING ==============
+# Уровень логов: DEBUG, INFO, WARNING, ERROR
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+
+# ============== WEBHOOK (BOT_MODE=webhook) ==============
+# Адрес и порт, на которых слушает встроенный HTTP-сервер
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+
+# Путь, на который Telegram присылает апдейты
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+
+# Публичный HTTPS-адрес бота, например https://bot.example.com
+# Пусто - вебхук не регистрируется в Telegram (локальное тестирование)
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+
+# Секрет, который Telegram передаёт в заголовке X-Telegram-Bot-Api-Secret-Token
+# Пусто при заданном WEBHOOK_URL - генерируется случайный при запуске
+WEBHOOK_SECRET_TOKEN = os.getenv("WEBHOOK_SECRET_TOKEN", "")
+
+# Сертификат и ключ для HTTPS без обратного прокси (необязательно)
+WEBHOOK_CERT = os.getenv("WEBHOOK_CERT", "")
+WEBHOOK_KEY = os.getenv("WEBHOOK_KEY", "")
+
 # ============== TELETHON (MTProto) ==============
 # API credentials для прямого доступа к Telegram API
 # Получите: https://my.telegram.org/apps -> Create application
@@ -30,13 +61,26 @@ SESSION_NAME = os.getenv("SESSION_NAME", "telegram_aggregator")
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///bot.db")
 
 # ============== SUMMARIZATION ==============
-# Тип суммаризации: "local" (FLAN-T5), "api" (OpenAI/Gemini), "llama_cpp" или "short"
+# Тип суммаризации: "local" (FLAN-T5), "api" (OpenAI/Gemini), "llama_cpp", "extractive", "router" или "short"
 # local: легкая FLAN-T5 модель для CPU, бесплатно, офлайн
 # api: требует API ключ, платный, качественная суммаризация
 # llama_cpp: локальная модель GGUF, высокая производительность
+# router: несколько бэкендов с учётом задержки и предохранителями (см. BACKEND ROUTER)
+# extractive: выбор ключевых предложений (TF-IDF + TextRank), без модели, тысячи постов в секунду
 # short: обрезка текста до 100 символов + "...", самый быстрый режим
 SUMMARIZATION_TYPE = os.getenv("SUMMARIZATION_TYPE", "short")
 
+# ============== EXTRACTIVE ==============
+# Сколько ключевых предложений оставлять в экстрактивном резюме
+EXTRACTIVE_MAX_SENTENCES = int(os.getenv("EXTRACTIVE_MAX_SENTENCES", "2"))
+
+# Максимальная длина экстрактивного резюме в символах
+EXTRACTIVE_MAX_CHARS = int(os.getenv("EXTRACTIVE_MAX_CHARS", "400"))
+
+# Экстрактивный предварительный проход перед LLM: длинный пост сжимается до ключевых
+# предложений, помещающихся в контекст, вместо map-reduce по частям (true/false)
+SUMMARY_EXTRACTIVE_PREPASS = os.getenv("SUMMARY_EXTRACTIVE_PREPASS", "false").lower() == "true"
+
 # ============== LLAMA_CPP ==============
 # Путь к модели GGUF для llama_cpp
 LLAMA_CPP_MODEL_PATH = os.getenv("LLAMA_CPP_MODEL_PATH", r"G:\LLM_models2\Grok-3-reasoning-gemma3-12B-distilled-HF.Q8_0.gguf")
@@ -61,6 +105,71 @@ LLAMA_CPP_TEMPERATURE = float(os.getenv("LLAMA_CPP_TEMPERATURE", "0.1"))
 #LLAMA_CPP_MAX_TOKENS = int(os.getenv("LLAMA_CPP_MAX_TOKENS", "8192"))
 LLAMA_CPP_MAX_TOKENS = int(os.getenv("LLAMA_CPP_MAX_TOKENS", "4096"))
 
+# Загружать модель в фоне при запуске бота (true/false), иначе - при первом сообщении
+LLAMA_CPP_PRELOAD = os.getenv("LLAMA_CPP_PRELOAD", "true").lower() == "true"
+
+# Закрепить веса модели в RAM (mlock), чтобы система не выгружала их в swap
+LLAMA_CPP_USE_MLOCK = os.getenv("LLAMA_CPP_USE_MLOCK", "false").lower() == "true"
+
+# ============== SUMMARY TIERS ==============
+# Как получать резюме разной длины (UserSettings.summary_length: short/medium/long)
+# derive: модель вызывается один раз для самого длинного нужного уровня,
+#         более короткие получаются экстрактивным сжатием этого резюме
+# generate: отдельный вызов модели для каждого нужного уровня
+SUMMARY_TIER_MODE = os.getenv("SUMMARY_TIER_MODE", "derive")
+
+# ============== NEAR-DUPLICATES ==============
+# Поиск почти одинаковых постов в разных каналах (SimHash): дубликат получает
+# резюме оригинала, а пользователь, уже получивший оригинал, не получает повтор
+NEAR_DUP_ENABLED = os.getenv("NEAR_DUP_ENABLED", "true").lower() == "true"
+
+# Максимальное расстояние Хэмминга между 64-битными отпечатками дубликатов
+NEAR_DUP_MAX_DISTANCE = int(os.getenv("NEAR_DUP_MAX_DISTANCE", "8"))
+
+# Окно в минутах, в течение которого пост считается оригиналом для новых дубликатов
+NEAR_DUP_WINDOW_MINUTES = int(os.getenv("NEAR_DUP_WINDOW_MINUTES", "120"))
+
+# ============== STORY CLUSTERING ==============
+# Порог косинусного сходства, при котором сообщение попадает в уже существующий сюжет
+STORY_SIMILARITY_THRESHOLD = float(os.getenv("STORY_SIMILARITY_THRESHOLD", "0.45"))
+
+# Сколько часов сюжет остаётся открытым для новых сообщений
+STORY_WINDOW_HOURS = int(os.getenv("STORY_WINDOW_HOURS", "24"))
+
+# Размерность хэшированных TF-IDF векторов
+STORY_HASH_DIM = int(os.getenv("STORY_HASH_DIM", "4096"))
+
+# ============== SUMMARY QUEUE ==============
+# Количество одновременных задач суммаризации (для одной локальной модели - 1)
+SUMMARY_QUEUE_WORKERS = int(os.getenv("SUMMARY_QUEUE_WORKERS", "1"))
+
+# Через сколько секунд после постановки в очередь задача деградирует до быстрого резюме
+SUMMARY_DEADLINE_SECONDS = int(os.getenv("SUMMARY_DEADLINE_SECONDS", "300"))
+
+# То же для запросов, которых пользователь ждёт прямо сейчас (/digest)
+SUMMARY_INTERACTIVE_DEADLINE_SECONDS = int(os.getenv("SUMMARY_INTERACTIVE_DEADLINE_SECONDS", "20"))
+
+# Насколько "свежее" (в секундах) считается пост за каждый e-кратный рост числа подписчиков
+SUMMARY_SUBSCRIBER_WEIGHT_SECONDS = int(os.getenv("SUMMARY_SUBSCRIBER_WEIGHT_SECONDS", "600"))
+
+# ============== CHUNKED SUMMARIZATION ==============
+# Максимум токенов в ответе модели на одну суммаризацию (часть бюджета контекста)
+SUMMARY_MAX_OUTPUT_TOKENS = int(os.getenv("SUMMARY_MAX_OUTPUT_TOKENS", "256"))
+
+# Размер контекста API-модели в токенах (для gpt-3.5-turbo - 16385)
+SUMMARY_API_N_CTX = int(os.getenv("SUMMARY_API_N_CTX", "16385"))
+
+# Среднее число символов на токен для оценки, когда токенизатор недоступен
+# (для русского текста ~3, для английского ~4)
+SUMMARY_CHARS_PER_TOKEN = float(os.getenv("SUMMARY_CHARS_PER_TOKEN", "3.0"))
+
+# Количество параллельных запросов при суммаризации частей длинного поста
+# (используется только для API; llama_cpp обрабатывает части последовательно)
+SUMMARIZATION_MAX_WORKERS = int(os.getenv("SUMMARIZATION_MAX_WORKERS", "4"))
+
+# Размер LRU-кэша результатов суммаризации (части, итоговые резюме)
+SUMMARY_CACHE_SIZE = int(os.getenv("SUMMARY_CACHE_SIZE", "2048"))
+
 # OpenAI API ключ для GPT-суммаризации
 # Получите: https://platform.openai.com/api-keys
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
@@ -68,12 +177,179 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
 # Gemini API ключ (альтернатива OpenAI)
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "")
 
+# Модель Gemini и размер её контекста в токенах
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-pro")
+GEMINI_N_CTX = int(os.getenv("GEMINI_N_CTX", "30720"))
+
+# ============== BACKEND ROUTER ==============
+# Используется при SUMMARIZATION_TYPE=router
+# Бэкенды в порядке предпочтения: llama_cpp, api (OpenAI), gemini, extractive
+SUMMARY_BACKENDS = [b.strip() for b in os.getenv("SUMMARY_BACKENDS", "llama_cpp,api,gemini,extractive").split(",") if b.strip()]
+
+# Бюджет времени на одну суммаризацию в секундах: бэкенд, чья задержка (p95)
+# не укладывается в остаток бюджета, пропускается
+SUMMARY_LATENCY_BUDGET_SECONDS = float(os.getenv("SUMMARY_LATENCY_BUDGET_SECONDS", "30"))
+
+# Сколько ошибок подряд размыкает предохранитель бэкенда
+SUMMARY_BREAKER_FAILURE_THRESHOLD = int(os.getenv("SUMMARY_BREAKER_FAILURE_THRESHOLD", "3"))
+
+# Сколько секунд бэкенд пропускается после срабатывания предохранителя
+SUMMARY_BREAKER_COOLDOWN_SECONDS = float(os.getenv("SUMMARY_BREAKER_COOLDOWN_SECONDS", "60"))
+
+# ============== METRICS ==============
+# Метрики Prometheus на http://METRICS_LISTEN:METRICS_PORT/metrics
+# 0 - выключить; при нескольких процессах (--role) у каждого свой порт
+METRICS_LISTEN = os.getenv("METRICS_LISTEN", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
+
+# ============== PROFILING ==============
+# Профилирование (выключено по умолчанию): медленные запросы, фазы цикла и
+# обработчики, сэмплы стека event loop и его блокировки
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+
+# Запросы дольше этого времени логируются с параметрами (миллисекунды)
+PROFILING_SLOW_QUERY_MS = float(os.getenv("PROFILING_SLOW_QUERY_MS", "100"))
+
+# Период сэмплирования стека event loop (миллисекунды)
+PROFILING_SAMPLE_MS = float(os.getenv("PROFILING_SAMPLE_MS", "20"))
+
+# Блокировка event loop дольше этого времени логируется со стеком (миллисекунды)
+PROFILING_LOOP_LAG_MS = float(os.getenv("PROFILING_LOOP_LAG_MS", "200"))
+
+# Как часто писать отчёт с худшими запросами и фазами (секунды)
+PROFILING_REPORT_SECONDS = float(os.getenv("PROFILING_REPORT_SECONDS", "300"))
+
+# Файл отчётов (ротируется); пусто - писать в обычный лог
+PROFILING_LOG_FILE = os.getenv("PROFILING_LOG_FILE", "profiling.log")
+PROFILING_LOG_MAX_BYTES = int(os.getenv("PROFILING_LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+
+# ============== USER CACHE ==============
+# Сколько пользователей (с настройками и подписками) держать в памяти
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+
+# Срок жизни записи кэша в процессах scraper (изменения делает процесс bot)
+USER_CACHE_TTL_SECONDS = float(os.getenv("USER_CACHE_TTL_SECONDS", "60"))
+
+# ============== MESSAGE FILTERS ==============
+# Сколько фильтров (/filter) может быть у одного пользователя
+MESSAGE_FILTERS_PER_USER = int(os.getenv("MESSAGE_FILTERS_PER_USER", "50"))
+
+# Максимальная длина слова или регулярного выражения в фильтре
+MESSAGE_FILTER_MAX_LENGTH = int(os.getenv("MESSAGE_FILTER_MAX_LENGTH", "200"))
+
+# Регулярные выражения проверяются в отдельном процессе; если проверка постов
+# одного канала дольше этого (секунды), процесс убивается, а медленное выражение
+# отключается до перезапуска (в базе оно остаётся)
+MESSAGE_FILTER_REGEX_TIMEOUT_SECONDS = float(os.getenv("MESSAGE_FILTER_REGEX_TIMEOUT_SECONDS", "1"))
+
+# ============== CHANNEL LIST ==============
+# Сколько секунд /all_channels использует сохранённый список каналов без запроса get_dialogs
+CHANNEL_LIST_TTL_SECONDS = int(os.getenv("CHANNEL_LIST_TTL_SECONDS", "300"))
+
+# ============== DELIVERY ==============
+# Глобальный лимит отправки сообщений ботом (Telegram: ~30 сообщений в секунду)
+DELIVERY_GLOBAL_RATE = float(os.getenv("DELIVERY_GLOBAL_RATE", "25"))
+
+# Минимальный интервал между сообщениями в один чат в секундах (Telegram: ~1 в секунду)
+DELIVERY_PER_CHAT_INTERVAL = float(os.getenv("DELIVERY_PER_CHAT_INTERVAL", "1.0"))
+
+# Сколько отправок может выполняться одновременно
+DELIVERY_MAX_IN_FLIGHT = int(os.getenv("DELIVERY_MAX_IN_FLIGHT", "30"))
+
+# Сколько раз повторять отправку при сетевых ошибках
+DELIVERY_MAX_ATTEMPTS = int(os.getenv("DELIVERY_MAX_ATTEMPTS", "5"))
+
+# Окно объединения уведомлений в секундах: новые суммаризации для пользователя
+# копятся и отправляются одним сообщением (0 - отправлять каждое сразу)
+NOTIFY_COALESCE_WINDOW_SECONDS = float(os.getenv("NOTIFY_COALESCE_WINDOW_SECONDS", "30"))
+
+# Сколько уведомлений максимум копить до досрочной отправки
+NOTIFY_COALESCE_MAX_ITEMS = int(os.getenv("NOTIFY_COALESCE_MAX_ITEMS", "10"))
+
+# Сколько секунд при остановке отправлять накопленные уведомления
+DELIVERY_DRAIN_SECONDS = float(os.getenv("DELIVERY_DRAIN_SECONDS", "15"))
+
+# ============== OUTBOX ==============
+# Сколько уведомлений забирать из outbox за один запрос
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "100"))
+
+# Как часто проверять outbox, если нет новых суммаризаций (секунды)
+OUTBOX_POLL_SECONDS = float(os.getenv("OUTBOX_POLL_SECONDS", "5"))
+
+# Попыток отправки до пометки уведомления как failed
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+
+# Экспоненциальная пауза между попытками: база и максимум (секунды)
+OUTBOX_RETRY_BASE_SECONDS = float(os.getenv("OUTBOX_RETRY_BASE_SECONDS", "5"))
+OUTBOX_RETRY_MAX_SECONDS = float(os.getenv("OUTBOX_RETRY_MAX_SECONDS", "900"))
+
+# Через сколько секунд забранное, но не отправленное уведомление забирается снова
+OUTBOX_CLAIM_TIMEOUT_SECONDS = float(os.getenv("OUTBOX_CLAIM_TIMEOUT_SECONDS", "300"))
+
+# Максимум уведомлений в отправке одновременно
+OUTBOX_MAX_IN_FLIGHT = int(os.getenv("OUTBOX_MAX_IN_FLIGHT", "500"))
+
+# ============== DAILY DIGEST ==============
+# Часовой пояс по умолчанию для времени уведомлений (IANA, например Europe/Moscow)
+DEFAULT_TIMEZONE = os.getenv("DEFAULT_TIMEZONE", "Europe/Moscow")
+
+# Сколько пользователей обрабатывать за один проход планировщика дайджестов
+DIGEST_BATCH_SIZE = int(os.getenv("DIGEST_BATCH_SIZE", "200"))
+
+# Максимальное количество сюжетов в ежедневном дайджесте
+DIGEST_MAX_STORIES = int(os.getenv("DIGEST_MAX_STORIES", "15"))
+
+# За сколько часов брать сообщения, если дайджест ещё не отправлялся
+DIGEST_LOOKBACK_HOURS = int(os.getenv("DIGEST_LOOKBACK_HOURS", "24"))
+
 # ============== SCHEDULER ==============
 # Интервал проверки новых сообщений в секундах
 # Рекомендуемое значение: 30-300 секунд
 # Слишком частые проверки могут привести к блокировке Telegram
 CHECK_INTERVAL_SECONDS = int(os.getenv("CHECK_INTERVAL_SECONDS", "10"))
 
+# Проверки идут с фиксированной частотой, не сдвигаясь на длительность цикла
+# Если цикл дольше интервала: skip - пропустить опоздавшие запуски,
+# coalesce - выполнить один запуск сразу за все пропущенные
+SCHEDULER_MISSED_TICKS = os.getenv("SCHEDULER_MISSED_TICKS", "skip")
+
+# Каналы опрашиваются не одновременно, а с постоянным сдвигом внутри этого окна
+# (секунды, не больше половины CHECK_INTERVAL_SECONDS)
+SCHEDULER_JITTER_SECONDS = float(os.getenv("SCHEDULER_JITTER_SECONDS", "30"))
+
+# Сколько секунд при остановке ждать завершения текущего цикла и конвейера
+SCHEDULER_DRAIN_SECONDS = float(os.getenv("SCHEDULER_DRAIN_SECONDS", "30"))
+
+# Конвейер сбор → сохранение → суммаризация (отправкой занимается outbox)
+# Размер очереди перед каждой стадией: когда она заполнена, предыдущая стадия ждёт
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "100"))
+
+# Количество обработчиков каждой стадии
+PIPELINE_FETCH_WORKERS = int(os.getenv("PIPELINE_FETCH_WORKERS", "4"))
+PIPELINE_STORE_WORKERS = int(os.getenv("PIPELINE_STORE_WORKERS", "1"))
+PIPELINE_SUMMARIZE_WORKERS = int(os.getenv("PIPELINE_SUMMARIZE_WORKERS", "8"))
+
+# ============== PROCESS ROLES ==============
+# Роль процесса (или аргумент --role):
+# all - всё в одном процессе; bot - бот, отправка и дайджесты;
+# scraper - планировщик (по аренде) и сбор каналов; summarizer - суммаризация
+ROLE = os.getenv("ROLE", "all")
+
+# Процессы scraper/summarizer/bot общаются через таблицу заданий в общей БД
+# Как часто проверять новые задания (секунды)
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "2"))
+
+# Через сколько секунд задание упавшего обработчика забирается снова
+JOB_CLAIM_TIMEOUT_SECONDS = float(os.getenv("JOB_CLAIM_TIMEOUT_SECONDS", "600"))
+
+# Попыток до пометки задания как failed и пауза между ними (база и максимум)
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+JOB_RETRY_BASE_SECONDS = float(os.getenv("JOB_RETRY_BASE_SECONDS", "10"))
+JOB_RETRY_MAX_SECONDS = float(os.getenv("JOB_RETRY_MAX_SECONDS", "600"))
+
+# Срок аренды планировщика: если держатель не продлил её, планирует другой scraper
+SCHEDULER_LEASE_SECONDS = float(os.getenv("SCHEDULER_LEASE_SECONDS", "60"))
+
 # Список каналов для автоматической подписки при первом запуске
 # Разделяйте запятыми: "channel1,channel2,channel3"
 DEFAULT_CHANNELS = os.getenv("DEFAULT_CHANNELS", "").split(",")
\ No newline at end of file
@@ -1,10 +1,11 @@
 """
 Database models and session management for Telegram Aggregator Bot
 """
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, Boolean, ForeignKey
+from sqlalchemy import create_engine, event, inspect, text, Column, BigInteger, Integer, String, Text, DateTime, Boolean, ForeignKey, Index, UniqueConstraint
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 from datetime import datetime, timezone
+import time
 
 from config import DATABASE_URL
 
@@ -56,8 +57,106 @@ class ScrapedMessage(Base):
     timestamp = Column(DateTime)
     processed_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
     is_summarized = Column(Boolean, default=False)
+    # Signed 64-bit fingerprint (dedup.to_signed)
+    simhash = Column(BigInteger, nullable=True)
+    duplicate_of = Column(Integer, ForeignKey("scraped_messages.id"), nullable=True, index=True)
     
     subscription = relationship("Subscription", back_populates="messages")
+    summaries = relationship("MessageSummary", back_populates="message")
+
+
+class MessageSummary(Base):
+    """Summary of one message at one length tier (short/medium/long)"""
+    __tablename__ = "message_summaries"
+    __table_args__ = (UniqueConstraint("scraped_message_id", "tier"),)
+    
+    id = Column(Integer, primary_key=True, index=True)
+    scraped_message_id = Column(Integer, ForeignKey("scraped_messages.id"), index=True)
+    tier = Column(String)
+    text = Column(Text)
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    
+    message = relationship("ScrapedMessage", back_populates="summaries")
+
+
+class OutboxEntry(Base):
+    """
+    Pending notification of one user about one message
+
+    Written in the same transaction as the message itself, drained by the
+    outbox worker. The idempotency key makes a user get a story only once.
+    """
+    __tablename__ = "outbox"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    idempotency_key = Column(String, unique=True)
+    scraped_message_id = Column(Integer, ForeignKey("scraped_messages.id"), index=True)
+    telegram_id = Column(Integer)
+    channel_title = Column(String)
+    tier = Column(String)
+    link = Column(String)
+    status = Column(String, default="pending", index=True)
+    attempts = Column(Integer, default=0)
+    next_attempt_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    claim_token = Column(String, nullable=True, index=True)
+    claimed_at = Column(DateTime, nullable=True)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    sent_at = Column(DateTime, nullable=True)
+
+
+class Job(Base):
+    """
+    Unit of work handed between processes (fetch a channel, summarize a post)
+
+    Claimed by workers the same way as outbox entries; finished jobs are
+    deleted, failed ones stay for inspection. At most one pending or running
+    job per key, enforced by a partial unique index.
+    """
+    __tablename__ = "jobs"
+    __table_args__ = (
+        Index(
+            "ux_jobs_active_key", "key", unique=True,
+            sqlite_where=text("status IN ('pending', 'running')"),
+            postgresql_where=text("status IN ('pending', 'running')")
+        ),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String, index=True)
+    key = Column(String, nullable=True, index=True)
+    payload = Column(Text)
+    status = Column(String, default="pending", index=True)
+    attempts = Column(Integer, default=0)
+    run_after = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    claim_token = Column(String, nullable=True, index=True)
+    claimed_by = Column(String, nullable=True)
+    claimed_at = Column(DateTime, nullable=True)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+
+
+class Lease(Base):
+    """Named lock held by one process until it expires or is renewed"""
+    __tablename__ = "leases"
+
+    name = Column(String, primary_key=True)
+    holder = Column(String)
+    expires_at = Column(DateTime)
+
+
+class UserFilter(Base):
+    """Keyword or regex a user's notifications are limited by (include) or hidden by (exclude)"""
+    __tablename__ = "user_filters"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    kind = Column(String)
+    pattern_type = Column(String)
+    pattern = Column(String)
+    # None applies to every channel
+    channel_id = Column(String, nullable=True)
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
 
 
 class UserSettings(Base):
@@ -69,6 +168,8 @@ class UserSettings(Base):
     include_media = Column(Boolean, default=False)
     notification_time = Column(String, default="09:00")
     daily_digest = Column(Boolean, default=True)
+    timezone = Column(String, nullable=True)
+    last_digest_at = Column(DateTime, nullable=True)
     
     user = relationship("User", back_populates="settings")
 
@@ -76,6 +177,58 @@ class UserSettings(Base):
 def init_db():
     """Initialize database tables"""
     Base.metadata.create_all(bind=engine)
+    _add_missing_columns()
+
+
+def _add_missing_columns():
+    """Add columns (and their indexes) that were introduced after a table was created"""
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column['name']: column['type'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    _widen_to_bigint(conn, table.name, column, existing[column.name])
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+            existing_indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    index.create(conn, checkfirst=True)
+
+
+def _widen_to_bigint(conn, table_name: str, column, existing_type):
+    """Turn an INTEGER column declared BigInteger since into BIGINT (SQLite integers are 64-bit already)"""
+    if engine.dialect.name == "sqlite" or not isinstance(column.type, BigInteger):
+        return
+    if isinstance(existing_type, BigInteger) or not isinstance(existing_type, Integer):
+        return
+    conn.execute(text(f'ALTER TABLE {table_name} ALTER COLUMN {column.name} TYPE BIGINT'))
+
+
+def add_query_listener(listener):
+    """
+    Call listener(statement, parameters, seconds) after every SQL statement
+
+    Nothing is hooked until the first listener is added (see profiling.py).
+    """
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info['query_started'].pop()
+        listener(statement, parameters, time.perf_counter() - started)
+
+    @event.listens_for(engine, "handle_error")
+    def _handle_error(context):
+        # A failed statement never reaches after_cursor_execute
+        if context.connection is not None and context.connection.info.get('query_started'):
+            context.connection.info['query_started'].pop()
 
 
 def get_db():
@@ -0,0 +1,188 @@
+"""
+Cross-channel near-duplicate detection with SimHash
+
+Channels often repost the same news within minutes with slightly different
+wording. Every incoming post gets a 64-bit SimHash fingerprint over its
+stemmed words and word pairs; fingerprints within a small Hamming distance
+are treated as the same story. The in-memory index only covers a sliding
+time window and uses the pigeonhole banding trick: with distance at most k,
+two fingerprints split into k + 1 bands share at least one band exactly,
+so lookups touch only a handful of candidates.
+"""
+import hashlib
+import logging
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Set
+
+import numpy as np
+
+from config import NEAR_DUP_MAX_DISTANCE, NEAR_DUP_WINDOW_MINUTES
+from extractive import tokenize
+
+logger = logging.getLogger(__name__)
+
+FINGERPRINT_BITS = 64
+# Posts with fewer features than this produce unstable fingerprints
+MIN_FEATURES = 6
+
+
+def _feature_hash(feature: str) -> int:
+    return int.from_bytes(hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def simhash(text: str) -> Optional[int]:
+    """
+    Compute a 64-bit SimHash of text
+
+    Features are stemmed words and adjacent word pairs, so reordering and
+    small edits move only a few bits.
+
+    Returns:
+        Unsigned fingerprint, or None for texts too short to fingerprint
+    """
+    tokens = tokenize(text or "")
+    features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+    if len(features) < MIN_FEATURES:
+        return None
+
+    hashes = np.fromiter((_feature_hash(f) for f in features), dtype='<u8', count=len(features))
+    bits = np.unpackbits(hashes.view(np.uint8).reshape(-1, 8), axis=1, bitorder='little')
+    votes = (bits.astype(np.int32) * 2 - 1).sum(axis=0)
+    packed = np.packbits(votes > 0, bitorder='little')
+    return int.from_bytes(packed.tobytes(), 'little')
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+
+def to_signed(fingerprint: int) -> int:
+    """Convert an unsigned fingerprint for storage in a signed 64-bit column"""
+    return fingerprint - (1 << 64) if fingerprint >= (1 << 63) else fingerprint
+
+
+def to_unsigned(value: int) -> int:
+    return value + (1 << 64) if value < 0 else value
+
+
+@dataclass
+class IndexedPost:
+    """A fingerprinted post inside the sliding window"""
+    fingerprint: int
+    # ScrapedMessage primary key, not the Telegram message id
+    post_id: int
+    channel_id: str
+    channel_title: str
+    seen_at: datetime
+    notified_users: Set[int] = field(default_factory=set)
+
+
+class NearDuplicateIndex:
+    """In-memory SimHash index over a sliding time window"""
+
+    def __init__(self, max_distance: int = NEAR_DUP_MAX_DISTANCE, window_minutes: int = NEAR_DUP_WINDOW_MINUTES):
+        self.max_distance = max_distance
+        self.window = timedelta(minutes=window_minutes)
+        band_count = max_distance + 1
+        width = FINGERPRINT_BITS // band_count
+        # The last band absorbs the remainder bits
+        self._bands = [
+            (i * width, FINGERPRINT_BITS - i * width if i == band_count - 1 else width)
+            for i in range(band_count)
+        ]
+        self._tables: List[Dict[int, List[IndexedPost]]] = [{} for _ in self._bands]
+        self._window: deque = deque()
+        self._by_post: Dict[int, IndexedPost] = {}
+        self.lookups = 0
+        self.duplicates = 0
+
+    def __len__(self):
+        return len(self._window)
+
+    def _band_keys(self, fingerprint: int):
+        for offset, width in self._bands:
+            yield (fingerprint >> offset) & ((1 << width) - 1)
+
+    def _evict(self, now: datetime):
+        cutoff = now - self.window
+        while self._window and self._window[0].seen_at < cutoff:
+            post = self._window.popleft()
+            self._by_post.pop(post.post_id, None)
+            for table, key in zip(self._tables, self._band_keys(post.fingerprint)):
+                bucket = table.get(key)
+                if bucket is None:
+                    continue
+                try:
+                    bucket.remove(post)
+                except ValueError:
+                    pass
+                if not bucket:
+                    del table[key]
+
+    def find(self, fingerprint: Optional[int], now: Optional[datetime] = None) -> Optional[IndexedPost]:
+        """Return the closest indexed post within max_distance, if any"""
+        if fingerprint is None:
+            return None
+        self._evict(now or datetime.now(timezone.utc))
+        self.lookups += 1
+
+        best = None
+        best_distance = self.max_distance + 1
+        for table, key in zip(self._tables, self._band_keys(fingerprint)):
+            for post in table.get(key, ()):
+                distance = hamming_distance(fingerprint, post.fingerprint)
+                if distance < best_distance:
+                    best, best_distance = post, distance
+        if best is not None:
+            self.duplicates += 1
+        return best
+
+    def add(
+        self,
+        fingerprint: Optional[int],
+        post_id: int,
+        channel_id: str,
+        channel_title: str,
+        seen_at: Optional[datetime] = None
+    ) -> Optional[IndexedPost]:
+        """Index an original post; returns the entry so notified users can be recorded"""
+        if fingerprint is None:
+            return None
+        post = IndexedPost(
+            fingerprint=fingerprint,
+            post_id=post_id,
+            channel_id=channel_id,
+            channel_title=channel_title,
+            seen_at=seen_at or datetime.now(timezone.utc)
+        )
+        self._window.append(post)
+        self._by_post[post_id] = post
+        for table, key in zip(self._tables, self._band_keys(fingerprint)):
+            table.setdefault(key, []).append(post)
+        return post
+
+    def get(self, post_id: int) -> Optional[IndexedPost]:
+        return self._by_post.get(post_id)
+
+    def warm(self, db, now: Optional[datetime] = None):
+        """Rebuild the window from stored fingerprints after a restart"""
+        from database import ScrapedMessage
+
+        now = now or datetime.now(timezone.utc)
+        rows = db.query(ScrapedMessage).filter(
+            ScrapedMessage.simhash.isnot(None),
+            ScrapedMessage.duplicate_of.is_(None),
+            ScrapedMessage.processed_at >= now - self.window
+        ).order_by(ScrapedMessage.processed_at).all()
+
+        for row in rows:
+            seen_at = row.processed_at
+            if seen_at.tzinfo is None:
+                seen_at = seen_at.replace(tzinfo=timezone.utc)
+            self.add(to_unsigned(row.simhash), row.id, row.channel_id, row.channel_title, seen_at)
+        logger.info(f"Near-duplicate index warmed with {len(rows)} posts")
+
+
+near_duplicate_index = NearDuplicateIndex()
@@ -0,0 +1,448 @@
+"""
+Outgoing message dispatcher respecting Telegram rate limits
+
+All bot messages go through one dispatcher instead of calling
+bot.send_message directly:
+
+- a global token bucket keeps the bot under ~30 messages per second
+- each chat gets at most one message per DELIVERY_PER_CHAT_INTERVAL seconds
+- priority lanes: command replies go ahead of digests, digests ahead of pushes
+- RetryAfter errors requeue the message at the head of its chat and delay
+  that chat for the requested time, so nothing is dropped
+- transient network errors are retried with backoff
+
+Push notifications can additionally be coalesced per user: summaries that
+arrive within NOTIFY_COALESCE_WINDOW_SECONDS are sent as one message, split
+at Telegram's 4096 character limit.
+
+Messages for one chat are delivered in order; different chats proceed in
+parallel, so a rate-limited chat never blocks the others.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TimedOut
+
+from config import (
+    DELIVERY_GLOBAL_RATE, DELIVERY_PER_CHAT_INTERVAL,
+    DELIVERY_MAX_IN_FLIGHT, DELIVERY_MAX_ATTEMPTS,
+    NOTIFY_COALESCE_WINDOW_SECONDS, NOTIFY_COALESCE_MAX_ITEMS
+)
+from metrics import REGISTRY, QUEUE_DEPTH, SEND_SECONDS, SENDS, RETRY_AFTER
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_REPLY = 0
+PRIORITY_DIGEST = 1
+PRIORITY_PUSH = 2
+
+# Telegram limit for the text of one message
+MAX_MESSAGE_LENGTH = 4096
+
+
+class TokenBucket:
+    """Classic token bucket refilled continuously at `rate` tokens per second"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self) -> float:
+        """Seconds until one token is available (0 if available now)"""
+        self._refill()
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self._refill()
+        self.tokens -= 1
+
+    def drain(self):
+        self._refill()
+        self.tokens = min(self.tokens, 0.0)
+
+
+@dataclass
+class OutgoingMessage:
+    chat_id: int
+    text: str
+    priority: int
+    kwargs: Dict[str, Any]
+    future: Optional[asyncio.Future]
+    seq: int
+    attempts: int = 0
+    created_at: float = field(default_factory=time.monotonic)
+
+
+class ChatQueue:
+    """Pending messages of one chat and its own rate limit state"""
+
+    def __init__(self, chat_id: int):
+        self.chat_id = chat_id
+        self.messages = []
+        self.ready_at = 0.0
+        self.in_flight = False
+
+    def head_key(self):
+        priority, seq, _ = self.messages[0]
+        return priority, seq
+
+    def push(self, message: OutgoingMessage):
+        heapq.heappush(self.messages, (message.priority, message.seq, message))
+
+    def pop(self) -> OutgoingMessage:
+        return heapq.heappop(self.messages)[2]
+
+
+class DeliveryDispatcher:
+    """Rate-limited, prioritized, retrying sender of bot messages"""
+
+    def __init__(
+        self,
+        global_rate: float = DELIVERY_GLOBAL_RATE,
+        per_chat_interval: float = DELIVERY_PER_CHAT_INTERVAL,
+        max_in_flight: int = DELIVERY_MAX_IN_FLIGHT
+    ):
+        self.bucket = TokenBucket(global_rate)
+        self.per_chat_interval = per_chat_interval
+        self.max_in_flight = max_in_flight
+        self.bot = None
+        self._seq = itertools.count()
+        self._chats: Dict[int, ChatQueue] = {}
+        self._ready = []
+        self._waiting = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._task: Optional[asyncio.Task] = None
+        self.sent = 0
+        self.retried = 0
+        self.dropped = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self, bot):
+        """Start dispatching in the running event loop"""
+        self.bot = bot
+        if self.running:
+            return
+        self._wakeup = asyncio.Event()
+        self._slots = asyncio.Semaphore(self.max_in_flight)
+        self._task = asyncio.create_task(self._run())
+        logger.info("Delivery dispatcher started")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def depth(self) -> int:
+        return sum(len(chat.messages) for chat in self._chats.values())
+
+    async def send_message(self, chat_id: int, text: str, priority: int = PRIORITY_PUSH, wait: bool = False, **kwargs):
+        """
+        Queue a message for delivery
+
+        Args:
+            chat_id: Recipient chat
+            text: Message text
+            priority: PRIORITY_REPLY, PRIORITY_DIGEST or PRIORITY_PUSH
+            wait: Wait until the message is actually sent and return it
+            **kwargs: Extra arguments for bot.send_message (reply_markup, ...)
+
+        Returns:
+            The sent telegram Message if wait is True, otherwise None
+        """
+        if not self.running:
+            if self.bot is None:
+                raise RuntimeError("Delivery dispatcher is not started")
+            # Dispatcher stopped (e.g. during shutdown): send directly
+            return await self.bot.send_message(chat_id=chat_id, text=text, **kwargs)
+
+        future = asyncio.get_running_loop().create_future() if wait else None
+        message = OutgoingMessage(chat_id, text, priority, kwargs, future, next(self._seq))
+        self._enqueue(message)
+        if future is not None:
+            return await future
+        return None
+
+    def _enqueue(self, message: OutgoingMessage):
+        chat = self._chats.get(message.chat_id)
+        if chat is None:
+            chat = self._chats[message.chat_id] = ChatQueue(message.chat_id)
+        chat.push(message)
+        if not chat.in_flight:
+            # The head may have changed; outdated heap entries are skipped on pop
+            self._schedule(chat)
+        self._wakeup.set()
+
+    def _schedule(self, chat: ChatQueue):
+        """Put a chat with pending messages into the ready or waiting heap"""
+        if chat.ready_at <= time.monotonic():
+            heapq.heappush(self._ready, (*chat.head_key(), chat.chat_id))
+        else:
+            heapq.heappush(self._waiting, (chat.ready_at, chat.chat_id))
+
+    def _next_ready_chat(self) -> Optional[ChatQueue]:
+        now = time.monotonic()
+        while self._waiting and self._waiting[0][0] <= now:
+            _, chat_id = heapq.heappop(self._waiting)
+            chat = self._chats.get(chat_id)
+            if chat and chat.messages and not chat.in_flight:
+                heapq.heappush(self._ready, (*chat.head_key(), chat_id))
+
+        while self._ready:
+            priority, seq, chat_id = heapq.heappop(self._ready)
+            chat = self._chats.get(chat_id)
+            # Skip stale entries: chat busy, emptied, or re-scheduled with another head
+            if not chat or chat.in_flight or not chat.messages or chat.head_key() != (priority, seq):
+                continue
+            if chat.ready_at > now:
+                heapq.heappush(self._waiting, (chat.ready_at, chat_id))
+                continue
+            return chat
+        return None
+
+    async def _run(self):
+        while True:
+            chat = self._next_ready_chat()
+            if chat is None:
+                self._prune_idle_chats()
+                timeout = self._waiting[0][0] - time.monotonic() if self._waiting else None
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            delay = self.bucket.delay()
+            if delay > 0:
+                # Put the chat back and wait for a global token
+                heapq.heappush(self._ready, (*chat.head_key(), chat.chat_id))
+                await asyncio.sleep(delay)
+                continue
+
+            await self._slots.acquire()
+            self.bucket.take()
+            chat.in_flight = True
+            message = chat.pop()
+            asyncio.create_task(self._deliver(chat, message))
+
+    async def _deliver(self, chat: ChatQueue, message: OutgoingMessage):
+        retry_delay = None
+        try:
+            message.attempts += 1
+            with SEND_SECONDS.time():
+                result = await self.bot.send_message(chat_id=message.chat_id, text=message.text, **message.kwargs)
+            self.sent += 1
+            SENDS.labels("sent").inc()
+            if message.future and not message.future.done():
+                message.future.set_result(result)
+        except RetryAfter as e:
+            retry_delay = _seconds(e.retry_after)
+            RETRY_AFTER.inc()
+            logger.warning(f"RetryAfter {retry_delay}s for chat {message.chat_id}, requeueing")
+            # Telegram asks to slow down: stop spending global tokens for a moment too
+            self.bucket.drain()
+        except (Forbidden, BadRequest) as e:
+            # Blocked bot or malformed message: retrying will not help
+            self._drop(message, e)
+        except (TimedOut, NetworkError) as e:
+            if message.attempts < DELIVERY_MAX_ATTEMPTS:
+                retry_delay = min(2 ** message.attempts, 60)
+                logger.warning(f"Network error sending to {message.chat_id}: {e}, retry in {retry_delay}s")
+            else:
+                self._drop(message, e)
+        except Exception as e:
+            self._drop(message, e)
+        finally:
+            now = time.monotonic()
+            chat.ready_at = now + max(self.per_chat_interval, retry_delay or 0)
+            if retry_delay is not None:
+                # Same sequence number: it stays ahead of later messages to this chat
+                self.retried += 1
+                SENDS.labels("retried").inc()
+                chat.push(message)
+            chat.in_flight = False
+            if chat.messages:
+                self._schedule(chat)
+            self._slots.release()
+            self._wakeup.set()
+
+    def _prune_idle_chats(self):
+        """Forget chats with nothing pending whose rate limit has already expired"""
+        now = time.monotonic()
+        idle = [
+            chat_id for chat_id, chat in self._chats.items()
+            if not chat.messages and not chat.in_flight and chat.ready_at <= now
+        ]
+        for chat_id in idle:
+            del self._chats[chat_id]
+
+    def _drop(self, message: OutgoingMessage, error: Exception):
+        self.dropped += 1
+        SENDS.labels("dropped").inc()
+        logger.error(f"Dropping message to {message.chat_id} after {message.attempts} attempt(s): {error}")
+        if message.future and not message.future.done():
+            message.future.set_exception(error)
+
+
+def split_message(parts: List[str], header: str = "", limit: int = MAX_MESSAGE_LENGTH) -> List[str]:
+    """
+    Join parts into as few messages as possible, each at most `limit` characters
+
+    Parts are never split unless a single part is longer than the limit.
+    The header is folded into the first part, so it never goes out alone.
+    """
+    separator = "\n\n"
+    if not parts:
+        return [header] if header else []
+    messages = []
+    current = ""
+    for index, part in enumerate(parts):
+        if index == 0 and header:
+            part = f"{header}{separator}{part}"
+        while len(part) > limit:
+            if current:
+                messages.append(current)
+                current = ""
+            messages.append(part[:limit])
+            part = part[limit:]
+        candidate = f"{current}{separator}{part}" if current else part
+        if len(candidate) > limit:
+            messages.append(current)
+            candidate = part
+        current = candidate
+    if current:
+        messages.append(current)
+    return messages
+
+
+class NotificationCoalescer:
+    """
+    Buffers push notifications per user and sends them as combined messages
+
+    A user's buffer is flushed when the window since its first item expires
+    or when it reaches max_items, so latency stays bounded by the window.
+    """
+
+    def __init__(
+        self,
+        dispatcher: DeliveryDispatcher,
+        window_seconds: float = NOTIFY_COALESCE_WINDOW_SECONDS,
+        max_items: int = NOTIFY_COALESCE_MAX_ITEMS
+    ):
+        self.dispatcher = dispatcher
+        self.window_seconds = window_seconds
+        self.max_items = max_items
+        self._buffers: Dict[int, List[str]] = {}
+        self._timers: Dict[int, asyncio.Task] = {}
+        self.items = 0
+        self.messages = 0
+
+    async def add(self, chat_id: int, text: str, wait: bool = False):
+        """
+        Queue a notification for a user
+
+        Args:
+            chat_id: Recipient chat
+            text: Notification text
+            wait: Return only once the message containing it was sent (raises if it failed)
+        """
+        self.items += 1
+        if self.window_seconds <= 0:
+            self.messages += 1
+            await self.dispatcher.send_message(chat_id, text, priority=PRIORITY_PUSH, wait=wait)
+            return
+
+        future = asyncio.get_running_loop().create_future() if wait else None
+        buffer = self._buffers.setdefault(chat_id, [])
+        buffer.append((text, future))
+        if len(buffer) >= self.max_items:
+            timer = self._timers.pop(chat_id, None)
+            if timer:
+                timer.cancel()
+            await self._flush(chat_id)
+        elif chat_id not in self._timers:
+            self._timers[chat_id] = asyncio.create_task(self._flush_later(chat_id))
+
+        if future is not None:
+            await future
+
+    async def _flush_later(self, chat_id: int):
+        await asyncio.sleep(self.window_seconds)
+        self._timers.pop(chat_id, None)
+        await self._flush(chat_id)
+
+    async def _flush(self, chat_id: int):
+        entries = self._buffers.pop(chat_id, [])
+        if not entries:
+            return
+        parts = [text for text, _ in entries]
+        futures = [future for _, future in entries if future is not None]
+        if len(parts) == 1:
+            texts = split_message(parts)
+        else:
+            texts = split_message([part.strip() for part in parts], header=f"🔔 Новых сообщений: {len(parts)}")
+
+        try:
+            for text in texts:
+                self.messages += 1
+                await self.dispatcher.send_message(chat_id, text, priority=PRIORITY_PUSH, wait=bool(futures))
+        except Exception as e:
+            logger.error(f"Error sending notifications to {chat_id}: {e}")
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for future in futures:
+            if not future.done():
+                future.set_result(None)
+
+    async def flush_all(self, timeout: Optional[float] = None):
+        """
+        Send everything buffered right away (e.g. before shutdown)
+
+        Chats are flushed concurrently; with a timeout, whatever has not been
+        handed to the dispatcher by then stays unsent.
+        """
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers.clear()
+        if not self._buffers:
+            return
+        flushes = asyncio.gather(*(self._flush(chat_id) for chat_id in list(self._buffers)))
+        try:
+            await asyncio.wait_for(flushes, timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Buffered notifications not sent within {timeout}s")
+
+
+def _seconds(value) -> float:
+    return value.total_seconds() if hasattr(value, 'total_seconds') else float(value)
+
+
+delivery_dispatcher = DeliveryDispatcher()
+notification_coalescer = NotificationCoalescer(delivery_dispatcher)
+
+
+def _collect_metrics():
+    QUEUE_DEPTH.labels("delivery").set(delivery_dispatcher.depth())
+    QUEUE_DEPTH.labels("coalescer").set(sum(len(items) for items in notification_coalescer._buffers.values()))
+
+
+REGISTRY.on_collect(_collect_metrics)
@@ -0,0 +1,289 @@
+"""
+Scheduled daily digests
+
+Users with UserSettings.daily_digest enabled get a digest of the stored
+summaries of their channels every day at UserSettings.notification_time in
+their timezone.
+
+The scheduler keeps a heap of (next digest time, user) and sleeps until
+the earliest entry is due, so it never scans all users. Changed settings
+push a new entry; outdated entries are recognized by their generation and
+skipped. Due users are handled in batches: each batch builds its digests
+with a fixed number of queries, and the next batch waits until the
+delivery queue has drained, so thousands of users sharing a 09:00 slot are
+spread across the delivery rate limit instead of piling up in memory.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from database import SessionLocal, User, UserSettings, Subscription, ScrapedMessage, MessageSummary
+from config import DEFAULT_TIMEZONE, DIGEST_BATCH_SIZE, DIGEST_MAX_STORIES, DIGEST_LOOKBACK_HOURS
+from summarizer import normalize_tier, TIER_LIMITS
+from clustering import story_clusterer
+from delivery import delivery_dispatcher, split_message, PRIORITY_DIGEST
+
+logger = logging.getLogger(__name__)
+
+# A batch that failed (e.g. the database was locked) is tried again after this
+DIGEST_RETRY_SECONDS = 60
+
+
+def get_timezone(name: Optional[str]):
+    """ZoneInfo for a timezone name, falling back to DEFAULT_TIMEZONE and then UTC"""
+    for candidate in (name, DEFAULT_TIMEZONE):
+        if not candidate:
+            continue
+        try:
+            return ZoneInfo(candidate)
+        except (ZoneInfoNotFoundError, ValueError):
+            logger.warning(f"Unknown timezone: {candidate}")
+    return timezone.utc
+
+
+def next_digest_time(notification_time: Optional[str], tz_name: Optional[str], now: Optional[datetime] = None) -> datetime:
+    """
+    Next moment (in UTC) when the local clock shows notification_time
+
+    Args:
+        notification_time: Local time as HH:MM
+        tz_name: IANA timezone name of the user
+        now: Current time, defaults to now
+
+    Returns:
+        Aware UTC datetime strictly after now
+    """
+    tz = get_timezone(tz_name)
+    try:
+        at = datetime.strptime(notification_time or "09:00", "%H:%M").time()
+    except ValueError:
+        at = datetime.strptime("09:00", "%H:%M").time()
+
+    local_now = (now or datetime.now(timezone.utc)).astimezone(tz)
+    candidate = datetime.combine(local_now.date(), at, tzinfo=tz)
+    if candidate <= local_now:
+        candidate = datetime.combine(local_now.date() + timedelta(days=1), at, tzinfo=tz)
+    return candidate.astimezone(timezone.utc)
+
+
+def _naive_utc(value: datetime) -> datetime:
+    """Timestamps are stored as naive UTC in the database"""
+    return value.astimezone(timezone.utc).replace(tzinfo=None) if value.tzinfo else value
+
+
+def build_digests(db, user_ids: List[int], now: Optional[datetime] = None) -> Dict[int, List[str]]:
+    """
+    Build digest messages for several users with a fixed number of queries
+
+    Returns:
+        {telegram_id: [message text, ...]} for users with something to read
+    """
+    now = now or datetime.now(timezone.utc)
+    lookback = _naive_utc(now) - timedelta(hours=DIGEST_LOOKBACK_HOURS)
+
+    rows = db.query(User, UserSettings).join(UserSettings, UserSettings.user_id == User.id).filter(
+        User.id.in_(user_ids),
+        User.is_active == True,
+        UserSettings.daily_digest == True
+    ).all()
+    if not rows:
+        return {}
+
+    channels_by_user: Dict[int, Dict[str, str]] = {}
+    for sub in db.query(Subscription).filter(
+        Subscription.user_id.in_([user.id for user, _ in rows]),
+        Subscription.is_active == True
+    ).all():
+        channels_by_user.setdefault(sub.user_id, {})[sub.channel_id] = sub.channel_title
+
+    since_by_user = {
+        user.id: max(lookback, settings.last_digest_at) if settings.last_digest_at else lookback
+        for user, settings in rows
+    }
+    all_channels = {channel for channels in channels_by_user.values() for channel in channels}
+    if not all_channels:
+        return {}
+
+    messages = db.query(ScrapedMessage).filter(
+        ScrapedMessage.channel_id.in_(all_channels),
+        # Near-duplicates are kept: a user may follow only the duplicating channel,
+        # and story grouping merges them with the original anyway
+        ScrapedMessage.timestamp >= min(since_by_user.values())
+    ).order_by(ScrapedMessage.timestamp.desc()).all()
+
+    tiers = {normalize_tier(settings.summary_length) for _, settings in rows}
+    summaries = {
+        (row.scraped_message_id, row.tier): row.text for row in db.query(MessageSummary).filter(
+            MessageSummary.scraped_message_id.in_([msg.id for msg in messages]),
+            MessageSummary.tier.in_(tiers)
+        ).all()
+    } if messages else {}
+
+    digests = {}
+    for user, settings in rows:
+        channels = channels_by_user.get(user.id, {})
+        since = since_by_user[user.id]
+        tier = normalize_tier(settings.summary_length)
+        items = [
+            {
+                'id': msg.id,
+                'text': msg.text or "",
+                'summary': summaries.get((msg.id, tier)) or msg.summary or (msg.text or "")[:TIER_LIMITS[tier][1]],
+                'link': msg.link,
+                'channel_title': channels[msg.channel_id],
+                'timestamp': msg.timestamp
+            }
+            for msg in messages
+            if msg.channel_id in channels and msg.timestamp >= since
+        ]
+        if not items:
+            continue
+
+        # Biggest stories first: an event covered by many channels matters more
+        stories = sorted(story_clusterer.group(items), key=len, reverse=True)[:DIGEST_MAX_STORIES]
+        entries = []
+        for members in stories:
+            sources = [f"{m['channel_title']}: {m['link']}" if m['link'] else m['channel_title'] for m in members]
+            entries.append(f"• {members[0]['summary']}\n📌 " + "; ".join(dict.fromkeys(sources)))
+        digests[user.telegram_id] = split_message(entries, header="📅 Ежедневный дайджест:")
+
+    return digests
+
+
+class DigestScheduler:
+    """Heap of users' next digest times, woken only when a digest is due"""
+
+    def __init__(self, batch_size: int = DIGEST_BATCH_SIZE):
+        self.batch_size = batch_size
+        self._heap = []
+        self._generation: Dict[int, int] = {}
+        self._counter = itertools.count()
+        self._changed: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.sent = 0
+
+    def start(self):
+        """Load schedules from the database and start in the running event loop"""
+        if self._task:
+            return
+        self._changed = asyncio.Event()
+        self.load()
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"Digest scheduler started with {len(self._generation)} user(s)")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def load(self):
+        """Schedule every user with daily digests enabled (one query)"""
+        db = SessionLocal()
+        try:
+            rows = db.query(UserSettings).join(User, User.id == UserSettings.user_id).filter(
+                User.is_active == True,
+                UserSettings.daily_digest == True
+            ).all()
+            for settings in rows:
+                self._push(settings.user_id, next_digest_time(settings.notification_time, settings.timezone))
+        finally:
+            db.close()
+
+    def reschedule(self, user_id: int, enabled: bool, notification_time: Optional[str], tz_name: Optional[str]):
+        """Apply changed settings of one user"""
+        if enabled:
+            self._push(user_id, next_digest_time(notification_time, tz_name))
+        else:
+            # Entries of an unscheduled user no longer match any generation
+            self._generation.pop(user_id, None)
+        if self._changed:
+            self._changed.set()
+
+    def next_due(self) -> Optional[datetime]:
+        self._discard_stale()
+        return datetime.fromtimestamp(self._heap[0][0], timezone.utc) if self._heap else None
+
+    def _push(self, user_id: int, due: datetime):
+        generation = next(self._counter)
+        self._generation[user_id] = generation
+        heapq.heappush(self._heap, (due.timestamp(), user_id, generation))
+
+    def _discard_stale(self):
+        while self._heap and self._generation.get(self._heap[0][1]) != self._heap[0][2]:
+            heapq.heappop(self._heap)
+
+    def _pop_due(self, now: float) -> List[int]:
+        due = []
+        while len(due) < self.batch_size:
+            self._discard_stale()
+            if not self._heap or self._heap[0][0] > now:
+                break
+            _, user_id, _ = heapq.heappop(self._heap)
+            del self._generation[user_id]
+            due.append(user_id)
+        return due
+
+    async def _run(self):
+        while True:
+            due_at = self.next_due()
+            timeout = None if due_at is None else max(0.0, due_at.timestamp() - time.time())
+            self._changed.clear()
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout)
+                continue
+            except asyncio.TimeoutError:
+                pass
+
+            user_ids = self._pop_due(time.time())
+            while user_ids:
+                try:
+                    await self._send_batch(user_ids)
+                except Exception as e:
+                    logger.error(f"Error sending digests, retrying in {DIGEST_RETRY_SECONDS}s: {e}")
+                    self._retry(user_ids)
+                # Let the delivery queue drain before building the next batch
+                while delivery_dispatcher.running and delivery_dispatcher.depth() > self.batch_size:
+                    await asyncio.sleep(1)
+                user_ids = self._pop_due(time.time())
+
+    def _retry(self, user_ids: List[int]):
+        """Schedule users of a failed batch again, unless they were rescheduled meanwhile"""
+        retry_at = datetime.now(timezone.utc) + timedelta(seconds=DIGEST_RETRY_SECONDS)
+        for user_id in user_ids:
+            if user_id not in self._generation:
+                self._push(user_id, retry_at)
+
+    async def _send_batch(self, user_ids: List[int]):
+        now = datetime.now(timezone.utc)
+        db = SessionLocal()
+        try:
+            digests = build_digests(db, user_ids, now)
+
+            settings_rows = db.query(UserSettings).filter(UserSettings.user_id.in_(user_ids)).all()
+            next_times = []
+            for settings in settings_rows:
+                settings.last_digest_at = _naive_utc(now)
+                if settings.daily_digest:
+                    next_times.append((settings.user_id, next_digest_time(settings.notification_time, settings.timezone, now)))
+            db.commit()
+        finally:
+            db.close()
+
+        # Only a committed batch moves on to the next day, a failed one is left to _retry
+        for user_id, due in next_times:
+            self._push(user_id, due)
+
+        for telegram_id, texts in digests.items():
+            for text in texts:
+                await delivery_dispatcher.send_message(telegram_id, text, priority=PRIORITY_DIGEST)
+            self.sent += 1
+        logger.info(f"Daily digests: {len(digests)} sent for {len(user_ids)} due user(s)")
+
+
+digest_scheduler = DigestScheduler()
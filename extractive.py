@@ -0,0 +1,218 @@
+"""
+Extractive summarization: picks key sentences with TF-IDF weighted TextRank
+
+Works without any model. Sentence vectors and the TextRank power iteration
+are computed with NumPy, so a batch of thousands of posts is summarized per
+second on a single CPU core. Used as the "extractive" SUMMARIZATION_TYPE and
+as a cheap first pass before LLM refinement.
+"""
+import re
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from config import EXTRACTIVE_MAX_SENTENCES, EXTRACTIVE_MAX_CHARS
+
+_WORD_RE = re.compile(r"[а-яa-z0-9]+")
+_SENTENCE_RE = re.compile(r'(?<=[.!?…])\s+|\n+')
+
+RUSSIAN_STOPWORDS = frozenset("""
+а без более бы был была были было быть в вам вас весь во вот все всего всех вы
+где да даже для до его ее ей ему если есть еще же за здесь и из или им их к как
+какая какой когда кто ли либо меня мне много может можно мой мы на над надо наш не
+него нее нет ни них но ну о об однако он она они оно от очень по под после потому
+при про раз с сам свой себя со так также такой там те тем то того тоже той только
+том ты у уже хотя чего чей чем что чтобы чье чья эта эти это этого этой этом этот
+я будет будут которые который которая которое которых котором этих всё сейчас
+теперь тогда ведь вся всю между через перед также кроме около стал стала стали
+ещё чтоб пока лишь именно нам нами ним ними собой тебя тебе тот эту
+the a an and or of to in on for with is are was were be by at as it this that from
+""".split())
+
+# Longest suffixes first; a light stemmer good enough for grouping word forms
+_RUSSIAN_SUFFIXES = sorted("""
+иями ями ами ией ий ый ой ая яя ое ее ые ие ых их ым им ом ем ам ям ах ях ую юю
+ого его ому ему ешь ет ют ут ит ат ят им ем ать ять ить еть уть ться тся ла ли ло
+ов ев ей ия ья ие ье а я о е и ы у ю ь
+""".split(), key=len, reverse=True)
+
+DAMPING = 0.85
+MAX_ITERATIONS = 30
+TOLERANCE = 1e-4
+# Bonus for the leading sentence: news posts usually start with the key fact
+LEAD_BONUS = 0.15
+
+
+def stem(word: str) -> str:
+    """Strip the longest known Russian suffix, keeping at least 3 characters"""
+    for suffix in _RUSSIAN_SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[:-len(suffix)]
+    return word
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase, drop stopwords and short tokens, stem"""
+    words = _WORD_RE.findall(text.lower().replace('ё', 'е'))
+    return [stem(w) for w in words if len(w) > 2 and w not in RUSSIAN_STOPWORDS]
+
+
+def split_sentences(text: str) -> List[str]:
+    """Split text into sentences and non-empty lines"""
+    return [s.strip() for s in _SENTENCE_RE.split(text) if s and s.strip()]
+
+
+def textrank_scores(counts: np.ndarray, idf: np.ndarray) -> np.ndarray:
+    """
+    Score sentences with TextRank over TF-IDF cosine similarity
+
+    Args:
+        counts: (n_sentences, n_terms) term counts
+        idf: (n_terms,) inverse document frequencies
+
+    Returns:
+        (n_sentences,) scores summing to 1
+    """
+    n = counts.shape[0]
+    weights = np.log1p(counts) * idf
+    norms = np.linalg.norm(weights, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    weights /= norms
+
+    similarity = weights @ weights.T
+    np.fill_diagonal(similarity, 0.0)
+
+    row_sums = similarity.sum(axis=1, keepdims=True)
+    dangling = row_sums[:, 0] == 0
+    row_sums[dangling] = 1.0
+    transition = similarity / row_sums
+    # Sentences with no overlap jump uniformly
+    transition[dangling] = 1.0 / n
+
+    scores = np.full(n, 1.0 / n)
+    teleport = (1.0 - DAMPING) / n
+    transition_t = transition.T
+    for _ in range(MAX_ITERATIONS):
+        updated = teleport + DAMPING * (transition_t @ scores)
+        if np.abs(updated - scores).sum() < TOLERANCE:
+            scores = updated
+            break
+        scores = updated
+    return scores
+
+
+class ExtractiveSummarizer:
+    """TextRank summarizer with Russian tokenization and stopwords"""
+
+    def __init__(self, max_sentences: int = EXTRACTIVE_MAX_SENTENCES, max_chars: int = EXTRACTIVE_MAX_CHARS):
+        self.max_sentences = max_sentences
+        self.max_chars = max_chars
+
+    def summarize(self, text: str, max_sentences: Optional[int] = None, max_chars: Optional[int] = None) -> str:
+        """Summarize a single text"""
+        return self.summarize_batch([text], max_sentences, max_chars)[0]
+
+    def summarize_batch(
+        self,
+        texts: List[str],
+        max_sentences: Optional[int] = None,
+        max_chars: Optional[int] = None
+    ) -> List[str]:
+        """
+        Summarize many texts at once
+
+        Document frequencies are computed over the whole batch, so terms that
+        appear in every post (channel signatures, hashtags) get low weight.
+
+        Args:
+            texts: Texts to summarize
+            max_sentences: Sentences to keep per text
+            max_chars: Upper bound on summary length in characters
+
+        Returns:
+            Summaries in the same order as texts
+        """
+        max_sentences = max_sentences or self.max_sentences
+        max_chars = max_chars or self.max_chars
+
+        vocabulary: Dict[str, int] = {}
+        parsed = []
+        doc_terms = []
+        for text in texts:
+            sentences = split_sentences(text or "")
+            token_ids = [
+                [vocabulary.setdefault(token, len(vocabulary)) for token in tokenize(sentence)]
+                for sentence in sentences
+            ]
+            parsed.append((sentences, token_ids))
+            doc_terms.append({t for ids in token_ids for t in ids})
+
+        df = np.zeros(len(vocabulary), dtype=np.float64)
+        for terms in doc_terms:
+            if terms:
+                df[np.fromiter(terms, dtype=np.int64, count=len(terms))] += 1
+        idf = np.log((1.0 + len(texts)) / (1.0 + df)) + 1.0
+
+        return [
+            self._summarize_parsed(text or "", sentences, token_ids, idf, max_sentences, max_chars)
+            for text, (sentences, token_ids) in zip(texts, parsed)
+        ]
+
+    def rank_sentences(self, text: str) -> List[str]:
+        """Return the sentences of text ordered from most to least important"""
+        sentences = split_sentences(text)
+        vocabulary: Dict[str, int] = {}
+        token_ids = [
+            [vocabulary.setdefault(token, len(vocabulary)) for token in tokenize(sentence)]
+            for sentence in sentences
+        ]
+        if len(sentences) < 2:
+            return sentences
+        scores = self._score(token_ids, np.ones(len(vocabulary)))
+        return [sentences[i] for i in np.argsort(-scores, kind='stable')]
+
+    def _score(self, token_ids: List[List[int]], idf: np.ndarray) -> np.ndarray:
+        """Build the local sentence-term matrix and run TextRank"""
+        local_terms = sorted({t for ids in token_ids for t in ids})
+        if not local_terms:
+            return np.zeros(len(token_ids))
+        column = {t: i for i, t in enumerate(local_terms)}
+
+        rows = np.fromiter(
+            (row for row, ids in enumerate(token_ids) for _ in ids),
+            dtype=np.int64
+        )
+        cols = np.fromiter(
+            (column[t] for ids in token_ids for t in ids),
+            dtype=np.int64
+        )
+        counts = np.zeros((len(token_ids), len(local_terms)))
+        np.add.at(counts, (rows, cols), 1.0)
+
+        scores = textrank_scores(counts, idf[local_terms])
+        scores[0] += LEAD_BONUS * scores.max()
+        return scores
+
+    def _summarize_parsed(self, text, sentences, token_ids, idf, max_sentences, max_chars) -> str:
+        if len(sentences) <= max_sentences:
+            return text.strip()[:max_chars]
+
+        scores = self._score(token_ids, idf)
+        ranked = np.argsort(-scores, kind='stable')
+
+        chosen = []
+        length = 0
+        for index in ranked:
+            sentence_length = len(sentences[index]) + 1
+            if chosen and length + sentence_length > max_chars:
+                continue
+            chosen.append(index)
+            length += sentence_length
+            if len(chosen) >= max_sentences:
+                break
+
+        summary = " ".join(sentences[i] for i in sorted(chosen))
+        return summary[:max_chars]
+
+
+extractive_summarizer = ExtractiveSummarizer()
@@ -0,0 +1,154 @@
+"""
+Minimal embedded HTTP/1.1 server on asyncio streams
+
+Enough HTTP for the webhook and service endpoints without pulling in a web
+framework: one request per connection, Content-Length bodies only, exact
+path routing. TLS is optional (pass an ssl.SSLContext) and usually
+terminated by a reverse proxy instead.
+"""
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+MAX_BODY_BYTES = 1024 * 1024
+MAX_HEADER_LINES = 100
+READ_TIMEOUT_SECONDS = 10
+
+REASONS = {
+    200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found",
+    405: "Method Not Allowed", 408: "Request Timeout", 413: "Payload Too Large",
+    500: "Internal Server Error", 503: "Service Unavailable",
+}
+
+
+@dataclass
+class Request:
+    method: str
+    path: str
+    query: str
+    headers: Dict[str, str]
+    body: bytes = b""
+
+
+@dataclass
+class Response:
+    status: int = 200
+    body: bytes = b""
+    content_type: str = "text/plain; charset=utf-8"
+    headers: Dict[str, str] = field(default_factory=dict)
+
+
+Handler = Callable[[Request], Awaitable[Response]]
+
+
+class HttpError(Exception):
+    def __init__(self, status: int):
+        super().__init__(REASONS.get(status, str(status)))
+        self.status = status
+
+
+class HttpServer:
+    """Routes (method, path) to async handlers"""
+
+    def __init__(self, host: str, port: int, ssl_context=None):
+        self.host = host
+        self.port = port
+        self.ssl_context = ssl_context
+        self._routes: Dict[Tuple[str, str], Handler] = {}
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    def route(self, method: str, path: str, handler: Handler):
+        self._routes[(method.upper(), path)] = handler
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port, ssl=self.ssl_context)
+        sockets = self._server.sockets or []
+        if sockets:
+            # Port 0 picks a free port, report the real one
+            self.port = sockets[0].getsockname()[1]
+        logger.info(f"HTTP server listening on {self.host}:{self.port}")
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            try:
+                request = await asyncio.wait_for(self._read_request(reader), READ_TIMEOUT_SECONDS)
+                response = await self._dispatch(request)
+            except HttpError as e:
+                response = Response(e.status, REASONS.get(e.status, "").encode())
+            except asyncio.TimeoutError:
+                response = Response(408, b"Request Timeout")
+            await self._write_response(writer, response)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception as e:
+            logger.error(f"HTTP connection error: {e}")
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+
+    async def _dispatch(self, request: Request) -> Response:
+        handler = self._routes.get((request.method, request.path))
+        if handler is None:
+            known_path = any(path == request.path for _, path in self._routes)
+            raise HttpError(405 if known_path else 404)
+        try:
+            return await handler(request)
+        except HttpError:
+            raise
+        except Exception as e:
+            logger.error(f"Error handling {request.method} {request.path}: {e}")
+            return Response(500, b"Internal Server Error")
+
+    @staticmethod
+    async def _read_request(reader: asyncio.StreamReader) -> Request:
+        request_line = (await reader.readline()).decode('latin-1').strip()
+        parts = request_line.split()
+        if len(parts) != 3:
+            raise HttpError(400)
+        method, target, _ = parts
+        path, _, query = target.partition('?')
+
+        headers = {}
+        for _ in range(MAX_HEADER_LINES):
+            line = (await reader.readline()).decode('latin-1').strip()
+            if not line:
+                break
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        else:
+            raise HttpError(400)
+
+        try:
+            length = int(headers.get('content-length', '0'))
+        except ValueError:
+            raise HttpError(400)
+        if length < 0:
+            raise HttpError(400)
+        if length > MAX_BODY_BYTES:
+            raise HttpError(413)
+        body = await reader.readexactly(length) if length else b""
+        return Request(method.upper(), path, query, headers, body)
+
+    @staticmethod
+    async def _write_response(writer: asyncio.StreamWriter, response: Response):
+        head = [
+            f"HTTP/1.1 {response.status} {REASONS.get(response.status, '')}",
+            f"Content-Type: {response.content_type}",
+            f"Content-Length: {len(response.body)}",
+            "Connection: close",
+        ]
+        head.extend(f"{name}: {value}" for name, value in response.headers.items())
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode('latin-1') + response.body)
+        await writer.drain()
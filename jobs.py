@@ -0,0 +1,301 @@
+"""
+Database-backed job queue and leases for multi-process deployments
+
+With ROLE=bot / scraper / summarizer each role runs in its own process and
+the processes coordinate through the shared database only:
+
+- the scheduler runs in whichever scraper process holds the "scheduler"
+  lease; it enqueues one fetch job per subscribed channel every cycle
+- scraper processes claim fetch jobs, fetch and store the channel's posts
+  and enqueue a summarize job per new post
+- summarizer processes claim summarize jobs and save the summaries; the
+  bot process's outbox worker then sends the notifications
+
+Jobs are claimed with a status-guarded UPDATE and a claim token, so two
+processes never run the same job. A job whose worker died is reclaimed
+after JOB_CLAIM_TIMEOUT_SECONDS; failures are retried with backoff.
+"""
+import asyncio
+import json
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Iterable, List, Optional
+
+from sqlalchemy import and_, or_, update
+from sqlalchemy.exc import IntegrityError
+
+from database import SessionLocal, Job, Lease
+from config import (
+    JOB_POLL_SECONDS, JOB_CLAIM_TIMEOUT_SECONDS, JOB_MAX_ATTEMPTS,
+    JOB_RETRY_BASE_SECONDS, JOB_RETRY_MAX_SECONDS
+)
+
+logger = logging.getLogger(__name__)
+
+FETCH_JOB = "fetch"
+SUMMARIZE_JOB = "summarize"
+
+PENDING = "pending"
+RUNNING = "running"
+FAILED = "failed"
+
+JobHandler = Callable[[dict], Awaitable[None]]
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def worker_identity(role: str) -> str:
+    """Readable unique id of this process, stored with claims and leases"""
+    return f"{role}@{socket.gethostname()}:{os.getpid()}"
+
+
+def enqueue(db, kind: str, payload: dict, key: Optional[str] = None, delay: float = 0) -> bool:
+    """
+    Add a job (the caller commits)
+
+    Args:
+        key: Skip the job if a pending or running one with this key exists
+        delay: Seconds before the job may run
+
+    Returns:
+        Whether a job was added
+    """
+    job = Job(kind=kind, key=key, payload=json.dumps(payload), status=PENDING,
+              run_after=_utcnow() + timedelta(seconds=delay))
+    if key is None:
+        db.add(job)
+        return True
+
+    active = db.query(Job.id).filter(
+        Job.key == key,
+        Job.status.in_((PENDING, RUNNING))
+    ).first()
+    if active:
+        return False
+    try:
+        # Another process may insert the same key between the check and here;
+        # the unique index rejects it and only this savepoint is rolled back
+        with db.begin_nested():
+            db.add(job)
+    except IntegrityError:
+        return False
+    return True
+
+
+def failed_keys(db, kind: str) -> set:
+    """Keys of jobs of one kind that failed for good"""
+    return {
+        row.key for row in db.query(Job.key).filter(
+            Job.kind == kind,
+            Job.status == FAILED
+        ).all()
+    }
+
+
+def active_keys(db, kind: str) -> set:
+    """Keys of pending and running jobs of one kind"""
+    return {
+        row.key for row in db.query(Job.key).filter(
+            Job.kind == kind,
+            Job.status.in_((PENDING, RUNNING))
+        ).all()
+    }
+
+
+def claim(db, kinds: Iterable[str], worker_id: str, limit: int) -> List[Job]:
+    """Atomically take up to `limit` runnable jobs"""
+    now = _utcnow()
+    stale = now - timedelta(seconds=JOB_CLAIM_TIMEOUT_SECONDS)
+    claimable = and_(
+        Job.kind.in_(list(kinds)),
+        or_(
+            and_(Job.status == PENDING, Job.run_after <= now),
+            and_(Job.status == RUNNING, Job.claimed_at < stale)
+        )
+    )
+    candidate_ids = [row.id for row in db.query(Job.id).filter(claimable).order_by(Job.id).limit(limit).all()]
+    if not candidate_ids:
+        return []
+
+    token = uuid.uuid4().hex
+    db.execute(
+        update(Job)
+        .where(Job.id.in_(candidate_ids), claimable)
+        .values(
+            status=RUNNING,
+            claim_token=token,
+            claimed_by=worker_id,
+            claimed_at=now,
+            attempts=Job.attempts + 1
+        )
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+    return db.query(Job).filter(Job.claim_token == token).all()
+
+
+def complete(db, job_id: int, token: str):
+    """Delete a finished job, unless another worker reclaimed it meanwhile"""
+    db.query(Job).filter(Job.id == job_id, Job.claim_token == token).delete(synchronize_session=False)
+    db.commit()
+
+
+def fail(db, job_id: int, token: str, attempts: int, error: Exception):
+    if attempts >= JOB_MAX_ATTEMPTS:
+        values = {'status': FAILED}
+    else:
+        delay = min(JOB_RETRY_BASE_SECONDS * 2 ** (attempts - 1), JOB_RETRY_MAX_SECONDS)
+        values = {'status': PENDING, 'run_after': _utcnow() + timedelta(seconds=delay)}
+    db.execute(
+        update(Job).where(Job.id == job_id, Job.claim_token == token)
+        .values(claim_token=None, last_error=str(error)[:500], **values)
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+
+
+class JobWorker:
+    """Claims jobs of the given kinds and runs up to `concurrency` of them at once"""
+
+    def __init__(self, kinds: Iterable[str], handler: JobHandler, worker_id: str, concurrency: int = 1):
+        self.kinds = list(kinds)
+        self.handler = handler
+        self.worker_id = worker_id
+        self.concurrency = concurrency
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._running = set()
+        self.processed = 0
+        self.failed = 0
+
+    def start(self):
+        if self._task:
+            return
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"Job worker {self.worker_id} started for {', '.join(self.kinds)} (×{self.concurrency})")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        # Unfinished jobs are reclaimed by another worker after the claim timeout
+        for task in list(self._running):
+            task.cancel()
+        await asyncio.gather(*self._running, return_exceptions=True)
+
+    async def _run(self):
+        while True:
+            claimed = []
+            free = self.concurrency - len(self._running)
+            if free > 0:
+                db = SessionLocal()
+                try:
+                    claimed = [(job.id, job.claim_token, job.attempts, job.payload) for job in claim(db, self.kinds, self.worker_id, free)]
+                except Exception as e:
+                    logger.error(f"Error claiming jobs: {e}")
+                finally:
+                    db.close()
+
+            for job in claimed:
+                task = asyncio.create_task(self._execute(*job))
+                self._running.add(task)
+                task.add_done_callback(self._running.discard)
+
+            if not claimed or len(self._running) >= self.concurrency:
+                # Poll again after the interval, or as soon as a slot frees up
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), JOB_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _execute(self, job_id: int, token: str, attempts: int, payload: str):
+        try:
+            try:
+                await self.handler(json.loads(payload))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Job {job_id} failed (attempt {attempts}): {e}")
+                db = SessionLocal()
+                try:
+                    fail(db, job_id, token, attempts, e)
+                finally:
+                    db.close()
+                return
+
+            self.processed += 1
+            db = SessionLocal()
+            try:
+                complete(db, job_id, token)
+            finally:
+                db.close()
+        finally:
+            self._wakeup.set()
+
+
+class LeaderLease:
+    """
+    A named lease in the database; at most one holder at a time
+
+    The holder renews it every cycle. If it stops renewing (crashed, hung),
+    the lease expires after `ttl` seconds and another process takes over.
+    """
+
+    def __init__(self, name: str, holder: str, ttl: float):
+        self.name = name
+        self.holder = holder
+        self.ttl = ttl
+        self.held = False
+
+    def acquire(self) -> bool:
+        """Take or renew the lease; returns whether this process holds it"""
+        now = _utcnow()
+        expires_at = now + timedelta(seconds=self.ttl)
+        db = SessionLocal()
+        try:
+            result = db.execute(
+                update(Lease)
+                .where(Lease.name == self.name, or_(Lease.holder == self.holder, Lease.expires_at < now))
+                .values(holder=self.holder, expires_at=expires_at)
+                .execution_options(synchronize_session=False)
+            )
+            if result.rowcount == 0:
+                db.add(Lease(name=self.name, holder=self.holder, expires_at=expires_at))
+            db.commit()
+            acquired = True
+        except IntegrityError:
+            # The lease row exists and somebody else holds it
+            db.rollback()
+            acquired = False
+        finally:
+            db.close()
+
+        if acquired != self.held:
+            logger.info(f"{self.holder} {'acquired' if acquired else 'lost'} the {self.name} lease")
+        self.held = acquired
+        return acquired
+
+    def release(self):
+        if not self.held:
+            return
+        db = SessionLocal()
+        try:
+            db.execute(
+                update(Lease)
+                .where(Lease.name == self.name, Lease.holder == self.holder)
+                .values(expires_at=_utcnow())
+                .execution_options(synchronize_session=False)
+            )
+            db.commit()
+        finally:
+            db.close()
+        self.held = False
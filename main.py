@@ -1,29 +1,150 @@
 """
 Main entry point for the Telegram Aggregator Bot
+
+    python main.py                    # everything in one process
+    python main.py --role bot         # bot frontend, delivery and digests
+    python main.py --role scraper     # scheduler (one at a time, by lease) and channel fetching
+    python main.py --role summarizer  # summarization workers
+
+The roles coordinate through the jobs table of the shared database (see
+jobs.py), so scraper and summarizer processes can be added as needed.
+Every process that uses Telethon (bot, scraper) needs its own SESSION_NAME.
+
+Startup is arranged so the bot answers commands as soon as possible: the
+database is initialized while Telethon is imported and connects, the local
+model loads in a background thread, and polling starts without waiting for
+either. The scheduler starts once Telethon is connected. How long each
+step took is logged (and exported as aggregator_startup_seconds).
 """
+import time
+
+# Before any other import: everything from here on counts as startup
+PROCESS_STARTED = time.perf_counter()
+
+import argparse
 import asyncio
+import importlib
 import logging
 from telegram.ext import ApplicationBuilder, CommandHandler, CallbackQueryHandler
 from database import init_db
-from config import BOT_TOKEN
+from update_processor import PerChatUpdateProcessor
+from metrics import STARTUP_SECONDS
+from config import (
+    BOT_TOKEN, BOT_MODE, LLAMA_CPP_PRELOAD, ROLE, PIPELINE_FETCH_WORKERS,
+    PIPELINE_SUMMARIZE_WORKERS, SCHEDULER_LEASE_SECONDS, USER_CACHE_TTL_SECONDS, LOG_LEVEL,
+    DELIVERY_DRAIN_SECONDS
+)
 import sys
+import threading
 
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
+    level=LOG_LEVEL
 )
+# python-telegram-bot logs every getUpdates request at INFO
+logging.getLogger("httpx").setLevel(logging.WARNING)
 logger = logging.getLogger(__name__)
 
-async def init_bot(application):
-    """Initialize bot and scheduler"""
+
+class StartupTimer:
+    """Seconds from process start to each startup step"""
+
+    def __init__(self, started: float):
+        self.started = started
+        self.steps = {}
+
+    def mark(self, step: str) -> float:
+        elapsed = time.perf_counter() - self.started
+        self.steps[step] = elapsed
+        STARTUP_SECONDS.labels(step).set(elapsed)
+        return elapsed
+
+    def report(self) -> str:
+        return ", ".join(f"{step} {seconds:.2f}s" for step, seconds in self.steps.items())
+
+
+startup = StartupTimer(PROCESS_STARTED)
+startup.mark("imports")
+
+# Telethon connection and scheduler start, running while the bot already answers
+_startup_task = None
+
+
+def start_llm_preload():
+    """Load the local model in a background thread while Telegram connects"""
+    from summarizer import summarizer, preload_llama_cpp
+
+    if not (LLAMA_CPP_PRELOAD and summarizer.uses_llama_cpp()):
+        return
+
+    def preload():
+        preload_llama_cpp()
+        logger.info(f"Startup: model loaded after {startup.mark('model'):.2f}s")
+
+    logger.info("Preloading llama_cpp model in background...")
+    threading.Thread(target=preload, name="llm-preload", daemon=True).start()
+
+
+async def connect_scraper():
+    """Create and connect the Telethon scraper; the import runs in a thread so the loop stays free"""
+    await asyncio.to_thread(importlib.import_module, "telethon")
+    from scraper import ChannelScraper
+
+    logger.info("Connecting to Telegram...")
+    scraper = ChannelScraper()
+    await scraper.connect()
+    logger.info(f"Startup: Telegram client connected after {startup.mark('telegram_client'):.2f}s")
+    return scraper
+
+
+async def start_scraping(application, role: str):
+    """Connect Telethon in the background, then start the scheduler"""
+    from scheduler import start_scheduler, set_scraper
+
+    try:
+        scraper = await connect_scraper()
+    except Exception as e:
+        logger.error(f"Could not connect to Telegram, stopping: {e}")
+        # Once polling runs this stops it; before that report_ready raises the error
+        application.stop_running()
+        raise
+    set_scraper(scraper)
+    if role == "all":
+        start_scheduler()
+        startup.mark("scheduler")
+
+
+async def report_ready(application):
+    """post_init hook: the application is about to take updates"""
+    if _startup_task and _startup_task.done() and not _startup_task.cancelled() and _startup_task.exception():
+        raise _startup_task.exception()
+    logger.info(f"Startup: answering commands after {startup.mark('ready'):.2f}s ({startup.report()})")
+
+
+async def init_bot(application, role: str = "all"):
+    """
+    Initialize the bot; Telethon keeps connecting in the background
+
+    The scheduler (only when role is all) starts once Telethon is connected.
+    """
+    global _startup_task
+
+    if role == "all":
+        start_llm_preload()
+
     logger.info("Initializing database...")
-    init_db()
+    await asyncio.to_thread(init_db)
+    startup.mark("database")
+
+    from metrics import start_metrics_server
+    from profiling import profiler
+    profiler.start(await start_metrics_server())
     
     # Import handler functions
     from bot import (
         start, help_command, channels_command, all_channels_command,
         subscribe_command, unsubscribe_command,
-        settings_command, digest_command, handle_callback
+        settings_command, timezone_command, filter_command, digest_command, handle_callback
     )
     
     # Add command handlers
@@ -34,43 +155,141 @@ async def init_bot(application):
     application.add_handler(CommandHandler('subscribe', subscribe_command))
     application.add_handler(CommandHandler('unsubscribe', unsubscribe_command))
     application.add_handler(CommandHandler('settings', settings_command))
+    application.add_handler(CommandHandler('timezone', timezone_command))
+    application.add_handler(CommandHandler('filter', filter_command))
     application.add_handler(CommandHandler('digest', digest_command))
     application.add_handler(CallbackQueryHandler(handle_callback))
+    startup.mark("handlers")
     
-    # Connect scraper and start scheduler
-    from scraper import ChannelScraper
-    from scheduler import start_scheduler, set_bot_instance, set_scraper
-
-    logger.info("Connecting to Telegram...")
-    scraper = ChannelScraper()
-    await scraper.connect()
-    logger.info("Telegram connection established")
+    from scheduler import set_bot_instance
+    from delivery import delivery_dispatcher
+    from outbox import outbox_worker
+    from digests import digest_scheduler
 
     set_bot_instance(application.bot)
-    set_scraper(scraper)
-    start_scheduler()
+    delivery_dispatcher.start(application.bot)
+    outbox_worker.start()
+    digest_scheduler.start()
+    startup.mark("services")
+
+    # Importing Telethon is CPU-bound and would hold the GIL against the steps above,
+    # so it starts last; the connection itself overlaps with polling startup
+    _startup_task = asyncio.create_task(start_scraping(application, role))
     
     logger.info("Bot initialized successfully")
 
+
+async def shutdown_bot(application):
+    """Stop background work once the application stopped taking updates"""
+    from scheduler import stop_scheduler
+    from outbox import outbox_worker
+    from digests import digest_scheduler
+    from delivery import delivery_dispatcher, notification_coalescer
+
+    if _startup_task:
+        # Stopped while Telethon was still connecting, or it failed
+        _startup_task.cancel()
+        await asyncio.gather(_startup_task, return_exceptions=True)
+
+    # The running check and the pipeline drain first, their notifications are already in the outbox
+    await stop_scheduler()
+    await digest_scheduler.stop()
+    await outbox_worker.stop()
+    # Buffered notifications still need the running dispatcher
+    await notification_coalescer.flush_all(DELIVERY_DRAIN_SECONDS)
+    await delivery_dispatcher.stop()
+
+
+async def run_worker(role: str):
+    """Run a scraper or summarizer process until it is stopped"""
+    from jobs import JobWorker, LeaderLease, worker_identity, FETCH_JOB, SUMMARIZE_JOB
+    import scheduler
+
+    from metrics import start_metrics_server
+    from profiling import profiler
+
+    logger.info("Initializing database...")
+    database = asyncio.create_task(asyncio.to_thread(init_db))
+    worker_id = worker_identity(role)
+    lease = None
+
+    if role == "scraper":
+        from user_cache import user_cache
+        from message_filters import message_filters
+
+        # Subscriptions and filters are changed by the bot process, not visible through invalidation here
+        user_cache.ttl = USER_CACHE_TTL_SECONDS
+        message_filters.ttl = USER_CACHE_TTL_SECONDS
+
+        scraper = await connect_scraper()
+        await database
+        scheduler.set_scraper(scraper)
+
+        lease = LeaderLease("scheduler", worker_id, SCHEDULER_LEASE_SECONDS)
+        scheduler.start_scheduler(lease)
+        worker = JobWorker([FETCH_JOB], scheduler.run_fetch_job, worker_id, PIPELINE_FETCH_WORKERS)
+    else:
+        start_llm_preload()
+        await database
+        worker = JobWorker([SUMMARIZE_JOB], scheduler.run_summarize_job, worker_id, PIPELINE_SUMMARIZE_WORKERS)
+
+    profiler.start(await start_metrics_server())
+    worker.start()
+    logger.info(f"Startup: {role} working after {startup.mark('ready'):.2f}s ({startup.report()})")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await scheduler.stop_scheduler()
+        await worker.stop()
+        if lease:
+            # Let another scraper take over scheduling right away
+            lease.release()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Telegram Aggregator Bot")
+    parser.add_argument(
+        "--role",
+        choices=("all", "bot", "scraper", "summarizer"),
+        default=ROLE,
+        help="Which part of the service this process runs (default: ROLE or all)"
+    )
+    return parser.parse_args()
+
 def main():
     """Main entry point"""
+    role = parse_args().role
+
+    if role in ("scraper", "summarizer"):
+        try:
+            asyncio.run(run_worker(role))
+        except KeyboardInterrupt:
+            logger.info("Application stopped")
+        return
+
     application = (
         ApplicationBuilder()
         .token(BOT_TOKEN)
-        .concurrent_updates(False)
+        .concurrent_updates(PerChatUpdateProcessor())
+        .post_init(report_ready)
+        .post_stop(shutdown_bot)
         .build()
     )
     
     # Run initialization
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
-    loop.run_until_complete(init_bot(application))
-    
-    logger.info("Starting polling...")
+    loop.run_until_complete(init_bot(application, role))
     
-    # Use run_polling with post_shutdown_stop=False
     try:
-        application.run_polling(drop_pending_updates=True, close_loop=False, poll_interval=10)
+        if BOT_MODE == "webhook":
+            from webhook import run_webhook
+            logger.info("Starting webhook server...")
+            loop.run_until_complete(run_webhook(application))
+        else:
+            logger.info("Starting polling...")
+            # Use run_polling with post_shutdown_stop=False
+            application.run_polling(drop_pending_updates=True, close_loop=False)
     except KeyboardInterrupt:
         logger.info("Application stopped")
         sys.exit(0)
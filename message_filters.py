@@ -0,0 +1,447 @@
+"""
+Per-user keyword and regex filters on incoming posts
+
+A user can limit notifications to posts containing given words (include)
+or hide posts containing them (exclude), in every channel or in one. For a
+post in a channel, the user's filters for all channels and for that
+channel apply: any matching exclude hides it; if there are includes, one
+of them must match. Users without filters get every post, as before.
+
+All users' patterns are compiled into one matcher, so a post is scanned
+once however many users and filters there are:
+
+- keywords: an Aho-Corasick automaton over the normalized (lowercase, ё → е)
+  text; a keyword matches as a substring, so "ставк" finds "ставки"
+- regexes: one alternation of all distinct regexes as a prefilter; only
+  when it matches somewhere are the individual regexes tried
+
+The match yields the set of patterns found in the post; deciding for each
+subscriber is then set lookups. A post nobody wants is not summarized.
+
+Users' regexes run on Python's backtracking engine, so they are guarded
+twice. validate_regex rejects the classic catastrophic shapes (a repeat
+inside a repeat, alternation inside a repeat). And since a match cannot be
+interrupted and holds the GIL, regexes are matched in a child process
+(RegexSandbox): when a channel's posts take longer than
+MESSAGE_FILTER_REGEX_TIMEOUT_SECONDS, the child is killed, the regexes
+that are too slow on their own are disabled, and the rest are matched
+again. Disabling is in memory only: the users' filters stay in the
+database, and until a restart a disabled regex is ignored as if its
+owners had not set it.
+
+Changing one user's filters updates the index in place (update_user).
+Patterns are reference counted, and the matcher is rebuilt lazily only
+when a pattern appears or disappears, not when a user adds a keyword
+someone already has. Like the user cache, processes that do not see the
+bot's writes (scraper workers) set a ttl and reload everything.
+"""
+import asyncio
+import logging
+import multiprocessing
+import re
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Dict, FrozenSet, Iterable, List, Optional, Sequence, Set, Tuple
+
+try:
+    from re import _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse
+
+from database import UserFilter
+from config import MESSAGE_FILTER_MAX_LENGTH, MESSAGE_FILTER_REGEX_TIMEOUT_SECONDS
+from metrics import FILTER_MATCH_SECONDS, FILTERS_DISABLED
+
+logger = logging.getLogger(__name__)
+
+INCLUDE = "include"
+EXCLUDE = "exclude"
+KEYWORD = "keyword"
+REGEX = "regex"
+
+# Backreferences and named groups break once patterns are joined into one alternation
+_UNCOMBINABLE_RE = re.compile(r'\\[1-9]|\(\?P[<=]')
+
+_REPEATS = {sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT, getattr(sre_parse, "POSSESSIVE_REPEAT", None)}
+_GROUPS = {sre_parse.SUBPATTERN, sre_parse.ASSERT, sre_parse.ASSERT_NOT, getattr(sre_parse, "ATOMIC_GROUP", None)}
+
+# How long the regex child process may take to start
+SANDBOX_START_TIMEOUT = 30
+
+
+def normalize(text: str) -> str:
+    return (text or "").lower().replace('ё', 'е')
+
+
+def validate_regex(pattern: str) -> re.Pattern:
+    """Compile a user's regex, raising ValueError if it cannot be used as a filter"""
+    if len(pattern) > MESSAGE_FILTER_MAX_LENGTH:
+        raise ValueError(f"longer than {MESSAGE_FILTER_MAX_LENGTH} characters")
+    if _UNCOMBINABLE_RE.search(pattern):
+        raise ValueError("backreferences and named groups are not supported")
+    try:
+        # Wrapped the way it is combined, so e.g. inline flags in the middle fail here
+        parsed = sre_parse.parse(f"(?:{pattern})", re.IGNORECASE)
+        compiled = re.compile(pattern, re.IGNORECASE)
+    except re.error as e:
+        raise ValueError(str(e))
+    _check_backtracking(parsed)
+    return compiled
+
+
+def _check_backtracking(items, repeated: bool = False):
+    """Reject shapes that backtrack exponentially: (a+)+, (a|ab)*, (\\w+\\s?)* and the like"""
+    for op, av in items:
+        if op in _REPEATS:
+            _, high, sub = av
+            many = high > 1
+            if repeated and many:
+                raise ValueError("nested quantifiers like (a+)+ are not supported")
+            _check_backtracking(sub, repeated or many)
+        elif op == sre_parse.BRANCH:
+            if repeated:
+                raise ValueError("alternation inside a repeated group like (a|b)+ is not supported")
+            for branch in av[1]:
+                _check_backtracking(branch, repeated)
+        elif op in _GROUPS:
+            _check_backtracking(av[-1], repeated)
+
+
+class AhoCorasick:
+    """All occurrences of many keywords in one pass over the text"""
+
+    def __init__(self, keywords: Iterable[str]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[Tuple[str, ...]] = [()]
+        for keyword in keywords:
+            self._insert(keyword)
+        self._link()
+
+    def _insert(self, keyword: str):
+        state = 0
+        for char in keyword:
+            following = self._goto[state].get(char)
+            if following is None:
+                following = len(self._goto)
+                self._goto[state][char] = following
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(())
+            state = following
+        self._output[state] += (keyword,)
+
+    def _link(self):
+        """Failure links breadth-first: the longest proper suffix that is also a trie path"""
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, following in self._goto[state].items():
+                queue.append(following)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(char, 0)
+                self._fail[following] = target if target != following else 0
+                self._output[following] += self._output[self._fail[following]]
+
+    def find(self, text: str) -> Set[str]:
+        goto, fail, output = self._goto, self._fail, self._output
+        found = set()
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                found.update(output[state])
+        return found
+
+
+@dataclass(frozen=True)
+class CachedFilter:
+    id: int
+    user_id: int
+    kind: str
+    pattern_type: str
+    pattern: str
+    channel_id: Optional[str]
+
+    @property
+    def key(self) -> Tuple[str, str]:
+        """What the matcher looks for: keywords normalized, regexes as written"""
+        if self.pattern_type == KEYWORD:
+            return KEYWORD, normalize(self.pattern)
+        return REGEX, self.pattern
+
+
+class RegexTimeout(Exception):
+    pass
+
+
+def _regex_worker(conn):
+    """Child process loop: ("patterns", [...]) replaces the regexes, ("search", [texts]) answers"""
+    regexes = {}
+    prefilter = None
+    conn.send("ready")
+    while True:
+        try:
+            command, payload = conn.recv()
+        except EOFError:
+            return
+        if command == "patterns":
+            regexes = {pattern: re.compile(pattern, re.IGNORECASE) for pattern in payload}
+            prefilter = re.compile("|".join(f"(?:{pattern})" for pattern in payload), re.IGNORECASE) if payload else None
+            continue
+        conn.send([
+            [pattern for pattern, regex in regexes.items() if regex.search(text)]
+            if prefilter is not None and prefilter.search(text) else []
+            for text in payload
+        ])
+
+
+class RegexSandbox:
+    """
+    Regexes matched in a child process that is killed when it takes too long
+
+    Blocking: call it from a worker thread, not the event loop.
+    """
+
+    def __init__(self, timeout: float = MESSAGE_FILTER_REGEX_TIMEOUT_SECONDS):
+        self.timeout = timeout
+        self._process = None
+        self._conn = None
+        self._patterns: Optional[Tuple[str, ...]] = None
+        self._lock = threading.Lock()
+        self.restarts = 0
+
+    def search(self, patterns: Tuple[str, ...], texts: Sequence[str]) -> List[List[str]]:
+        """
+        Patterns found in each text
+
+        Raises:
+            RegexTimeout: the texts took longer than the timeout (the child is killed)
+        """
+        with self._lock:
+            if self._process is None or not self._process.is_alive():
+                self._start()
+            if patterns != self._patterns:
+                self._conn.send(("patterns", patterns))
+                self._patterns = patterns
+            self._conn.send(("search", list(texts)))
+            if not self._conn.poll(self.timeout):
+                self._kill()
+                raise RegexTimeout(f"{len(texts)} text(s) not matched within {self.timeout}s")
+            return self._conn.recv()
+
+    def _start(self):
+        context = multiprocessing.get_context("spawn")
+        self._conn, child = context.Pipe()
+        self._process = context.Process(target=_regex_worker, args=(child,), name="filter-regex", daemon=True)
+        self._process.start()
+        child.close()
+        self._patterns = None
+        self.restarts += 1
+        if not self._conn.poll(SANDBOX_START_TIMEOUT):
+            self._kill()
+            raise RuntimeError("Filter regex process did not start")
+        self._conn.recv()
+
+    def _kill(self):
+        if self._process is not None:
+            self._process.kill()
+            self._process.join()
+        if self._conn is not None:
+            self._conn.close()
+        self._process = None
+        self._conn = None
+        self._patterns = None
+
+    def close(self):
+        with self._lock:
+            self._kill()
+
+
+def _snapshot(row) -> CachedFilter:
+    return CachedFilter(row.id, row.user_id, row.kind, row.pattern_type, row.pattern, row.channel_id)
+
+
+class FilterIndex:
+    """Filters of all users with one combined matcher"""
+
+    def __init__(self, ttl: float = 0):
+        # Seconds the loaded filters stay valid; 0 keeps them until changed here
+        self.ttl = ttl
+        self._filters: Dict[int, Tuple[CachedFilter, ...]] = {}
+        self._refcounts: Dict[Tuple[str, str], int] = {}
+        self._loaded_at: Optional[float] = None
+        self._keywords: Optional[AhoCorasick] = None
+        self._regexes: Tuple[str, ...] = ()
+        # Regexes too slow to match; kept in the database, ignored here
+        self._disabled: FrozenSet[str] = frozenset()
+        self._sandbox = RegexSandbox()
+        self._stale = True
+        self._lock = threading.Lock()
+        self.rebuilds = 0
+
+    def refresh(self, db):
+        """Load all filters if not loaded yet or expired"""
+        if self._loaded_at is not None and not (self.ttl and time.monotonic() - self._loaded_at > self.ttl):
+            return
+        by_user: Dict[int, List[CachedFilter]] = {}
+        for row in db.query(UserFilter).order_by(UserFilter.id).all():
+            by_user.setdefault(row.user_id, []).append(_snapshot(row))
+        with self._lock:
+            self._filters = {user_id: tuple(filters) for user_id, filters in by_user.items()}
+            refcounts: Dict[Tuple[str, str], int] = {}
+            for filters in self._filters.values():
+                for item in filters:
+                    refcounts[item.key] = refcounts.get(item.key, 0) + 1
+            if refcounts.keys() != self._refcounts.keys():
+                self._stale = True
+            self._refcounts = refcounts
+            self._loaded_at = time.monotonic()
+
+    def update_user(self, db, user_id: int):
+        """Reload one user's filters after they changed"""
+        filters = tuple(
+            _snapshot(row) for row in
+            db.query(UserFilter).filter(UserFilter.user_id == user_id).order_by(UserFilter.id).all()
+        )
+        with self._lock:
+            if self._loaded_at is None:
+                # Nothing loaded yet: refresh() will read everything, this user included
+                return
+            for item in self._filters.pop(user_id, ()):
+                self._refcounts[item.key] -= 1
+                if not self._refcounts[item.key]:
+                    del self._refcounts[item.key]
+                    self._stale = True
+            for item in filters:
+                if item.key not in self._refcounts:
+                    self._refcounts[item.key] = 0
+                    self._stale = True
+                self._refcounts[item.key] += 1
+            if filters:
+                self._filters[user_id] = filters
+
+    def user_filters(self, user_id: int) -> Tuple[CachedFilter, ...]:
+        return self._filters.get(user_id, ())
+
+    def _matchers(self):
+        with self._lock:
+            if self._stale:
+                keys = list(self._refcounts)
+                self._keywords = AhoCorasick(pattern for kind, pattern in keys if kind == KEYWORD)
+                regexes = []
+                for pattern in sorted(pattern for kind, pattern in keys if kind == REGEX and pattern not in self._disabled):
+                    try:
+                        validate_regex(pattern)
+                        regexes.append(pattern)
+                    except ValueError as e:
+                        logger.warning(f"Skipping invalid filter regex {pattern!r}: {e}")
+                self._regexes = tuple(regexes)
+                self._stale = False
+                self.rebuilds += 1
+            return self._keywords, self._regexes
+
+    def has_filters(self, recipients: list) -> bool:
+        """Whether any of the (subscription, user, tier) recipients has filters"""
+        return any(recipient[1].id in self._filters for recipient in recipients)
+
+    async def match_texts(self, texts: List[str]) -> List[FrozenSet[Tuple[str, str]]]:
+        """Keys of all patterns found in each text, matched off the event loop"""
+        keywords, regexes = self._matchers()
+        with FILTER_MATCH_SECONDS.time():
+            return await asyncio.to_thread(self._match_batch, keywords, regexes, texts)
+
+    def _match_batch(self, keywords: AhoCorasick, regexes: Tuple[str, ...], texts: List[str]):
+        texts = [text or "" for text in texts]
+        found = [{(KEYWORD, keyword) for keyword in keywords.find(normalize(text))} for text in texts]
+        if regexes:
+            for keys, patterns in zip(found, self._search_regexes(regexes, texts)):
+                keys.update((REGEX, pattern) for pattern in patterns)
+        return [frozenset(keys) for keys in found]
+
+    def _search_regexes(self, regexes: Tuple[str, ...], texts: List[str]) -> List[List[str]]:
+        """Regexes found in each text; regexes too slow on these texts are disabled"""
+        try:
+            return self._sandbox.search(regexes, texts)
+        except RegexTimeout as e:
+            logger.warning(f"Filter regexes timed out: {e}, looking for the slow ones")
+
+        slow = []
+        for pattern in regexes:
+            try:
+                self._sandbox.search((pattern,), texts)
+            except RegexTimeout:
+                slow.append(pattern)
+        if slow:
+            self._disable_regexes(slow)
+        remaining = tuple(pattern for pattern in regexes if pattern not in slow)
+        try:
+            return self._sandbox.search(remaining, texts) if remaining else [[] for _ in texts]
+        except RegexTimeout:
+            # Only slow together: skip the regexes for these texts rather than stall
+            logger.warning(f"Filter regexes timed out together on {len(texts)} text(s), ignoring them")
+            return [[] for _ in texts]
+
+    def _disable_regexes(self, patterns: List[str]):
+        """Stop matching regexes that cannot be matched in time, leaving the users' filters in place"""
+        with self._lock:
+            self._disabled = self._disabled | set(patterns)
+            owners = sorted({
+                user_id for user_id, filters in self._filters.items()
+                if any(item.pattern_type == REGEX and item.pattern in patterns for item in filters)
+            })
+            self._stale = True
+        FILTERS_DISABLED.inc(len(patterns))
+        logger.warning(f"Disabled filter regex(es) too slow to match: {sorted(patterns)}, set by user(s) {owners}")
+
+    @staticmethod
+    def accepts(
+        filters: Iterable[CachedFilter],
+        channel_id: str,
+        found: FrozenSet[Tuple[str, str]],
+        disabled: FrozenSet[str] = frozenset()
+    ) -> bool:
+        """Whether a post with the `found` patterns passes one user's filters for a channel"""
+        has_include = False
+        included = False
+        for item in filters:
+            if item.channel_id is not None and item.channel_id != channel_id:
+                continue
+            if item.pattern_type == REGEX and item.pattern in disabled:
+                continue
+            if item.kind == EXCLUDE:
+                if item.key in found:
+                    return False
+            else:
+                has_include = True
+                included = included or item.key in found
+        return included or not has_include
+
+    def filter_recipients(self, found: FrozenSet[Tuple[str, str]], channel_id: str, recipients: list) -> list:
+        """
+        Recipients of a post whose filters accept it
+
+        Args:
+            found: Patterns found in the post, from match_texts
+            channel_id: Channel the post came from
+            recipients: (subscription, user, tier) tuples as from get_channel_recipients
+
+        Returns:
+            The accepted subset, in the same order
+        """
+        accepted = []
+        for recipient in recipients:
+            filters = self._filters.get(recipient[1].id)
+            if filters and not self.accepts(filters, channel_id, found, self._disabled):
+                continue
+            accepted.append(recipient)
+        return accepted
+
+
+message_filters = FilterIndex()
@@ -0,0 +1,286 @@
+"""
+Prometheus metrics
+
+A small in-process registry of counters, gauges and histograms rendered in
+the Prometheus text format at GET /metrics (METRICS_LISTEN:METRICS_PORT).
+Recording a sample is a dict lookup and an addition under a lock, cheap
+enough to leave on everywhere. Gauges that mirror state owned by other
+modules (queue depths, scheduler stats) are refreshed by callbacks those
+modules register with on_collect(), only when the endpoint is scraped.
+
+With several processes (see main.py --role) give each its own METRICS_PORT.
+"""
+import bisect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Sequence, Tuple
+
+from config import METRICS_LISTEN, METRICS_PORT
+from httpd import HttpServer, Request, Response
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List["Metric"] = []
+        self._collectors: List[Callable[[], None]] = []
+
+    def register(self, metric: "Metric"):
+        self._metrics.append(metric)
+
+    def on_collect(self, callback: Callable[[], None]):
+        """Run `callback` before every render, to refresh gauges from their source"""
+        self._collectors.append(callback)
+
+    def render(self) -> str:
+        for callback in self._collectors:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"Metrics collector failed: {e}")
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), registry: Registry = REGISTRY):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            # Unlabeled metrics are exported as 0 before their first sample
+            self.labels()
+        registry.register(self)
+
+    def labels(self, *values):
+        key = tuple(str(value) for value in values)
+        if len(key) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {key}")
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _unlabeled(self):
+        return self.labels()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            children = list(self._children.items())
+        for values, child in sorted(children):
+            lines.extend(child.render(self.name, self.labelnames, values))
+        return lines
+
+
+class _Value:
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1):
+        self.inc(-amount)
+
+    def set(self, value: float):
+        with self._lock:
+            self.value = value
+
+    def render(self, name, labelnames, values):
+        return [f"{name}{_format_labels(labelnames, values)} {_format_value(self.value)}"]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1):
+        self._unlabeled().inc(amount)
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return _Value()
+
+    def set(self, value: float):
+        self._unlabeled().set(value)
+
+    def inc(self, amount: float = 1):
+        self._unlabeled().inc(amount)
+
+
+class _HistogramValue:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    @contextmanager
+    def time(self):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+    def render(self, name, labelnames, values):
+        with self._lock:
+            counts = list(self.counts)
+            total = self.sum
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            le = f'le="{_format_value(bound)}"'
+            lines.append(f"{name}_bucket{_format_labels(labelnames, values, le)} {cumulative}")
+        lines.append(f"{name}_sum{_format_labels(labelnames, values)} {_format_value(total)}")
+        lines.append(f"{name}_count{_format_labels(labelnames, values)} {cumulative}")
+        return lines
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = (),
+                 registry: Registry = REGISTRY):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float):
+        self._unlabeled().observe(value)
+
+    def time(self):
+        return self._unlabeled().time()
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SUMMARY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+DB_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+END_TO_END_BUCKETS = (5, 15, 30, 60, 120, 300, 600, 1800, 3600, 7200, 21600)
+
+# Process
+STARTUP_SECONDS = Gauge("aggregator_startup_seconds", "Seconds from process start to each startup step", ["step"])
+
+# Scraper
+MESSAGES_FETCHED = Counter("aggregator_messages_fetched_total", "Messages read from channels", ["channel"])
+FETCH_SECONDS = Histogram("aggregator_fetch_seconds", "Time to read one channel over MTProto", buckets=LATENCY_BUCKETS)
+FETCH_ERRORS = Counter("aggregator_fetch_errors_total", "Failed channel reads", ["error"])
+FLOOD_WAIT_SECONDS = Counter("aggregator_flood_wait_seconds_total", "Seconds Telegram asked the scraper to wait")
+
+# Database
+DB_COMMIT_SECONDS = Histogram("aggregator_db_commit_seconds", "Session commit time, flush included", buckets=DB_BUCKETS)
+
+# Summarizer
+SUMMARIZE_SECONDS = Histogram(
+    "aggregator_summarize_seconds", "Backend completion time (cache misses)",
+    ["backend", "stage"], buckets=SUMMARY_BUCKETS
+)
+
+# Filters
+UNWANTED_POSTS = Counter("aggregator_unwanted_posts_total", "Posts no subscriber's filters accepted, left unsummarized")
+FILTERED_NOTIFICATIONS = Counter("aggregator_filtered_notifications_total", "Notifications not sent because of user filters")
+FILTER_MATCH_SECONDS = Histogram("aggregator_filter_match_seconds", "Matching a channel's new posts against all filters", buckets=DB_BUCKETS)
+FILTERS_DISABLED = Counter("aggregator_filters_disabled_total", "Filter regexes disabled because matching them timed out")
+
+# Queues and scheduler
+QUEUE_DEPTH = Gauge("aggregator_queue_depth", "Items waiting in an in-process queue", ["queue"])
+SCHEDULER_CYCLE_SECONDS = Gauge("aggregator_scheduler_cycle_seconds", "Duration of the last scheduler run", ["task"])
+SCHEDULER_LAG_SECONDS = Gauge("aggregator_scheduler_lag_seconds", "How late the last scheduler run started", ["task"])
+MISSED_TICKS = Gauge("aggregator_scheduler_missed_ticks", "Ticks missed because a run overran", ["task"])
+
+# Delivery
+SEND_SECONDS = Histogram("aggregator_send_seconds", "Bot API sendMessage latency", buckets=LATENCY_BUCKETS)
+SENDS = Counter("aggregator_sends_total", "sendMessage attempts by result", ["result"])
+RETRY_AFTER = Counter("aggregator_retry_after_total", "RetryAfter (flood control) responses from the Bot API")
+NOTIFY_LATENCY_SECONDS = Histogram(
+    "aggregator_post_to_notification_seconds", "From a post's publication to its notification being sent",
+    buckets=END_TO_END_BUCKETS
+)
+
+
+def instrument_database():
+    """Time every session commit"""
+    from sqlalchemy import event
+    from database import SessionLocal
+
+    @event.listens_for(SessionLocal, "before_commit")
+    def _before_commit(session):
+        session.info['commit_started'] = time.perf_counter()
+
+    @event.listens_for(SessionLocal, "after_commit")
+    def _after_commit(session):
+        started = session.info.pop('commit_started', None)
+        if started is not None:
+            DB_COMMIT_SECONDS.observe(time.perf_counter() - started)
+
+
+async def handle_metrics(request: Request) -> Response:
+    return Response(200, REGISTRY.render().encode(), content_type=CONTENT_TYPE)
+
+
+async def start_metrics_server(port: int = METRICS_PORT):
+    """Serve /metrics; port 0 in the config disables it. Returns the server or None"""
+    if not port:
+        return None
+    instrument_database()
+    server = HttpServer(METRICS_LISTEN, port)
+    server.route("GET", "/metrics", handle_metrics)
+    try:
+        await server.start()
+    except OSError as e:
+        # Metrics are not worth failing the service over
+        logger.error(f"Metrics server could not listen on {METRICS_LISTEN}:{port}: {e}")
+        return None
+    return server
@@ -0,0 +1,371 @@
+"""
+Persistent delivery outbox
+
+When a new post is stored, one OutboxEntry per recipient is added in the
+same transaction, so a post is never marked as seen without its pending
+notifications. The outbox worker drains entries whose post has been
+summarized:
+
+- entries are claimed in batches with a claim token (an UPDATE guarded by
+  the status), so several workers or processes never send the same entry
+- claimed entries go out through the notification coalescer and are marked
+  sent as soon as Telegram accepted the message containing them
+- while a batch is still waiting (a slow or rate-limited chat), its claim is
+  renewed, so it is not reclaimed and sent a second time
+- on stop, buffered notifications are flushed and the batches in flight get
+  DELIVERY_DRAIN_SECONDS to finish and be recorded
+- failures are retried with exponential backoff up to OUTBOX_MAX_ATTEMPTS
+- entries stuck in "sending" (the process died mid-send) are reclaimed
+  after OUTBOX_CLAIM_TIMEOUT_SECONDS
+
+The idempotency key is (story, user): a near-duplicate of a post the user
+was already notified about cannot create a second entry, even across
+restarts. Delivery is at-least-once only for the narrow window between
+Telegram accepting a message and the entry being marked sent.
+"""
+import asyncio
+import logging
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+
+from sqlalchemy import or_, and_, update
+from telegram.error import BadRequest, Forbidden
+
+from database import SessionLocal, OutboxEntry, ScrapedMessage, MessageSummary
+from config import (
+    OUTBOX_BATCH_SIZE, OUTBOX_POLL_SECONDS, OUTBOX_MAX_ATTEMPTS,
+    OUTBOX_RETRY_BASE_SECONDS, OUTBOX_RETRY_MAX_SECONDS,
+    OUTBOX_CLAIM_TIMEOUT_SECONDS, OUTBOX_MAX_IN_FLIGHT, DELIVERY_DRAIN_SECONDS
+)
+from delivery import notification_coalescer
+from metrics import REGISTRY, QUEUE_DEPTH, NOTIFY_LATENCY_SECONDS
+from profiling import profiler
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+SENDING = "sending"
+SENT = "sent"
+FAILED = "failed"
+
+
+def _utcnow() -> datetime:
+    """Naive UTC, the way timestamps are stored"""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def idempotency_key(story_id: int, telegram_id: int) -> str:
+    return f"story:{story_id}:user:{telegram_id}"
+
+
+def enqueue_deliveries(db, scraped_msg, story_id: int, deliveries: list) -> List[tuple]:
+    """
+    Add outbox entries for a stored message (the caller commits)
+
+    Args:
+        db: Session holding the message insert
+        scraped_msg: The new ScrapedMessage (flushed, so it has an id)
+        story_id: ScrapedMessage id of the story's first post
+        deliveries: (telegram_id, channel_title, tier) tuples
+
+    Returns:
+        The deliveries that were not already in the outbox
+    """
+    keys = {idempotency_key(story_id, telegram_id): (telegram_id, title, tier) for telegram_id, title, tier in deliveries}
+    if not keys:
+        return []
+    existing = {
+        row.idempotency_key for row in db.query(OutboxEntry.idempotency_key).filter(
+            OutboxEntry.idempotency_key.in_(keys)
+        ).all()
+    }
+    added = []
+    for key, (telegram_id, title, tier) in keys.items():
+        if key in existing:
+            continue
+        db.add(OutboxEntry(
+            idempotency_key=key,
+            scraped_message_id=scraped_msg.id,
+            telegram_id=telegram_id,
+            channel_title=title,
+            tier=tier,
+            link=scraped_msg.link or "",
+            status=PENDING,
+            next_attempt_at=_utcnow()
+        ))
+        added.append((telegram_id, title, tier))
+    return added
+
+
+def format_notification(channel_title: str, summary: str, link: str) -> str:
+    return f"""
+📌 {channel_title}
+🕒 {datetime.now(timezone.utc).strftime('%H:%M')}
+
+📝 Краткое содержание:
+"{summary}"
+
+🔗 Исходное сообщение: {link}
+"""
+
+
+def _posted_at(message) -> Optional[datetime]:
+    """Publication time of a post as an aware datetime (SQLite returns naive UTC)"""
+    if message is None or message.timestamp is None:
+        return None
+    posted_at = message.timestamp
+    return posted_at if posted_at.tzinfo else posted_at.replace(tzinfo=timezone.utc)
+
+
+def retry_delay(attempts: int) -> float:
+    return min(OUTBOX_RETRY_BASE_SECONDS * 2 ** max(attempts - 1, 0), OUTBOX_RETRY_MAX_SECONDS)
+
+
+def _outcome(send: asyncio.Future) -> Optional[BaseException]:
+    """Exception of a finished send, None if it went out"""
+    return asyncio.CancelledError() if send.cancelled() else send.exception()
+
+
+class OutboxWorker:
+    """Claims ready outbox entries in batches and delivers them"""
+
+    def __init__(self, batch_size: int = OUTBOX_BATCH_SIZE, max_in_flight: int = OUTBOX_MAX_IN_FLIGHT):
+        self.batch_size = batch_size
+        self.max_in_flight = max_in_flight
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._batches = set()
+        self.in_flight = 0
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+
+    def start(self):
+        if self._task:
+            return
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+        logger.info("Outbox worker started")
+
+    async def stop(self, timeout: float = DELIVERY_DRAIN_SECONDS):
+        """Stop claiming, then give the batches in flight `timeout` seconds to be sent and recorded"""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if not self._batches:
+            return
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        # Batches wait for the coalescer window otherwise
+        await notification_coalescer.flush_all(timeout)
+        _, unfinished = await asyncio.wait(set(self._batches), timeout=max(deadline - loop.time(), 0))
+        if unfinished:
+            logger.warning(f"{self.in_flight} outbox entries still sending after {timeout}s, "
+                           f"they are retried after OUTBOX_CLAIM_TIMEOUT_SECONDS")
+            for task in unfinished:
+                task.cancel()
+            await asyncio.gather(*unfinished, return_exceptions=True)
+
+    def notify(self):
+        """New entries may be ready (a post was summarized)"""
+        if self._wakeup:
+            self._wakeup.set()
+
+    def pending(self) -> int:
+        db = SessionLocal()
+        try:
+            return db.query(OutboxEntry).filter(OutboxEntry.status.in_((PENDING, SENDING))).count()
+        finally:
+            db.close()
+
+    async def _run(self):
+        while True:
+            claimed = 0
+            if self.in_flight < self.max_in_flight:
+                try:
+                    with profiler.phase("outbox.claim"):
+                        claimed = self._claim_and_send()
+                except Exception as e:
+                    logger.error(f"Error claiming outbox entries: {e}")
+
+            if claimed == self.batch_size and self.in_flight < self.max_in_flight:
+                # More may be ready right away
+                await asyncio.sleep(0)
+                continue
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), OUTBOX_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+    def claim(self, db, limit: int) -> List[OutboxEntry]:
+        """Atomically take up to `limit` ready entries for this worker"""
+        now = _utcnow()
+        stale = now - timedelta(seconds=OUTBOX_CLAIM_TIMEOUT_SECONDS)
+        claimable = or_(
+            and_(OutboxEntry.status == PENDING, OutboxEntry.next_attempt_at <= now),
+            and_(OutboxEntry.status == SENDING, OutboxEntry.claimed_at < stale)
+        )
+        candidate_ids = [
+            row.id for row in db.query(OutboxEntry.id).join(
+                ScrapedMessage, ScrapedMessage.id == OutboxEntry.scraped_message_id
+            ).filter(
+                claimable,
+                ScrapedMessage.is_summarized == True
+            ).order_by(OutboxEntry.id).limit(limit).all()
+        ]
+        if not candidate_ids:
+            return []
+
+        token = uuid.uuid4().hex
+        # The status guard makes a concurrent claimer's UPDATE skip rows we took first
+        db.execute(
+            update(OutboxEntry)
+            .where(OutboxEntry.id.in_(candidate_ids), claimable)
+            .values(
+                status=SENDING,
+                claim_token=token,
+                claimed_at=now,
+                attempts=OutboxEntry.attempts + 1
+            )
+            .execution_options(synchronize_session=False)
+        )
+        db.commit()
+        return db.query(OutboxEntry).filter(OutboxEntry.claim_token == token).all()
+
+    def _claim_and_send(self) -> int:
+        db = SessionLocal()
+        try:
+            entries = self.claim(db, min(self.batch_size, self.max_in_flight - self.in_flight))
+            if not entries:
+                return 0
+            token = entries[0].claim_token
+            summaries = {
+                (row.scraped_message_id, row.tier): row.text for row in db.query(MessageSummary).filter(
+                    MessageSummary.scraped_message_id.in_({entry.scraped_message_id for entry in entries})
+                ).all()
+            }
+            messages = {
+                row.id: row for row in db.query(ScrapedMessage).filter(
+                    ScrapedMessage.id.in_({entry.scraped_message_id for entry in entries})
+                ).all()
+            }
+            fallback = {message_id: row.summary or (row.text or "")[:200] for message_id, row in messages.items()}
+            jobs = [
+                (
+                    entry.id,
+                    entry.attempts,
+                    entry.telegram_id,
+                    _posted_at(messages.get(entry.scraped_message_id)),
+                    format_notification(
+                        entry.channel_title,
+                        summaries.get((entry.scraped_message_id, entry.tier)) or fallback.get(entry.scraped_message_id, ""),
+                        entry.link
+                    )
+                )
+                for entry in entries
+            ]
+        finally:
+            db.close()
+
+        self.in_flight += len(jobs)
+        task = asyncio.create_task(self._deliver(jobs, token))
+        self._batches.add(task)
+        task.add_done_callback(self._batches.discard)
+        return len(jobs)
+
+    async def _deliver(self, jobs: list, token: str):
+        """Send a claimed batch, recording entries as the messages containing them go out"""
+        sends = {}
+        for job in jobs:
+            _, _, telegram_id, _, text = job
+            sends[asyncio.ensure_future(notification_coalescer.add(telegram_id, text, wait=True))] = job
+        waiting = set(sends)
+        # Renew well before another worker may consider the claim stale
+        renew_every = OUTBOX_CLAIM_TIMEOUT_SECONDS / 3
+        loop = asyncio.get_running_loop()
+        renew_at = loop.time() + renew_every
+        try:
+            while waiting:
+                done, waiting = await asyncio.wait(
+                    waiting, timeout=max(renew_at - loop.time(), 0), return_when=asyncio.FIRST_COMPLETED
+                )
+                if done:
+                    try:
+                        with profiler.phase("outbox.record"):
+                            self._record([sends[send] for send in done], [_outcome(send) for send in done])
+                    except Exception as e:
+                        logger.error(f"Error recording outbox results: {e}")
+                    self.in_flight -= len(done)
+                    self.notify()
+                if waiting and loop.time() >= renew_at:
+                    self._renew(token, [sends[send][0] for send in waiting])
+                    renew_at = loop.time() + renew_every
+        finally:
+            # Cancelled on stop: the rest stay claimed and are retried once the claim is stale
+            for send in waiting:
+                send.cancel()
+            self.in_flight -= len(waiting)
+
+    def _renew(self, token: str, entry_ids: List[int]):
+        """Keep a slow batch's claim fresh so its entries are not reclaimed and sent twice"""
+        db = SessionLocal()
+        try:
+            db.execute(
+                update(OutboxEntry)
+                .where(OutboxEntry.id.in_(entry_ids), OutboxEntry.claim_token == token, OutboxEntry.status == SENDING)
+                .values(claimed_at=_utcnow())
+                .execution_options(synchronize_session=False)
+            )
+            db.commit()
+        except Exception as e:
+            logger.error(f"Error renewing outbox claim: {e}")
+        finally:
+            db.close()
+
+    def _record(self, jobs: list, results: list):
+        now = _utcnow()
+        db = SessionLocal()
+        try:
+            sent = [job for job, result in zip(jobs, results) if not isinstance(result, BaseException)]
+            sent_ids = [entry_id for entry_id, _, _, _, _ in sent]
+            if sent_ids:
+                db.execute(
+                    update(OutboxEntry).where(OutboxEntry.id.in_(sent_ids))
+                    .values(status=SENT, sent_at=now, claim_token=None, last_error=None)
+                    .execution_options(synchronize_session=False)
+                )
+                self.sent += len(sent_ids)
+                wall_now = datetime.now(timezone.utc)
+                for _, _, _, posted_at, _ in sent:
+                    if posted_at is not None:
+                        NOTIFY_LATENCY_SECONDS.observe(max((wall_now - posted_at).total_seconds(), 0))
+
+            for (entry_id, attempts, telegram_id, _, _), result in zip(jobs, results):
+                if not isinstance(result, BaseException):
+                    continue
+                permanent = isinstance(result, (Forbidden, BadRequest)) or attempts >= OUTBOX_MAX_ATTEMPTS
+                values = {'claim_token': None, 'last_error': str(result)[:500]}
+                if permanent:
+                    self.failed += 1
+                    values['status'] = FAILED
+                    logger.error(f"Outbox entry {entry_id} for {telegram_id} failed permanently: {result}")
+                else:
+                    self.retried += 1
+                    values['status'] = PENDING
+                    values['next_attempt_at'] = now + timedelta(seconds=retry_delay(attempts))
+                db.execute(
+                    update(OutboxEntry).where(OutboxEntry.id == entry_id).values(**values)
+                    .execution_options(synchronize_session=False)
+                )
+            db.commit()
+        finally:
+            db.close()
+
+
+outbox_worker = OutboxWorker()
+REGISTRY.on_collect(lambda: QUEUE_DEPTH.labels("outbox_in_flight").set(outbox_worker.in_flight))
@@ -0,0 +1,118 @@
+"""
+Staged processing pipeline with bounded queues
+
+Each stage has its own queue and its own pool of worker tasks. A worker
+takes an item, processes it and emits any number of items into the next
+stage. Queues are bounded, so when a downstream stage lags its queue fills
+up, emits block and the slowdown propagates upstream instead of piling up
+work in memory.
+"""
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from profiling import profiler
+
+logger = logging.getLogger(__name__)
+
+Emit = Callable[[Any], Awaitable[None]]
+Handler = Callable[[Any, Emit], Awaitable[None]]
+
+
+class Stage:
+    """One pipeline stage: a bounded queue drained by `workers` tasks"""
+
+    def __init__(self, name: str, handler: Handler, workers: int = 1, maxsize: int = 100):
+        self.name = name
+        self.handler = handler
+        self.workers = workers
+        self.maxsize = maxsize
+        self.next: Optional["Stage"] = None
+        self.queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self.in_flight = 0
+        self.processed = 0
+        self.failed = 0
+
+    def start(self):
+        self.queue = asyncio.Queue(self.maxsize)
+        self._tasks = [
+            asyncio.create_task(self._worker(), name=f"pipeline-{self.name}-{i}")
+            for i in range(self.workers)
+        ]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def put(self, item):
+        await self.queue.put(item)
+
+    async def _emit(self, item):
+        if self.next is None:
+            raise RuntimeError(f"Stage {self.name} is the last stage and cannot emit")
+        await self.next.put(item)
+
+    async def _worker(self):
+        while True:
+            item = await self.queue.get()
+            self.in_flight += 1
+            try:
+                with profiler.phase(f"stage.{self.name}"):
+                    await self.handler(item, self._emit)
+                self.processed += 1
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Pipeline stage {self.name} failed: {e}")
+            finally:
+                self.in_flight -= 1
+                self.queue.task_done()
+
+    def depth(self) -> dict:
+        return {
+            'queued': self.queue.qsize() if self.queue else 0,
+            'capacity': self.maxsize,
+            'in_flight': self.in_flight,
+            'workers': self.workers,
+            'processed': self.processed,
+            'failed': self.failed,
+        }
+
+
+class Pipeline:
+    """Stages connected in order"""
+
+    def __init__(self, stages: List[Stage]):
+        self.stages = stages
+        for upstream, downstream in zip(stages, stages[1:]):
+            upstream.next = downstream
+
+    @property
+    def running(self) -> bool:
+        return any(stage._tasks for stage in self.stages)
+
+    def start(self):
+        if self.running:
+            return
+        for stage in self.stages:
+            stage.start()
+        logger.info("Pipeline started: " + " → ".join(f"{s.name}×{s.workers}" for s in self.stages))
+
+    async def stop(self):
+        for stage in self.stages:
+            await stage.stop()
+
+    async def submit(self, item):
+        """Feed the first stage; blocks while it is full"""
+        await self.stages[0].put(item)
+
+    async def join(self):
+        """Wait until everything submitted so far went through all stages"""
+        # Upstream items emit before they are marked done, so joining in order is enough
+        for stage in self.stages:
+            await stage.queue.join()
+
+    def depths(self) -> Dict[str, dict]:
+        return {stage.name: stage.depth() for stage in self.stages}
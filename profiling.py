@@ -0,0 +1,289 @@
+"""
+Opt-in profiling hooks (PROFILING_ENABLED)
+
+When enabled, the running process collects:
+
+- SQL: every statement's time, aggregated per statement; statements slower
+  than PROFILING_SLOW_QUERY_MS are logged with their parameters
+- phases: wall time of named code sections (check_and_notify steps,
+  pipeline stages, outbox batches) and of every bot update by command
+- loop lag: a heartbeat task notices when the event loop was blocked, and
+  the sampler thread logs the loop thread's stack while it still is
+- samples: the sampler thread records the loop thread's stack every
+  PROFILING_SAMPLE_MS; the hottest stacks are a cheap sampling profile
+
+Every PROFILING_REPORT_SECONDS the top offenders go to PROFILING_LOG_FILE
+(rotated) and the counters start over. The current window can be dumped
+at any time from the metrics server:
+
+    python profiling.py              # GET /debug/profile on METRICS_PORT
+
+When disabled, phase() returns a shared no-op context manager and nothing
+else is installed.
+"""
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from logging.handlers import RotatingFileHandler
+from typing import Dict, List, Optional
+
+from config import (
+    PROFILING_ENABLED, PROFILING_SLOW_QUERY_MS, PROFILING_SAMPLE_MS,
+    PROFILING_LOOP_LAG_MS, PROFILING_REPORT_SECONDS, PROFILING_LOG_FILE,
+    PROFILING_LOG_MAX_BYTES, METRICS_LISTEN, METRICS_PORT
+)
+
+logger = logging.getLogger(__name__)
+
+# Report lines go here; with a file configured it does not reach the console
+report_logger = logging.getLogger("profiling.report")
+
+MAX_STACK_DEPTH = 30
+MAX_PARAMS_LENGTH = 300
+_NOOP = nullcontext()
+
+
+class Timings:
+    """count / total / max per name, safe to update from any thread"""
+
+    def __init__(self):
+        self._stats: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, name: str, seconds: float):
+        with self._lock:
+            stats = self._stats.get(name)
+            if stats is None:
+                self._stats[name] = [1, seconds, seconds]
+            else:
+                stats[0] += 1
+                stats[1] += seconds
+                stats[2] = max(stats[2], seconds)
+
+    def top(self, limit: int) -> List[tuple]:
+        """(name, count, total, max), largest total first"""
+        with self._lock:
+            rows = [(name, int(s[0]), s[1], s[2]) for name, s in self._stats.items()]
+        return sorted(rows, key=lambda row: row[2], reverse=True)[:limit]
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+def _short(statement: str, length: int = 160) -> str:
+    statement = " ".join(statement.split())
+    return statement if len(statement) <= length else statement[:length] + "…"
+
+
+def _collapse(frame) -> str:
+    """Stack as 'file:function;file:function', outermost first, from the running callback on"""
+    parts = []
+    while frame is not None:
+        code = frame.f_code
+        name = f"{code.co_filename.rsplit('/', 1)[-1]}:{code.co_name}"
+        if name == "events.py:_run":
+            # Everything further out is asyncio's own run loop
+            break
+        parts.append(name)
+        frame = frame.f_back
+    return ";".join(reversed(parts[-MAX_STACK_DEPTH:]))
+
+
+def _is_idle(frame) -> bool:
+    """The loop thread is waiting in select(), not running anything"""
+    return frame is not None and frame.f_code.co_filename.endswith("selectors.py")
+
+
+class Profiler:
+    def __init__(self, enabled: bool = PROFILING_ENABLED):
+        self.enabled = enabled
+        self.sql = Timings()
+        self.phases = Timings()
+        self.slowest_queries: Dict[str, tuple] = {}
+        self.samples = Counter()
+        self.busy_samples = 0
+        self.idle_samples = 0
+        self.lag = Timings()
+        self._heartbeat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._blocked_reported = False
+        self._window_started = time.time()
+        self._lock = threading.Lock()
+        self._tasks: List[asyncio.Task] = []
+        self._sampler: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def phase(self, name: str):
+        """Time a block of code under `name` (a no-op when profiling is off)"""
+        if not self.enabled:
+            return _NOOP
+        return self._timed(name)
+
+    @contextmanager
+    def _timed(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.record(name, time.perf_counter() - started)
+
+    def on_query(self, statement: str, parameters, seconds: float):
+        self.sql.record(statement, seconds)
+        if seconds * 1000 < PROFILING_SLOW_QUERY_MS:
+            return
+        params = repr(parameters)[:MAX_PARAMS_LENGTH]
+        with self._lock:
+            slowest = self.slowest_queries.get(statement)
+            if slowest is None or seconds > slowest[0]:
+                self.slowest_queries[statement] = (seconds, params)
+        report_logger.warning(f"Slow query {seconds * 1000:.0f}ms: {_short(statement)} params={params}")
+
+    def start(self, http_server=None):
+        """Install the hooks in the running event loop; `http_server` gets /debug/profile"""
+        if not self.enabled or self._tasks:
+            return
+        from database import add_query_listener
+
+        _setup_report_log()
+        add_query_listener(self.on_query)
+        self._loop_thread_id = threading.get_ident()
+        self._tasks = [
+            asyncio.create_task(self._heartbeat_loop(), name="profiling-heartbeat"),
+            asyncio.create_task(self._report_loop(), name="profiling-report"),
+        ]
+        self._stop.clear()
+        self._sampler = threading.Thread(target=self._sample_loop, name="profiling-sampler", daemon=True)
+        self._sampler.start()
+        if http_server is not None:
+            http_server.route("GET", "/debug/profile", self._handle_dump)
+        logger.info(f"Profiling enabled (slow queries ≥ {PROFILING_SLOW_QUERY_MS}ms, "
+                    f"sampling every {PROFILING_SAMPLE_MS}ms, loop lag ≥ {PROFILING_LOOP_LAG_MS}ms)")
+
+    async def stop(self):
+        self._stop.set()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _heartbeat_loop(self):
+        interval = PROFILING_LOOP_LAG_MS / 1000 / 2
+        while True:
+            expected = time.monotonic() + interval
+            await asyncio.sleep(interval)
+            now = time.monotonic()
+            self._heartbeat = now
+            lag = now - expected
+            if lag * 1000 >= PROFILING_LOOP_LAG_MS:
+                self.lag.record("event_loop", lag)
+                report_logger.warning(f"Event loop was blocked for {lag * 1000:.0f}ms")
+            self._blocked_reported = False
+
+    def _sample_loop(self):
+        interval = PROFILING_SAMPLE_MS / 1000
+        while not self._stop.wait(interval):
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            if _is_idle(frame):
+                self.idle_samples += 1
+                continue
+            stack = _collapse(frame)
+            with self._lock:
+                self.samples[stack] += 1
+                self.busy_samples += 1
+
+            blocked_for = time.monotonic() - self._heartbeat
+            if blocked_for * 1000 >= PROFILING_LOOP_LAG_MS and not self._blocked_reported:
+                # Caught in the act: this is what keeps the loop busy
+                self._blocked_reported = True
+                report_logger.warning(
+                    f"Event loop blocked for {blocked_for * 1000:.0f}ms so far in:\n"
+                    + "".join(traceback.format_stack(frame, limit=MAX_STACK_DEPTH))
+                )
+
+    async def _report_loop(self):
+        while True:
+            await asyncio.sleep(PROFILING_REPORT_SECONDS)
+            report_logger.info(self.dump())
+            self.reset()
+
+    def reset(self):
+        self.sql.reset()
+        self.phases.reset()
+        self.lag.reset()
+        with self._lock:
+            self.slowest_queries.clear()
+            self.samples.clear()
+            self.busy_samples = 0
+            self.idle_samples = 0
+        self._window_started = time.time()
+
+    def dump(self, limit: int = 15) -> str:
+        """Top offenders since the last report, as text"""
+        window = time.time() - self._window_started
+        lines = [f"=== Profile of the last {window:.0f}s ==="]
+
+        lines.append("\n-- SQL statements by total time (count, total ms, max ms)")
+        for statement, count, total, longest in self.sql.top(limit):
+            lines.append(f"{count:7d} {total * 1000:10.1f} {longest * 1000:9.1f}  {_short(statement)}")
+
+        with self._lock:
+            slowest = sorted(self.slowest_queries.items(), key=lambda item: item[1][0], reverse=True)[:limit]
+            samples = self.samples.most_common(limit)
+            busy, idle = self.busy_samples, self.idle_samples
+        if slowest:
+            lines.append(f"\n-- Slowest statements (≥ {PROFILING_SLOW_QUERY_MS}ms) with parameters")
+            for statement, (seconds, params) in slowest:
+                lines.append(f"{seconds * 1000:9.1f}ms  {_short(statement)}  params={params}")
+
+        lines.append("\n-- Phases and handlers by total time (count, total ms, max ms)")
+        for name, count, total, longest in self.phases.top(limit):
+            lines.append(f"{count:7d} {total * 1000:10.1f} {longest * 1000:9.1f}  {name}")
+
+        lag = self.lag.top(1)
+        if lag:
+            _, count, total, longest = lag[0]
+            lines.append(f"\n-- Event loop blocked {count} time(s), {total * 1000:.0f}ms total, longest {longest * 1000:.0f}ms")
+
+        total_samples = busy + idle
+        lines.append(f"\n-- Event loop samples: {busy} busy / {total_samples} "
+                     f"({busy / total_samples:.0%} busy)" if total_samples else "\n-- No event loop samples")
+        for stack, count in samples:
+            lines.append(f"{count:7d} {count / busy:6.1%}  {stack}")
+        return "\n".join(lines)
+
+    async def _handle_dump(self, request):
+        from httpd import Response
+        return Response(200, self.dump().encode())
+
+
+def _setup_report_log():
+    if not PROFILING_LOG_FILE or report_logger.handlers:
+        return
+    handler = RotatingFileHandler(PROFILING_LOG_FILE, maxBytes=PROFILING_LOG_MAX_BYTES, backupCount=3, encoding="utf-8")
+    handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    report_logger.addHandler(handler)
+    report_logger.setLevel(logging.INFO)
+    report_logger.propagate = False
+
+
+profiler = Profiler()
+
+
+if __name__ == "__main__":
+    import urllib.request
+
+    url = sys.argv[1] if len(sys.argv) > 1 else f"http://{METRICS_LISTEN}:{METRICS_PORT}/debug/profile"
+    try:
+        with urllib.request.urlopen(url, timeout=10) as response:
+            print(response.read().decode())
+    except OSError as e:
+        print(f"Could not read {url}: {e} (is PROFILING_ENABLED=true and METRICS_PORT set?)")
+        sys.exit(1)
@@ -2,18 +2,46 @@
 Scheduler for periodic message checking using asyncio
 """
 import asyncio
+from collections import defaultdict
+from dataclasses import dataclass, asdict
 from datetime import datetime, timezone, timedelta
-from database import SessionLocal, Subscription, ScrapedMessage
-from config import CHECK_INTERVAL_SECONDS
+from typing import Optional
+from database import SessionLocal, ScrapedMessage, MessageSummary, OutboxEntry
+from config import (
+    CHECK_INTERVAL_SECONDS, SCHEDULER_MISSED_TICKS, SCHEDULER_JITTER_SECONDS,
+    SCHEDULER_DRAIN_SECONDS, NEAR_DUP_ENABLED, SUMMARY_DEADLINE_SECONDS,
+    PIPELINE_QUEUE_SIZE, PIPELINE_FETCH_WORKERS, PIPELINE_STORE_WORKERS,
+    PIPELINE_SUMMARIZE_WORKERS, LOG_LEVEL
+)
+from summarizer import summarizer, normalize_tier, DEFAULT_TIER, llm_state, wait_llm_loaded, LLM_LOADING
+from dedup import near_duplicate_index, simhash, to_signed
+from clustering import story_clusterer
+from summary_queue import summary_queue
+from user_cache import user_cache
+from outbox import outbox_worker, enqueue_deliveries, PENDING
+from message_filters import message_filters
+from pipeline import Pipeline, Stage
+from jobs import enqueue, failed_keys, FETCH_JOB, SUMMARIZE_JOB
+from ticker import PeriodicTask, jitter_offset
+from profiling import profiler
+from metrics import (
+    REGISTRY, QUEUE_DEPTH, SCHEDULER_CYCLE_SECONDS, SCHEDULER_LAG_SECONDS, MISSED_TICKS,
+    UNWANTED_POSTS, FILTERED_NOTIFICATIONS
+)
 import logging
 
-logging.basicConfig(level=logging.INFO)
+logging.basicConfig(level=LOG_LEVEL)
 logger = logging.getLogger(__name__)
 
 # Global bot instance and scraper
 _bot_instance = None
 _scraper = None
-_scheduler_task = None
+# Periodic tasks started by start_scheduler
+_periodic_tasks = []
+_dedup_warmed = False
+_outbox_resumed = False
+# Channels waiting in or being processed by the fetch stage
+_queued_channels = set()
 
 def set_bot_instance(bot):
     """Set the bot instance for sending messages"""
@@ -31,146 +59,552 @@ def get_scraper():
     return _scraper
 
 
-async def send_summary(user_id: int, channel_title: str, message_text: str, link: str):
-    """Send summarized message to user"""
-    global _bot_instance
-    if not _bot_instance:
-        logger.error("Bot instance not set")
-        return
-    
+def get_channel_recipients(db, subscriptions):
+    """
+    Resolve subscribers of one channel with their summary tier
+
+    Returns:
+        List of (subscription, user, tier) tuples for active users
+    """
+    entries = user_cache.get_many_by_id(db, {sub.user_id for sub in subscriptions})
+    recipients = []
+    for sub in subscriptions:
+        entry = entries.get(sub.user_id)
+        if entry is None or not entry.user.is_active:
+            continue
+        tier = normalize_tier(entry.settings.summary_length if entry.settings else None)
+        recipients.append((sub, entry.user, tier))
+    return recipients
+
+
+def store_summaries(db, scraped_msg, summaries: dict):
+    """Persist tier summaries; the medium tier also fills ScrapedMessage.summary"""
+    for tier, text in summaries.items():
+        db.add(MessageSummary(scraped_message_id=scraped_msg.id, tier=tier, text=text))
+    if DEFAULT_TIER in summaries:
+        scraped_msg.summary = summaries[DEFAULT_TIER]
+    scraped_msg.is_summarized = True
+
+
+def reuse_summaries(db, original_id: int, tiers: set, text: str) -> dict:
+    """Take tier summaries from the original post, computing only tiers it lacks"""
+    summaries = {
+        row.tier: row.text for row in db.query(MessageSummary).filter(
+            MessageSummary.scraped_message_id == original_id,
+            MessageSummary.tier.in_(tiers)
+        ).all()
+    }
+    missing = tiers - set(summaries)
+    if missing:
+        original = db.query(ScrapedMessage).filter(ScrapedMessage.id == original_id).first()
+        summaries.update(summarizer.summarize_tiers(original.text if original else text, missing))
+    return summaries
+
+
+@dataclass
+class FetchTask:
+    """A channel to fetch, with its active subscriptions"""
+    channel_id: str
+    subscriptions: list
+
+
+@dataclass
+class FetchedChannel:
+    channel_id: str
+    subscriptions: list
+    messages: list
+
+
+@dataclass
+class StoredPost:
+    """A new post saved to the database, waiting for its summaries"""
+    scraped_msg_id: int
+    text: str
+    posted_at: datetime
+    channel_id: str
+    tiers: set
+    subscribers: int
+    original_id: Optional[int] = None
+
+    def to_payload(self) -> dict:
+        """JSON-safe form for a summarize job"""
+        payload = asdict(self)
+        payload['posted_at'] = self.posted_at.isoformat() if self.posted_at else None
+        payload['tiers'] = sorted(self.tiers)
+        return payload
+
+    @classmethod
+    def from_payload(cls, payload: dict) -> "StoredPost":
+        posted_at = payload.get('posted_at')
+        return cls(**{
+            **payload,
+            'posted_at': datetime.fromisoformat(posted_at) if posted_at else None,
+            'tiers': set(payload['tiers']),
+        })
+
+
+async def fetch_stage(task: FetchTask, emit):
+    """Fetch new messages of one channel"""
     try:
-        from summarizer import summarizer
-        summary = summarizer.summarize_text(message_text)
-        
-        formatted_msg = f"""
-📌 {channel_title}
-🕒 {datetime.now(timezone.utc).strftime('%H:%M')}
+        messages = await _scraper.get_channel_messages(
+            task.channel_id,
+            limit=20,
+            since_hours=1
+        )
+    finally:
+        # The next cycle may queue this channel again
+        _queued_channels.discard(task.channel_id)
 
-📝 Краткое содержание:
-"{summary}"
+    if messages:
+        await emit(FetchedChannel(task.channel_id, task.subscriptions, messages))
 
-🔗 Исходное сообщение: {link}
-"""
+
+async def store_stage(fetched: FetchedChannel, emit):
+    """
+    Save new messages, detect near-duplicates and queue their notifications
+
+    Each post goes only to subscribers whose filters (message_filters.py)
+    accept it, and is summarized once per distinct summary tier among them,
+    regardless of how many users follow it; a post nobody wants is stored
+    but not summarized. Near-duplicates of posts already seen in another channel reuse the
+    original's summaries and are not sent again to users who already
+    received the original. Notifications go to the outbox in the same
+    transaction as the post, so a crash never loses them.
+    """
+    global _dedup_warmed
+
+    channel_id = fetched.channel_id
+    channel_subs = fetched.subscriptions
+    channel_title = channel_subs[0].channel_title
+    posts = []
+
+    db = SessionLocal()
+    try:
+        if NEAR_DUP_ENABLED and not _dedup_warmed:
+            near_duplicate_index.warm(db)
+            _dedup_warmed = True
+
+        recipients = get_channel_recipients(db, channel_subs)
+        if not recipients:
+            return
+        message_filters.refresh(db)
+        if message_filters.has_filters(recipients):
+            # Matched in one go off the event loop, before anything is written
+            matches = await message_filters.match_texts([msg['text'] for msg in fetched.messages])
+        else:
+            matches = [frozenset()] * len(fetched.messages)
+
+        for msg, found in zip(fetched.messages, matches):
+            logger.debug(f"Checking message ID={msg['message_id']} from channel {channel_id}")
+
+            existing = db.query(ScrapedMessage).filter(
+                ScrapedMessage.message_id == msg['message_id'],
+                ScrapedMessage.channel_id == channel_id
+            ).first()
+            
+            if existing:
+                logger.debug(f"Message {msg['message_id']} already exists, skipping")
+                continue
+            
+            logger.info(f"Saving new message ID={msg['message_id']} from {channel_title}: {msg['text'][:50]}...")
+
+            scraped_msg = ScrapedMessage(
+                subscription_id=channel_subs[0].id,
+                channel_id=channel_id,
+                channel_title=channel_title,
+                message_id=msg['message_id'],
+                text=msg['text'],
+                link=msg['link'] or "",
+                timestamp=msg['date'],
+                processed_at=datetime.now(timezone.utc)
+            )
+            db.add(scraped_msg)
+            db.flush()
+
+            fingerprint = simhash(msg['text']) if NEAR_DUP_ENABLED else None
+            original = near_duplicate_index.find(fingerprint)
+
+            if fingerprint is not None:
+                scraped_msg.simhash = to_signed(fingerprint)
+
+            if original:
+                logger.info(f"Message {msg['message_id']} from {channel_title} duplicates "
+                            f"message #{original.post_id} from {original.channel_title}")
+                scraped_msg.duplicate_of = original.post_id
+
+            wanted = message_filters.filter_recipients(found, channel_id, recipients)
+            if len(wanted) < len(recipients):
+                FILTERED_NOTIFICATIONS.inc(len(recipients) - len(wanted))
+
+            # The in-memory claim skips users already notified about the story
+            # cheaply; the outbox key (story, user) is what makes it durable
+            deliveries = [
+                (user.telegram_id, sub.channel_title, tier)
+                for sub, user, tier in wanted
+                if original is None or user.telegram_id not in original.notified_users
+            ]
+            story_id = original.post_id if original else scraped_msg.id
+            deliveries = enqueue_deliveries(db, scraped_msg, story_id, deliveries)
+
+            # Message, dedup fields and outbox entries commit together
+            db.commit()
+
+            story = original or near_duplicate_index.add(
+                fingerprint, scraped_msg.id, channel_id, channel_title
+            )
+            if story is not None:
+                story.notified_users.update(telegram_id for telegram_id, _, _ in deliveries)
+
+            if not wanted:
+                # Kept for deduplication and digests, but not worth a summary
+                UNWANTED_POSTS.inc()
+                continue
+
+            posts.append(StoredPost(
+                scraped_msg.id,
+                msg['text'],
+                msg['date'],
+                channel_id,
+                {tier for _, _, tier in wanted},
+                len(deliveries),
+                original.post_id if original else None
+            ))
         
-        await _bot_instance.send_message(chat_id=user_id, text=formatted_msg)
-    except Exception as e:
-        logger.error(f"Error sending summary: {e}")
+        logger.info(f"Processed {len(fetched.messages)} messages from {channel_title}")
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+    for post in posts:
+        await emit(post)
+
+
+async def summarize_stage(post: StoredPost, emit):
+    """
+    Summarize a stored post through the priority queue and save the summaries
+
+    Several workers keep several posts in the summary queue at once, so its
+    priority order (fresh, popular, fair across channels) decides what runs first.
+    """
+    text = post.text
+    tiers = post.tiers
+    fast = lambda: summarizer.summarize_tiers_fast(text, tiers)
+
+    if llm_state() == LLM_LOADING:
+        # The model is still loading at startup: wait for it, but not past the deadline
+        await wait_llm_loaded(SUMMARY_DEADLINE_SECONDS)
+
+    def work():
+        if llm_state() == LLM_LOADING:
+            return fast()
+        if post.original_id is None:
+            return summarizer.summarize_tiers(text, tiers)
+        db = SessionLocal()
+        try:
+            return reuse_summaries(db, post.original_id, tiers, text)
+        finally:
+            db.close()
+
+    summaries = await summary_queue.submit(
+        work,
+        fallback=fast,
+        channel_id=post.channel_id,
+        posted_at=post.posted_at,
+        subscribers=post.subscribers
+    )
+
+    db = SessionLocal()
+    try:
+        scraped_msg = db.get(ScrapedMessage, post.scraped_msg_id)
+        store_summaries(db, scraped_msg, summaries)
+        db.commit()
+    finally:
+        db.close()
+
+    # Incremental story assignment keeps /digest from clustering from scratch
+    story_clusterer.assign(post.scraped_msg_id, text, post.posted_at)
+
+    # The post's outbox entries are now ready to send
+    outbox_worker.notify()
+
+
+def pending_posts(db) -> list:
+    """
+    Stored posts whose summaries were never saved (the process stopped
+    between the store and summarize stages), rebuilt from their outbox entries
+    """
+    tiers = defaultdict(set)
+    subscribers = defaultdict(int)
+    for message_id, tier in db.query(OutboxEntry.scraped_message_id, OutboxEntry.tier).join(
+        ScrapedMessage, ScrapedMessage.id == OutboxEntry.scraped_message_id
+    ).filter(
+        OutboxEntry.status == PENDING,
+        ScrapedMessage.is_summarized == False
+    ).all():
+        tiers[message_id].add(tier)
+        subscribers[message_id] += 1
+    if not tiers:
+        return []
+
+    return [
+        StoredPost(
+            msg.id,
+            msg.text,
+            msg.timestamp,
+            str(msg.channel_id),
+            tiers[msg.id],
+            subscribers[msg.id],
+            msg.duplicate_of
+        )
+        for msg in db.query(ScrapedMessage).filter(ScrapedMessage.id.in_(tiers)).all()
+    ]
+
+
+async def resume_pending():
+    """Send unsummarized posts with pending notifications back to the summarize stage"""
+    db = SessionLocal()
+    try:
+        posts = pending_posts(db)
+    finally:
+        db.close()
+
+    summarize = ingest_pipeline.stages[2]
+    for post in posts:
+        await summarize.put(post)
+    if posts:
+        logger.info(f"Resumed {len(posts)} post(s) waiting for summaries")
+
+
+ingest_pipeline = Pipeline([
+    Stage("fetch", fetch_stage, PIPELINE_FETCH_WORKERS, PIPELINE_QUEUE_SIZE),
+    Stage("store", store_stage, PIPELINE_STORE_WORKERS, PIPELINE_QUEUE_SIZE),
+    Stage("summarize", summarize_stage, PIPELINE_SUMMARIZE_WORKERS, PIPELINE_QUEUE_SIZE),
+])
 
 
 async def check_and_notify():
     """
-    Main task: check channels for new messages and send summaries
+    Main task: queue every subscribed channel for fetching
+
+    Subscriptions are grouped by channel, so each channel is fetched once.
+    The work itself runs in the fetch → store → summarize pipeline, and
+    the outbox worker sends the notifications; when a downstream stage
+    lags, its queue fills up and this function blocks instead of fetching more.
     """
-    global _scraper
+    global _scraper, _outbox_resumed
 
     if not _scraper:
         logger.error("Scraper instance not set")
         return
 
     logger.info("Starting scheduled check...")
+    ingest_pipeline.start()
+
+    if not _outbox_resumed:
+        _outbox_resumed = True
+        try:
+            with profiler.phase("check.resume_pending"):
+                await resume_pending()
+        except Exception as e:
+            logger.error(f"Error resuming pending posts: {e}")
     
     db = SessionLocal()
-
     try:
-        subscriptions = db.query(Subscription).filter(
-            Subscription.is_active == True
-        ).all()
-        
-        for sub in subscriptions:
-            try:
-                messages = await _scraper.get_channel_messages(
-                    sub.channel_id,
-                    limit=20,
-                    since_hours=1
-                )
-                
-                if not messages:
-                    continue
-                
-                from database import User
-                user = db.query(User).filter(User.id == sub.user_id).first()
-                
-                if not user:
-                    continue
-                
-                for msg in messages:
-                    logger.debug(f"Checking message ID={msg['message_id']} from channel {sub.channel_id}")
-
-                    existing = db.query(ScrapedMessage).filter(
-                        ScrapedMessage.message_id == msg['message_id'],
-                        ScrapedMessage.channel_id == str(sub.channel_id)
-                    ).first()
-                    
-                    if existing:
-                        logger.debug(f"Message {msg['message_id']} already exists, skipping")
-                        continue
-                    
-                    logger.info(f"Saving new message ID={msg['message_id']} from {sub.channel_title}: {msg['text'][:50]}...")
-
-                    scraped_msg = ScrapedMessage(
-                        subscription_id=sub.id,
-                        channel_id=str(sub.channel_id),
-                        channel_title=sub.channel_title,
-                        message_id=msg['message_id'],
-                        text=msg['text'],
-                        link=msg['link'] or "",
-                        timestamp=msg['date'],
-                        processed_at=datetime.now(timezone.utc)
-                    )
-                    db.add(scraped_msg)
-                    db.commit()
-                    
-                    await send_summary(
-                        user.telegram_id,
-                        sub.channel_title,
-                        msg['text'],
-                        msg['link'] or ""
-                    )
-                
-                logger.info(f"Processed {len(messages)} messages from {sub.channel_title}")
-                
-            except Exception as e:
-                logger.error(f"Error processing channel {sub.channel_id}: {e}")
-                continue
-    
+        with profiler.phase("check.load_subscriptions"):
+            subscriptions = user_cache.active_subscriptions(db)
     except Exception as e:
         logger.error(f"Error in scheduled check: {e}")
+        return
     finally:
         db.close()
 
+    by_channel = defaultdict(list)
+    for sub in subscriptions:
+        by_channel[str(sub.channel_id)].append(sub)
 
-async def scheduler_loop():
-    """Main scheduler loop"""
-    logger.info("Scheduler loop started")
-    
-    while True:
+    # Each channel is fetched at its own fixed offset into the cycle
+    loop = asyncio.get_running_loop()
+    cycle_start = loop.time()
+    spread = jitter_spread()
+    queued = 0
+    for offset, channel_id in sorted((jitter_offset(channel_id, spread), channel_id) for channel_id in by_channel):
+        if channel_id in _queued_channels:
+            # Still waiting from the previous cycle
+            continue
+        delay = cycle_start + offset - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        _queued_channels.add(channel_id)
+        # Time spent here is backpressure from a full fetch queue
+        with profiler.phase("check.submit"):
+            await ingest_pipeline.submit(FetchTask(channel_id, by_channel[channel_id]))
+        queued += 1
+
+    logger.debug(f"Queued {queued} channel(s), pipeline: {ingest_pipeline.depths()}")
+
+
+def _collect(items: list):
+    """Emit callback that keeps the items instead of passing them on"""
+    async def emit(item):
+        items.append(item)
+    return emit
+
+
+def summarize_job_key(post: StoredPost) -> str:
+    return f"summarize:{post.scraped_msg_id}"
+
+
+def enqueue_fetch_jobs():
+    """
+    Multi-process counterpart of check_and_notify, run by the lease holder
+
+    Queues a fetch job for every subscribed channel that has none pending,
+    and a summarize job for every stored post whose job was lost (its
+    scraper stopped between storing the post and queueing the job). Posts
+    whose summarize job failed JOB_MAX_ATTEMPTS times are not retried.
+    """
+    db = SessionLocal()
+    try:
+        channels = {str(sub.channel_id) for sub in user_cache.active_subscriptions(db)}
+        spread = jitter_spread()
+        queued = sum(
+            enqueue(
+                db, FETCH_JOB, {'channel_id': channel_id},
+                key=f"fetch:{channel_id}", delay=jitter_offset(channel_id, spread)
+            )
+            for channel_id in sorted(channels)
+        )
+        given_up = failed_keys(db, SUMMARIZE_JOB)
+        resumed = sum(
+            enqueue(db, SUMMARIZE_JOB, post.to_payload(), key=summarize_job_key(post))
+            for post in pending_posts(db)
+            if summarize_job_key(post) not in given_up
+        )
+        db.commit()
+    finally:
+        db.close()
+
+    logger.info(f"Queued {queued} fetch job(s)" + (f", resumed {resumed} summarize job(s)" if resumed else ""))
+
+
+async def run_fetch_job(payload: dict):
+    """Fetch and store one channel, then queue its new posts for the summarizers"""
+    channel_id = payload['channel_id']
+    db = SessionLocal()
+    try:
+        channel_subs = [sub for sub in user_cache.active_subscriptions(db) if str(sub.channel_id) == channel_id]
+    finally:
+        db.close()
+    if not channel_subs:
+        return
+
+    fetched, posts = [], []
+    await fetch_stage(FetchTask(channel_id, channel_subs), _collect(fetched))
+    for item in fetched:
+        await store_stage(item, _collect(posts))
+    if not posts:
+        return
+
+    db = SessionLocal()
+    try:
+        for post in posts:
+            enqueue(db, SUMMARIZE_JOB, post.to_payload(), key=summarize_job_key(post))
+        db.commit()
+    finally:
+        db.close()
+
+
+async def run_summarize_job(payload: dict):
+    await summarize_stage(StoredPost.from_payload(payload), None)
+
+
+def jitter_spread() -> float:
+    """Window channel fetches are spread over; at most half a cycle"""
+    return min(SCHEDULER_JITTER_SECONDS, CHECK_INTERVAL_SECONDS / 2)
+
+
+def start_scheduler(lease=None):
+    """
+    Start the scheduler in the current event loop
+
+    Checks run at a fixed rate (see ticker.py). Without a lease everything
+    runs in this process. With one (multi-process mode) the lease is renewed
+    several times per TTL, and only while it is held do checks queue fetch
+    jobs instead of fetching here.
+    """
+    if _periodic_tasks:
+        return
+
+    if lease is None:
+        check = check_and_notify
+    else:
+        async def check():
+            if lease.held:
+                with profiler.phase("check.enqueue_fetch_jobs"):
+                    enqueue_fetch_jobs()
+
+        async def renew():
+            lease.acquire()
+
+        _periodic_tasks.append(PeriodicTask(f"{lease.name}-lease", lease.ttl / 3, renew))
+
+    _periodic_tasks.append(PeriodicTask("scheduler", CHECK_INTERVAL_SECONDS, check, SCHEDULER_MISSED_TICKS))
+    for task in _periodic_tasks:
+        task.start()
+    logger.info(f"Scheduler started (check every {CHECK_INTERVAL_SECONDS} seconds, "
+                f"missed ticks: {SCHEDULER_MISSED_TICKS}, jitter {jitter_spread():.0f}s"
+                + (f", {lease.name} lease {lease.holder})" if lease else ")"))
+
+
+async def stop_scheduler(timeout: float = SCHEDULER_DRAIN_SECONDS):
+    """
+    Stop the scheduler gracefully
+
+    No new checks start; a check in progress and the work already in the
+    pipeline get `timeout` seconds to finish before they are cancelled.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while _periodic_tasks:
+        await _periodic_tasks.pop().stop(max(deadline - loop.time(), 0))
+
+    if ingest_pipeline.running:
         try:
-            await check_and_notify()
-        except Exception as e:
-            logger.error(f"Error in scheduler loop: {e}")
-        
-        # Wait for next check interval
-        await asyncio.sleep(CHECK_INTERVAL_SECONDS)
+            await asyncio.wait_for(ingest_pipeline.join(), max(deadline - loop.time(), 0))
+        except asyncio.TimeoutError:
+            logger.warning(f"Pipeline not drained within {timeout}s: {ingest_pipeline.depths()}")
+        await ingest_pipeline.stop()
+    logger.info("Scheduler stopped")
 
 
-def start_scheduler():
-    """Start the scheduler in the current event loop"""
-    global _scheduler_task
-    _scheduler_task = asyncio.create_task(scheduler_loop())
-    logger.info(f"Scheduler started (check every {CHECK_INTERVAL_SECONDS} seconds)")
+def scheduler_stats() -> dict:
+    """Cycle duration, lag and missed ticks of the scheduler's periodic tasks"""
+    return {task.name: task.stats() for task in _periodic_tasks}
 
 
-def stop_scheduler():
-    """Stop the scheduler"""
-    global _scheduler_task
-    if _scheduler_task:
-        _scheduler_task.cancel()
-        logger.info("Scheduler stopped")
+def _collect_metrics():
+    for name, depth in ingest_pipeline.depths().items():
+        QUEUE_DEPTH.labels(f"pipeline_{name}").set(depth['queued'] + depth['in_flight'])
+    for task in _periodic_tasks:
+        SCHEDULER_CYCLE_SECONDS.labels(task.name).set(task.last_duration)
+        SCHEDULER_LAG_SECONDS.labels(task.name).set(task.last_lag)
+        MISSED_TICKS.labels(task.name).set(task.missed)
+
+
+REGISTRY.on_collect(_collect_metrics)
 
 
 if __name__ == "__main__":
-    start_scheduler()
+    async def _main():
+        start_scheduler()
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await stop_scheduler()
+
     try:
-        asyncio.get_event_loop().run_forever()
+        asyncio.run(_main())
     except KeyboardInterrupt:
-        stop_scheduler()
\ No newline at end of file
+        pass
@@ -1,23 +1,37 @@
-from telethon import TelegramClient
-from telethon.errors import FloodWaitError, RPCError
-from telethon.tl.types import Channel, Chat
 from datetime import datetime, timedelta, timezone
 import asyncio
 import logging
+import time
 from typing import List, Dict, Optional
 from database import SessionLocal, ScrapedMessage, Subscription
-from config import API_ID, API_HASH, SESSION_NAME
+from config import API_ID, API_HASH, SESSION_NAME, LOG_LEVEL
+from metrics import MESSAGES_FETCHED, FETCH_SECONDS, FETCH_ERRORS, FLOOD_WAIT_SECONDS
 
-logging.basicConfig(level=logging.INFO)
+logging.basicConfig(level=LOG_LEVEL)
 logger = logging.getLogger(__name__)
 
 
 class ChannelScraper:
-    """Class for scraping messages from Telegram channels using Telethon"""
+    """
+    Class for scraping messages from Telegram channels using Telethon
+
+    Telethon takes a noticeable part of startup to import, so it is imported
+    when a scraper is created rather than with this module.
+    """
     
-    def __init__(self):
-        self.client = TelegramClient(SESSION_NAME, API_ID, API_HASH)
+    def __init__(self, client=None):
+        """
+        Args:
+            client: Telethon client to use instead of a new one (e.g. a fake in simulation.py)
+        """
+        if client is None:
+            from telethon import TelegramClient
+            client = TelegramClient(SESSION_NAME, API_ID, API_HASH)
+        self.client = client
         self.last_check_time = {}
+        self._channels = None
+        self._channels_fetched_at = 0.0
+        self._channels_lock = asyncio.Lock()
     
     async def connect(self):
         """Connect to Telegram using Telethon"""
@@ -39,31 +53,43 @@ class ChannelScraper:
             logger.error(f"Connection error: {e}")
             raise
     
-    async def get_user_channels(self) -> List[Dict]:
+    async def get_user_channels(self, max_age: float = 0) -> List[Dict]:
         """
         Get all channels the user has access to
         
+        Args:
+            max_age: Reuse the last fetched list if it is at most this many seconds old
+        
         Returns:
             List of channel dictionaries with id, title, access_hash
         """
-        try:
-            dialogs = await self.client.get_dialogs()
-            channels = []
-            
-            for dialog in dialogs:
-                entity = dialog.entity
-                if isinstance(entity, Channel):
-                    channels.append({
-                        'id': entity.id,
-                        'title': entity.title,
-                        'username': entity.username,
-                        'access_hash': entity.access_hash if hasattr(entity, 'access_hash') else None
-                    })
-            
-            return channels
-        except Exception as e:
-            logger.error(f"Error getting channels: {e}")
-            return []
+        from telethon.tl.types import Channel
+
+        # One get_dialogs at a time: concurrent callers share its result
+        async with self._channels_lock:
+            if self._channels is not None and time.monotonic() - self._channels_fetched_at <= max_age:
+                return self._channels
+
+            try:
+                dialogs = await self.client.get_dialogs()
+                channels = []
+                
+                for dialog in dialogs:
+                    entity = dialog.entity
+                    if isinstance(entity, Channel):
+                        channels.append({
+                            'id': entity.id,
+                            'title': entity.title,
+                            'username': entity.username,
+                            'access_hash': entity.access_hash if hasattr(entity, 'access_hash') else None
+                        })
+                
+                self._channels = channels
+                self._channels_fetched_at = time.monotonic()
+                return channels
+            except Exception as e:
+                logger.error(f"Error getting channels: {e}")
+                return []
     
     async def get_channel_messages(
         self, 
@@ -82,10 +108,13 @@ class ChannelScraper:
         Returns:
             List of message dictionaries
         """
+        from telethon.errors import FloodWaitError, RPCError
+
         messages = []
         cutoff_time = datetime.now(timezone.utc) - timedelta(hours=since_hours)
 
         logger.info(f"Reading channel {channel_id}, limit={limit}, since_hours={since_hours}")
+        started = time.perf_counter()
 
         try:
             # Handle different channel ID formats
@@ -133,17 +162,23 @@ class ChannelScraper:
                     # Messages are ordered by date descending, so we can break early
                     break
 
+            FETCH_SECONDS.observe(time.perf_counter() - started)
+            MESSAGES_FETCHED.labels(channel_id).inc(msg_count)
             logger.info(f"Retrieved {msg_count} messages from {entity.title}")
             return messages
         except FloodWaitError as e:
             logger.warning(f"Flood wait: {e.seconds} seconds")
+            FETCH_ERRORS.labels("flood_wait").inc()
+            FLOOD_WAIT_SECONDS.inc(e.seconds)
             await asyncio.sleep(e.seconds)
             return []
         except RPCError as e:
             logger.error(f"RPC error: {e}")
+            FETCH_ERRORS.labels("rpc").inc()
             return []
         except Exception as e:
             logger.error(f"Error getting messages from channel {channel_id}: {e}")
+            FETCH_ERRORS.labels("other").inc()
             return []
     
     async def check_new_messages(self) -> Dict[str, List[Dict]]:
@@ -0,0 +1,509 @@
+#!/usr/bin/env python3
+"""
+Load simulation of the whole service without Telegram
+
+Runs the real scheduler, scraper, pipeline, outbox and delivery code, and
+the bot's /start and /subscribe handlers for a sample of users, against a
+temporary SQLite database. Telegram is replaced by two fakes:
+
+- FakeTelegramClient (Telethon) generates channel traffic: each channel
+  posts at its own rate (log-normal across channels, Poisson in time),
+  sometimes in bursts, sometimes cross-posts another channel's text, and
+  answers a share of requests with FloodWait
+- FakeBot (Bot API) enforces the send limits, per chat and global, by
+  raising RetryAfter the way Telegram does
+
+Subscriptions follow a Zipf popularity curve: a few channels have most of
+the subscribers. Users beyond --onboard-users are inserted directly, since
+going through the handlers for every one of them would take longer than
+the simulation itself.
+
+After --duration seconds the channels go quiet and the run waits (up to
+--drain seconds) for the pipeline, the outbox and the delivery queues to
+empty. Reports throughput, post-to-notification latency percentiles, RPC
+counts, send limit hits, backlogs and peak RSS as JSON.
+
+Examples:
+    python simulation.py
+    python simulation.py --channels 2000 --users 10000 --duration 300
+    python simulation.py --time-scale 10 --set CHECK_INTERVAL_SECONDS=30 --set PIPELINE_FETCH_WORKERS=8
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+from collections import Counter, deque
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+from benchmark import BUNDLED_CORPUS, apply_overrides, percentile, peak_rss_mb
+
+# Messages a fake channel keeps; the scraper reads at most 20 per check
+CHANNEL_HISTORY = 50
+LINK_PATTERN = re.compile(r"https://t\.me/(\w+)/(\d+)")
+TIERS = ("short", "medium", "long")
+
+
+def latency_summary(values) -> dict:
+    values = sorted(values)
+    return {
+        'count': len(values),
+        'p50': round(percentile(values, 0.50), 3),
+        'p95': round(percentile(values, 0.95), 3),
+        'p99': round(percentile(values, 0.99), 3),
+        'max': round(values[-1], 3) if values else 0.0,
+    }
+
+
+class TextGenerator:
+    """Random Russian-looking posts built from the benchmark corpus vocabulary"""
+
+    def __init__(self, rng: random.Random, duplicate_rate: float):
+        self.rng = rng
+        self.duplicate_rate = duplicate_rate
+        self.words = sorted({word.strip(".,:;%").lower() for text in BUNDLED_CORPUS for word in text.split()} - {""})
+        self._recent = deque(maxlen=200)
+        self.duplicates = 0
+
+    def next(self) -> str:
+        if self._recent and self.rng.random() < self.duplicate_rate:
+            # Cross-posted news: the same story in another channel
+            self.duplicates += 1
+            return self.rng.choice(self._recent)
+        sentences = []
+        for _ in range(self.rng.randint(2, 5)):
+            words = self.rng.choices(self.words, k=self.rng.randint(8, 16))
+            sentences.append(" ".join(words).capitalize() + ".")
+        text = " ".join(sentences)
+        self._recent.append(text)
+        return text
+
+
+class SimulatedChannel:
+    def __init__(self, number: int, rate: float):
+        self.entity = None
+        self.username = f"sim_ch{number}"
+        self.rate = rate
+        self.messages = deque(maxlen=CHANNEL_HISTORY)
+        self.next_id = 1
+        self.next_post_at = None
+
+
+class FakeTelegramClient:
+    """
+    Stand-in for telethon.TelegramClient with generated channel traffic
+
+    Posts are generated lazily, when a channel is read: every post that
+    would have appeared since the previous read is created with its own
+    publication time. Only the methods ChannelScraper uses are provided.
+    """
+
+    def __init__(self, args, rng: random.Random):
+        from telethon.tl.types import Channel, ChatPhotoEmpty
+
+        self.rng = rng
+        self.args = args
+        self.texts = TextGenerator(rng, args.duplicate_rate)
+        self.rpc = Counter()
+        self.flood_waits = 0
+        self.flood_wait_seconds = 0
+        self.posts = 0
+        self.burst_posts = 0
+        self.posted_at = {}
+        self.generating = True
+        self._resolved = set()
+
+        # Median rate from --posts-per-hour, spread log-normally across channels
+        median = args.posts_per_hour / 3600 * args.time_scale
+        self.channels = {}
+        now = datetime.now(timezone.utc)
+        for number in range(1, args.channels + 1):
+            channel = SimulatedChannel(number, median * rng.lognormvariate(0, 1))
+            channel.entity = Channel(
+                id=1_000_000 + number, title=f"Канал {number}", photo=ChatPhotoEmpty(), date=now,
+                broadcast=True, access_hash=rng.getrandbits(63), username=channel.username
+            )
+            self.channels[channel.username] = channel
+
+    async def connect(self):
+        pass
+
+    async def is_user_authorized(self):
+        return True
+
+    async def disconnect(self):
+        pass
+
+    async def _call(self, method: str):
+        """One MTProto request: latency, accounting and the occasional FloodWait"""
+        from telethon.errors import FloodWaitError
+
+        self.rpc[method] += 1
+        await asyncio.sleep(self.rng.uniform(0.5, 1.5) * self.args.rpc_latency)
+        if self.rng.random() < self.args.flood_wait_rate:
+            seconds = self.rng.randint(1, self.args.flood_wait_seconds)
+            self.flood_waits += 1
+            self.flood_wait_seconds += seconds
+            raise FloodWaitError(None, capture=seconds)
+
+    async def get_dialogs(self):
+        await self._call("messages.getDialogs")
+        return [SimpleNamespace(entity=channel.entity) for channel in self.channels.values()]
+
+    async def get_entity(self, peer):
+        username = str(peer).lstrip("@")
+        channel = self.channels.get(username)
+        if username not in self._resolved:
+            # Telethon caches resolved entities in the session
+            await self._call("contacts.resolveUsername")
+            self._resolved.add(username)
+        if channel is None:
+            raise ValueError(f'No user has "{username}" as username')
+        return channel.entity
+
+    async def iter_messages(self, entity, limit: int = 100):
+        channel = self.channels[entity.username]
+        await self._call("messages.getHistory")
+        self._generate(channel)
+        for message in list(reversed(channel.messages))[:limit]:
+            yield message
+
+    def _generate(self, channel: SimulatedChannel):
+        now = time.monotonic()
+        if channel.next_post_at is None:
+            channel.next_post_at = now + self.rng.expovariate(channel.rate)
+        while self.generating and channel.next_post_at <= now:
+            count = 1
+            if self.rng.random() < self.args.burst_probability:
+                count = self.rng.randint(3, 15)
+                self.burst_posts += count
+            for _ in range(count):
+                self._post(channel, now - channel.next_post_at)
+            channel.next_post_at += self.rng.expovariate(channel.rate)
+
+    def _post(self, channel: SimulatedChannel, age: float):
+        posted_at = datetime.now(timezone.utc) - timedelta(seconds=age)
+        message = SimpleNamespace(
+            id=channel.next_id, text=self.texts.next(), date=posted_at, sender_id=None, media=None
+        )
+        channel.next_id += 1
+        channel.messages.append(message)
+        self.posted_at[(channel.username, message.id)] = posted_at
+        self.posts += 1
+
+    def stats(self) -> dict:
+        return {
+            'posts_generated': self.posts,
+            'burst_posts': self.burst_posts,
+            'cross_posts': self.texts.duplicates,
+            'requests': dict(self.rpc),
+            'flood_waits': self.flood_waits,
+            'flood_wait_seconds': self.flood_wait_seconds,
+        }
+
+
+class FakeBot:
+    """
+    Stand-in for telegram.Bot that enforces the Bot API send limits
+
+    More than --chat-rate messages a second to one chat, or more than
+    --global-rate in total, get RetryAfter instead of being sent.
+    """
+
+    def __init__(self, args, rng: random.Random, posted_at: dict):
+        self.args = args
+        self.rng = rng
+        self.posted_at = posted_at
+        self.calls = 0
+        self.sent = 0
+        self.retry_after = Counter()
+        self.notification_latencies = []
+        self._recent = deque()
+        self._last_sent = {}
+
+    async def send_message(self, chat_id: int, text: str, **kwargs):
+        from telegram.error import RetryAfter
+
+        self.calls += 1
+        await asyncio.sleep(self.rng.uniform(0.5, 1.5) * self.args.send_latency)
+        now = time.monotonic()
+        while self._recent and now - self._recent[0] >= 1:
+            self._recent.popleft()
+        if len(self._recent) >= self.args.global_rate:
+            self.retry_after["global"] += 1
+            raise RetryAfter(1)
+        last = self._last_sent.get(chat_id)
+        if last is not None and now - last < 1 / self.args.chat_rate:
+            self.retry_after["chat"] += 1
+            raise RetryAfter(math.ceil(1 / self.args.chat_rate))
+
+        self._recent.append(now)
+        self._last_sent[chat_id] = now
+        self.sent += 1
+        wall_now = datetime.now(timezone.utc)
+        for username, message_id in LINK_PATTERN.findall(text):
+            posted_at = self.posted_at.get((username, int(message_id)))
+            if posted_at is not None:
+                self.notification_latencies.append((wall_now - posted_at).total_seconds())
+        return SimpleNamespace(message_id=self.sent, chat_id=chat_id, text=text)
+
+    def stats(self) -> dict:
+        return {
+            'send_calls': self.calls,
+            'sent': self.sent,
+            'retry_after': dict(self.retry_after),
+            'notifications': len(self.notification_latencies),
+        }
+
+
+def pick_channels(rng: random.Random, usernames: list, weights: list, count: int) -> list:
+    """`count` distinct channels, popular ones more often"""
+    count = min(count, len(usernames))
+    chosen = set()
+    while len(chosen) < count:
+        chosen.update(rng.choices(usernames, weights=weights, k=count - len(chosen)))
+    return sorted(chosen)
+
+
+def seed_users(args, rng: random.Random, usernames: list, weights: list, first_id: int, count: int):
+    """Insert users, settings and subscriptions directly, bypassing the bot"""
+    from sqlalchemy import insert
+    from database import SessionLocal, User, UserSettings, Subscription
+
+    db = SessionLocal()
+    try:
+        telegram_ids = list(range(first_id, first_id + count))
+        db.execute(insert(User), [{'telegram_id': tg, 'username': f"sim{tg}"} for tg in telegram_ids])
+        ids = dict(db.query(User.telegram_id, User.id).filter(User.telegram_id >= first_id).all())
+        db.execute(insert(UserSettings), [
+            {'user_id': ids[tg], 'summary_length': rng.choice(TIERS)} for tg in telegram_ids
+        ])
+        rows = []
+        for tg in telegram_ids:
+            for username in pick_channels(rng, usernames, weights, args.subscriptions_per_user):
+                rows.append({'user_id': ids[tg], 'channel_id': f"@{username}", 'channel_title': username})
+        db.execute(insert(Subscription), rows)
+        db.commit()
+        return len(rows)
+    finally:
+        db.close()
+
+
+async def onboard_users(args, rng: random.Random, usernames: list, weights: list, count: int) -> dict:
+    """Register users through the bot's /start and /subscribe handlers"""
+    from telegram import Update, Message, Chat, User as TelegramUser
+    from bot import start, subscribe_command
+    from update_processor import PerChatUpdateProcessor
+
+    processor = PerChatUpdateProcessor()
+    await processor.initialize()
+    latencies = []
+    update_ids = iter(range(1, 10 ** 9))
+
+    async def command(telegram_id: int, handler, text: str):
+        update_id = next(update_ids)
+        user = TelegramUser(id=telegram_id, first_name=f"Sim {telegram_id}", is_bot=False, username=f"sim{telegram_id}")
+        message = Message(
+            message_id=update_id, date=datetime.now(timezone.utc),
+            chat=Chat(id=telegram_id, type=Chat.PRIVATE), from_user=user, text=text
+        )
+        update = Update(update_id, message=message)
+        context = SimpleNamespace(args=text.split()[1:])
+        started = time.perf_counter()
+        await processor.process_update(update, handler(update, context))
+        latencies.append(time.perf_counter() - started)
+
+    async def onboard(telegram_id: int):
+        await command(telegram_id, start, "/start")
+        for username in pick_channels(rng, usernames, weights, args.subscriptions_per_user):
+            await command(telegram_id, subscribe_command, f"/subscribe {username}")
+
+    await asyncio.gather(*(onboard(telegram_id) for telegram_id in range(1, count + 1)))
+    await processor.shutdown()
+    return latency_summary(latencies)
+
+
+def table_counts() -> dict:
+    from sqlalchemy import func
+    from database import SessionLocal, ScrapedMessage, OutboxEntry
+
+    db = SessionLocal()
+    try:
+        return {
+            'posts_stored': db.query(ScrapedMessage).count(),
+            'near_duplicates': db.query(ScrapedMessage).filter(ScrapedMessage.duplicate_of.isnot(None)).count(),
+            'summarized': db.query(ScrapedMessage).filter(ScrapedMessage.is_summarized == True).count(),
+            'outbox': dict(db.query(OutboxEntry.status, func.count()).group_by(OutboxEntry.status).all()),
+        }
+    finally:
+        db.close()
+
+
+async def run(args) -> dict:
+    from database import init_db
+    from scraper import ChannelScraper
+    from delivery import delivery_dispatcher, notification_coalescer
+    from outbox import outbox_worker
+    from digests import digest_scheduler
+    from config import DELIVERY_DRAIN_SECONDS
+    import scheduler
+
+    rng = random.Random(args.seed)
+    init_db()
+    client = FakeTelegramClient(args, rng)
+    bot = FakeBot(args, rng, client.posted_at)
+
+    # Zipf popularity: the n-th channel is n times less popular than the first
+    usernames = list(client.channels)
+    weights = [1 / rank for rank in range(1, len(usernames) + 1)]
+
+    delivery_dispatcher.start(bot)
+    onboarded = min(args.onboard_users, args.users)
+    print(f"Onboarding {onboarded} user(s) through the bot handlers...", file=sys.stderr)
+    started = time.perf_counter()
+    commands = await onboard_users(args, rng, usernames, weights, onboarded)
+    onboarding_seconds = time.perf_counter() - started
+    print(f"Seeding {args.users - onboarded} more user(s)...", file=sys.stderr)
+    seeded = 0
+    if args.users > onboarded:
+        seeded = seed_users(args, rng, usernames, weights, onboarded + 1, args.users - onboarded)
+
+    scraper = ChannelScraper(client=client)
+    await scraper.connect()
+    scheduler.set_bot_instance(bot)
+    scheduler.set_scraper(scraper)
+    outbox_worker.start()
+    digest_scheduler.start()
+
+    print(f"Running for {args.duration}s...", file=sys.stderr)
+    backlog = Counter()
+    started = time.perf_counter()
+    scheduler.start_scheduler()
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + args.duration
+    while loop.time() < deadline:
+        await asyncio.sleep(min(1, max(deadline - loop.time(), 0)))
+        backlog['outbox'] = max(backlog['outbox'], outbox_worker.pending())
+        backlog['delivery'] = max(backlog['delivery'], delivery_dispatcher.depth())
+        pipeline_depth = sum(d['queued'] + d['in_flight'] for d in scheduler.ingest_pipeline.depths().values())
+        backlog['pipeline'] = max(backlog['pipeline'], pipeline_depth)
+    load_seconds = time.perf_counter() - started
+
+    print(f"Draining (up to {args.drain}s)...", file=sys.stderr)
+    client.generating = False
+    scheduler_stats = scheduler.scheduler_stats()
+    drain_deadline = loop.time() + args.drain
+    await scheduler.stop_scheduler(args.drain)
+    while loop.time() < drain_deadline and (outbox_worker.pending() or delivery_dispatcher.depth()):
+        await asyncio.sleep(1)
+    drained = not (outbox_worker.pending() or delivery_dispatcher.depth())
+    total_seconds = time.perf_counter() - started
+
+    await digest_scheduler.stop()
+    await outbox_worker.stop()
+    await notification_coalescer.flush_all(DELIVERY_DRAIN_SECONDS)
+    await delivery_dispatcher.stop()
+
+    counts = table_counts()
+    return {
+        'setup': {
+            'channels': args.channels,
+            'users': args.users,
+            'onboarded_users': onboarded,
+            'seeded_subscriptions': seeded,
+            'duration_seconds': args.duration,
+            'time_scale': args.time_scale,
+            'summarizer': os.environ.get("SUMMARIZATION_TYPE"),
+            'seed': args.seed,
+            'overrides': args.set or [],
+        },
+        'telethon': client.stats(),
+        'bot_api': bot.stats(),
+        'pipeline': counts,
+        'throughput_per_second': {
+            'posts_stored': round(counts['posts_stored'] / load_seconds, 2),
+            'notifications': round(len(bot.notification_latencies) / total_seconds, 2),
+            'messages_sent': round(bot.sent / total_seconds, 2),
+        },
+        'latency_seconds': {
+            'post_to_notification': latency_summary(bot.notification_latencies),
+            'onboarding_commands': commands,
+        },
+        'delivery': {
+            'sent': delivery_dispatcher.sent,
+            'retried': delivery_dispatcher.retried,
+            'dropped': delivery_dispatcher.dropped,
+            'coalesced_items': notification_coalescer.items,
+            'coalesced_messages': notification_coalescer.messages,
+        },
+        'max_backlog': dict(backlog),
+        'drained': drained,
+        'scheduler': scheduler_stats,
+        'onboarding_seconds': round(onboarding_seconds, 2),
+        'wall_seconds': round(total_seconds, 2),
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate channel traffic and bot load end to end")
+    parser.add_argument("--channels", type=int, default=200)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--subscriptions-per-user", type=int, default=10)
+    parser.add_argument("--onboard-users", type=int, default=50,
+                        help="users registered through /start and /subscribe; the rest are inserted directly")
+    parser.add_argument("--duration", type=float, default=60, help="seconds of channel traffic")
+    parser.add_argument("--drain", type=float, default=120,
+                        help="seconds to wait afterwards for queued work to be delivered")
+    parser.add_argument("--posts-per-hour", type=float, default=6, help="median posting rate of a channel")
+    parser.add_argument("--time-scale", type=float, default=1,
+                        help="simulated seconds per real second (multiplies posting rates)")
+    parser.add_argument("--burst-probability", type=float, default=0.02,
+                        help="chance that a post comes with a burst of 3-15 more")
+    parser.add_argument("--duplicate-rate", type=float, default=0.05, help="share of cross-posted texts")
+    parser.add_argument("--rpc-latency", type=float, default=0.05, help="mean MTProto request latency in seconds")
+    parser.add_argument("--flood-wait-rate", type=float, default=0.002, help="share of requests answered with FloodWait")
+    parser.add_argument("--flood-wait-seconds", type=int, default=5, help="longest FloodWait")
+    parser.add_argument("--send-latency", type=float, default=0.03, help="mean sendMessage latency in seconds")
+    parser.add_argument("--chat-rate", type=float, default=1, help="Bot API limit: messages per second to one chat")
+    parser.add_argument("--global-rate", type=float, default=30, help="Bot API limit: messages per second in total")
+    parser.add_argument("--summarizer", default="short", help="SUMMARIZATION_TYPE (short and extractive need no model)")
+    parser.add_argument("--database", help="database URL (default: a new SQLite file in a temp directory)")
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--set", action="append", metavar="KEY=VALUE",
+                        help="override a config setting, e.g. PIPELINE_FETCH_WORKERS=8")
+    parser.add_argument("--output", help="write JSON here instead of stdout")
+    args = parser.parse_args(argv)
+
+    database = args.database or "sqlite:///" + os.path.join(tempfile.mkdtemp(prefix="simulation-"), "simulation.db")
+    os.environ["DATABASE_URL"] = database
+    os.environ["SUMMARIZATION_TYPE"] = args.summarizer
+    os.environ.setdefault("METRICS_PORT", "0")
+    os.environ.setdefault("LLAMA_CPP_PRELOAD", "false")
+    apply_overrides(args.set)
+
+    # The modules configure logging on import, so override it afterwards
+    import scheduler  # noqa: F401
+    import bot  # noqa: F401
+    logging.getLogger().setLevel(args.log_level.upper())
+
+    print(f"Simulating {args.channels} channel(s) and {args.users} user(s), database {database}", file=sys.stderr)
+    report = asyncio.run(run(args))
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,90 @@
 """
 Text summarization module using API or simple truncation
+
+Long posts are summarized map-reduce style: the text is split at sentence
+boundaries into chunks that fit the backend's context window, each chunk is
+summarized separately and the partial summaries are reduced into one.
+Every stage is cached by content hash, so an edited post only re-summarizes
+the chunks that actually changed.
 """
+import asyncio
+import hashlib
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
 from config import (
     SUMMARIZATION_TYPE, OPENAI_API_KEY,
     LLAMA_CPP_MODEL_PATH, LLAMA_CPP_CHAT_FORMAT,
     LLAMA_CPP_N_CTX, LLAMA_CPP_N_THREADS,
     LLAMA_CPP_N_GPU_LAYERS, LLAMA_CPP_TEMPERATURE,
-    LLAMA_CPP_MAX_TOKENS
+    LLAMA_CPP_MAX_TOKENS,
+    SUMMARY_MAX_OUTPUT_TOKENS, SUMMARY_API_N_CTX,
+    SUMMARY_CHARS_PER_TOKEN, SUMMARIZATION_MAX_WORKERS,
+    SUMMARY_CACHE_SIZE, SUMMARY_EXTRACTIVE_PREPASS,
+    SUMMARY_TIER_MODE, GEMINI_API_KEY, GEMINI_MODEL, GEMINI_N_CTX,
+    LLAMA_CPP_USE_MLOCK, SUMMARY_BACKENDS
 )
+from extractive import extractive_summarizer, split_sentences as split_key_sentences
+from clustering import story_clusterer
+from metrics import SUMMARIZE_SECONDS
 
 _openai_client = None
 _llama_cpp_client = None
+_gemini_client = None
+_llama_cpp_lock = threading.Lock()
+
+logger = logging.getLogger(__name__)
+
+LLM_COLD = "cold"
+LLM_LOADING = "loading"
+LLM_READY = "ready"
+LLM_FAILED = "failed"
+
+_llm_state = LLM_COLD
+_llm_ready = threading.Event()
+# Set once loading has finished either way; event loops waiting for it get their asyncio.Event set
+_llm_done = threading.Event()
+_llm_waiters = {}
+_llm_waiters_lock = threading.Lock()
+
+API_SYSTEM_PROMPT = "Кратко изложи суть на русском языке. Максимум 2-3 предложения."
+LLAMA_CPP_SYSTEM_PROMPT = "Суммируй контекст. Не делай рассуждений, Не давай коментариев, Не делай анализа и не делай выводов. Максимум 1-2 коротких предложения. Ответ дай на русском языке"
+
+# Summary length tiers, shortest first; "medium" is what summarize_text returns
+SUMMARY_TIERS = ("short", "medium", "long")
+DEFAULT_TIER = "medium"
+
+# (max sentences, max characters) per tier for truncating and extractive paths
+TIER_LIMITS = {
+    "short": (1, 160),
+    "medium": (3, 400),
+    "long": (5, 800),
+}
+
+API_TIER_PROMPTS = {
+    "short": "Кратко изложи суть на русском языке одним коротким предложением.",
+    "medium": API_SYSTEM_PROMPT,
+    "long": "Изложи суть на русском языке, сохрани ключевые факты, имена и цифры. Максимум 5 предложений.",
+}
+LLAMA_CPP_TIER_PROMPTS = {
+    "short": "Суммируй контекст одним коротким предложением. Не делай рассуждений, не давай комментариев и не делай выводов. Ответ дай на русском языке",
+    "medium": LLAMA_CPP_SYSTEM_PROMPT,
+    "long": "Суммируй контекст, сохрани ключевые факты, имена и цифры. Не делай рассуждений, не давай комментариев и не делай выводов. Максимум 5 предложений. Ответ дай на русском языке",
+}
+MAP_SYSTEM_PROMPT = "Кратко изложи суть этого фрагмента длинного текста на русском языке. Не делай выводов. Максимум 2 предложения."
+REDUCE_SYSTEM_PROMPT = "Ниже краткие изложения последовательных частей одного текста. Объедини их в одно связное резюме на русском языке. Максимум 2-3 предложения."
+
+# Safety margin for chat template tokens that the tokenizer does not see
+PROMPT_OVERHEAD_TOKENS = 64
+
+# Maximum number of reduce rounds before falling back to truncation
+MAX_REDUCE_DEPTH = 3
+
+_SENTENCE_SPLIT_RE = re.compile(r'(?<=[.!?…])\s+|\n{2,}')
 
 
 def _get_openai_client():
@@ -25,42 +99,265 @@ def _get_openai_client():
     return _openai_client
 
 
+def _get_gemini_client():
+    """Lazy initialization of Gemini client"""
+    global _gemini_client
+    if _gemini_client is None:
+        import google.generativeai as genai
+        if GEMINI_API_KEY:
+            genai.configure(api_key=GEMINI_API_KEY)
+            _gemini_client = genai.GenerativeModel(GEMINI_MODEL)
+        else:
+            raise ValueError("GEMINI_API_KEY not set")
+    return _gemini_client
+
+
 def _get_llama_cpp_client():
     """Lazy initialization of llama_cpp client"""
     global _llama_cpp_client
     if _llama_cpp_client is None:
-        try:
-            from llama_cpp import Llama
-            _llama_cpp_client = Llama(
-                model_path=LLAMA_CPP_MODEL_PATH,
-                chat_format=LLAMA_CPP_CHAT_FORMAT,
-                n_ctx=LLAMA_CPP_N_CTX,
-                n_threads=LLAMA_CPP_N_THREADS,
-                n_gpu_layers=LLAMA_CPP_N_GPU_LAYERS,
-                temperature=LLAMA_CPP_TEMPERATURE,
-                max_tokens=LLAMA_CPP_MAX_TOKENS,
-                verbose=False
-            )
-        except ImportError:
-            print("llama-cpp-python not installed, LLM summarization will be disabled")
-            _llama_cpp_client = False
-        except Exception as e:
-            print(f"Error loading llama_cpp model: {e}")
-            _llama_cpp_client = False
+        # Preloading and the first summarization may race for the model
+        with _llama_cpp_lock:
+            if _llama_cpp_client is None:
+                _llama_cpp_client = _load_llama_cpp_client()
     return _llama_cpp_client
 
 
+def _load_llama_cpp_client():
+    try:
+        from llama_cpp import Llama
+        return Llama(
+            model_path=LLAMA_CPP_MODEL_PATH,
+            chat_format=LLAMA_CPP_CHAT_FORMAT,
+            n_ctx=LLAMA_CPP_N_CTX,
+            n_threads=LLAMA_CPP_N_THREADS,
+            n_gpu_layers=LLAMA_CPP_N_GPU_LAYERS,
+            temperature=LLAMA_CPP_TEMPERATURE,
+            max_tokens=LLAMA_CPP_MAX_TOKENS,
+            # Map the weights instead of reading them: faster start, shared page cache
+            use_mmap=True,
+            use_mlock=LLAMA_CPP_USE_MLOCK,
+            verbose=False
+        )
+    except ImportError:
+        print("llama-cpp-python not installed, LLM summarization will be disabled")
+        return False
+    except Exception as e:
+        print(f"Error loading llama_cpp model: {e}")
+        return False
+
+
+def llm_state() -> str:
+    """Readiness of the llama_cpp path: cold, loading, ready or failed"""
+    return _llm_state
+
+
+def is_llm_ready() -> bool:
+    return _llm_ready.is_set()
+
+
+async def wait_llm_loaded(timeout: float) -> bool:
+    """
+    Wait until the model load has finished, successfully or not
+
+    All waiters on one event loop share an asyncio.Event that the loading
+    thread sets with call_soon_threadsafe, so waiting holds no thread.
+
+    Returns:
+        False if the timeout passed first
+    """
+    loop = asyncio.get_running_loop()
+    with _llm_waiters_lock:
+        if _llm_done.is_set():
+            return True
+        event = _llm_waiters.setdefault(loop, asyncio.Event())
+    try:
+        await asyncio.wait_for(event.wait(), timeout)
+        return True
+    except asyncio.TimeoutError:
+        return False
+
+
+def _finish_llm_load(state: str):
+    global _llm_state
+    with _llm_waiters_lock:
+        _llm_state = state
+        if state == LLM_READY:
+            _llm_ready.set()
+        _llm_done.set()
+        waiters = list(_llm_waiters.items())
+        _llm_waiters.clear()
+    for loop, event in waiters:
+        try:
+            loop.call_soon_threadsafe(event.set)
+        except RuntimeError:
+            # That loop has been closed meanwhile
+            pass
+
+
+def preload_llama_cpp():
+    """
+    Load the GGUF model and run a tiny warm-up inference
+
+    Meant to run in a background thread at startup, so the first
+    notification does not pay for the model load.
+    """
+    global _llm_state
+    _llm_state = LLM_LOADING
+    started = time.monotonic()
+    client = _get_llama_cpp_client()
+    if not client:
+        _finish_llm_load(LLM_FAILED)
+        logger.warning("llama_cpp model could not be loaded, summaries will use the fallback")
+        return
+
+    loaded = time.monotonic()
+    try:
+        client.create_chat_completion(
+            messages=[{"role": "user", "content": "Привет"}],
+            max_tokens=1
+        )
+    except Exception as e:
+        logger.warning(f"llama_cpp warm-up inference failed: {e}")
+
+    _finish_llm_load(LLM_READY)
+    logger.info(
+        f"llama_cpp model ready: load {loaded - started:.1f}s, "
+        f"warm-up {time.monotonic() - loaded:.1f}s"
+    )
+
+
+class SummaryCache:
+    """Thread-safe LRU cache of summarization results keyed by content hash"""
+
+    def __init__(self, maxsize: int = SUMMARY_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(*parts: str) -> str:
+        digest = hashlib.sha1()
+        for part in parts:
+            digest.update(part.encode('utf-8'))
+            digest.update(b'\x00')
+        return digest.hexdigest()
+
+    def get(self, key: str):
+        with self._lock:
+            value = self._data.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: str, value: str):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+            }
+
+
+def normalize_tier(tier) -> str:
+    """Map a UserSettings.summary_length value to a known tier"""
+    return tier if tier in SUMMARY_TIERS else DEFAULT_TIER
+
+
+def split_sentences(text: str) -> list:
+    """Split text into sentences, keeping paragraph breaks as boundaries"""
+    return [s.strip() for s in _SENTENCE_SPLIT_RE.split(text) if s and s.strip()]
+
+
+def split_into_chunks(text: str, budget: int, count_tokens) -> list:
+    """
+    Split text into chunks of at most `budget` tokens at sentence boundaries
+
+    Boundaries are content-defined: once a chunk is at least half full, it is
+    closed after any sentence whose hash hits a fixed pattern. An edit inside
+    one sentence therefore only shifts the boundaries up to the next such
+    anchor, and the following chunks keep their cache keys.
+
+    Args:
+        text: Text to split
+        budget: Maximum chunk size in tokens
+        count_tokens: Callable returning the token count of a string
+
+    Returns:
+        List of chunk strings
+    """
+    chunks = []
+    current = []
+    current_tokens = 0
+
+    def flush():
+        nonlocal current, current_tokens
+        if current:
+            chunks.append(" ".join(current))
+        current = []
+        current_tokens = 0
+
+    for sentence in split_sentences(text):
+        tokens = count_tokens(sentence)
+
+        if tokens > budget:
+            # A single oversized sentence: fall back to word-level splitting
+            flush()
+            for word in sentence.split():
+                word_tokens = count_tokens(word) + 1
+                if current and current_tokens + word_tokens > budget:
+                    flush()
+                current.append(word)
+                current_tokens += word_tokens
+            flush()
+            continue
+
+        if current and current_tokens + tokens > budget:
+            flush()
+
+        current.append(sentence)
+        current_tokens += tokens
+
+        anchor = hashlib.md5(sentence.encode('utf-8')).digest()[0] % 4 == 0
+        if anchor and current_tokens >= budget // 2:
+            flush()
+
+    flush()
+    return chunks
+
+
 class Summarizer:
     def __init__(self):
         self.summarization_type = SUMMARIZATION_TYPE
-    
+        self.cache = SummaryCache()
+
+    def uses_llama_cpp(self) -> bool:
+        """Whether this configuration may summarize with the local model"""
+        if self.summarization_type == "router":
+            return "llama_cpp" in SUMMARY_BACKENDS
+        return self.summarization_type == "llama_cpp"
+
     def summarize_text(self, text: str, max_length: int = 150, min_length: int = 30) -> str:
         """Summarize text content"""
         if not text or len(text.strip()) < 50:
             return text
-        
-        text = text[:4000]
-        
+
         try:
             if self.summarization_type == "short":
                 return text[:100].strip() + "..."
@@ -68,48 +365,334 @@ class Summarizer:
                 return self._summarize_with_api(text)
             elif self.summarization_type == "llama_cpp":
                 return self._summarize_with_llama_cpp(text)
+            elif self.summarization_type == "extractive":
+                return self._summarize_extractive(text)
+            elif self.summarization_type == "router":
+                return self._summarize_with_router(text)
             else:
                 return text[:200] + "..."
         except Exception as e:
             print(f"Summarization error: {e}")
             return text[:200] + "..."
-    
-    def _summarize_with_api(self, text: str) -> str:
+
+    def summarize_batch(self, texts: list) -> list:
+        """Summarize many texts; extractive mode shares one TF-IDF pass across the batch"""
+        if self.summarization_type == "extractive":
+            return [
+                text if not text or len(text.strip()) < 50 else summary
+                for text, summary in zip(texts, extractive_summarizer.summarize_batch(texts))
+            ]
+        return [self.summarize_text(text) for text in texts]
+
+    def summarize_tiers(self, text: str, tiers) -> dict:
+        """
+        Summarize text once for each requested length tier
+
+        Cost scales with the number of distinct tiers, never with the number
+        of users reading them. In "derive" mode the model is called only for
+        the longest requested tier and shorter ones are cut down from that
+        summary extractively, so every message costs a single LLM call.
+
+        Args:
+            text: Message text
+            tiers: Iterable of tier names (UserSettings.summary_length values)
+
+        Returns:
+            Dictionary mapping tier name to summary
+        """
+        requested = [tier for tier in SUMMARY_TIERS if tier in {normalize_tier(t) for t in tiers}]
+        if not text or len(text.strip()) < 50:
+            return {tier: text for tier in requested}
+
+        results = {}
+        missing = []
+        for tier in requested:
+            cached = self.cache.get(self._tier_cache_key(tier, text))
+            if cached is not None:
+                results[tier] = cached
+            else:
+                missing.append(tier)
+
+        if missing:
+            with SUMMARIZE_SECONDS.labels(self.summarization_type, "tiers").time():
+                computed = self._compute_tiers(text, missing)
+            for tier, summary in computed.items():
+                self.cache.put(self._tier_cache_key(tier, text), summary)
+                results[tier] = summary
+
+        return results
+
+    def summarize_tiers_fast(self, text: str, tiers) -> dict:
+        """Cheap tier summaries without any model, used when a deadline has passed"""
+        requested = [tier for tier in SUMMARY_TIERS if tier in {normalize_tier(t) for t in tiers}]
+        if not text or len(text.strip()) < 50:
+            return {tier: text for tier in requested}
+        return {tier: extractive_summarizer.summarize(text, *TIER_LIMITS[tier]) for tier in requested}
+
+    def _tier_cache_key(self, tier: str, text: str) -> str:
+        return SummaryCache.make_key("tier", self.summarization_type, SUMMARY_TIER_MODE, tier, text)
+
+    def _compute_tiers(self, text: str, tiers: list) -> dict:
+        """Produce summaries for the given tiers (ordered shortest first)"""
+        try:
+            if self.summarization_type == "short":
+                return {
+                    tier: self.summarize_text(text) if tier == DEFAULT_TIER
+                    else text[:TIER_LIMITS[tier][1] // 2].strip() + "..."
+                    for tier in tiers
+                }
+            if self.summarization_type == "extractive":
+                return {
+                    tier: self.summarize_text(text) if tier == DEFAULT_TIER
+                    else extractive_summarizer.summarize(text, *TIER_LIMITS[tier])
+                    for tier in tiers
+                }
+            if self.summarization_type not in ("api", "llama_cpp", "router"):
+                return {tier: self.summarize_text(text) for tier in tiers}
+
+            if SUMMARY_TIER_MODE == "generate":
+                return {tier: self._summarize_with_model(text, tier) for tier in tiers}
+
+            longest = tiers[-1]
+            base = self._summarize_with_model(text, longest)
+            results = {longest: base}
+            for tier in tiers[:-1]:
+                results[tier] = extractive_summarizer.summarize(base, *TIER_LIMITS[tier])
+            return results
+        except Exception as e:
+            print(f"Tier summarization error: {e}")
+            return {tier: text[:200] + "..." for tier in tiers}
+
+    def _summarize_with_model(self, text: str, tier: str = DEFAULT_TIER) -> str:
+        if self.summarization_type == "router":
+            return self._summarize_with_router(text, tier)
+        if self.summarization_type == "api":
+            return self._summarize_with_api(text, tier)
+        return self._summarize_with_llama_cpp(text, tier)
+
+    def _summarize_extractive(self, text: str) -> str:
+        """Summarize by picking key sentences, no model required"""
+        return extractive_summarizer.summarize(text)
+
+    def _summarize_with_router(self, text: str, tier: str = DEFAULT_TIER) -> str:
+        """Summarize with the best healthy backend that fits the latency budget"""
+        from summary_router import get_summary_router
+        return get_summary_router().summarize(text, tier)
+
+    def _summarize_with_api(self, text: str, tier: str = DEFAULT_TIER) -> str:
         """Summarize using OpenAI API"""
         try:
-            client = _get_openai_client()
-            response = client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": "Кратко изложи суть на русском языке. Максимум 2-3 предложения."},
-                    {"role": "user", "content": text}
-                ],
-                max_tokens=150,
-                temperature=0.7
-            )
-            return response.choices[0].message.content
+            return self.summarize_api_raw(text, tier)
         except Exception as e:
             print(f"API summarization error: {e}")
             return text[:200] + "..."
-    
-    def _summarize_with_llama_cpp(self, text: str) -> str:
+
+    def _summarize_with_llama_cpp(self, text: str, tier: str = DEFAULT_TIER) -> str:
         """Summarize using llama_cpp local model"""
         try:
             client = _get_llama_cpp_client()
             if client is False:
-                return text[:200] + "..."
-
-            response = client.create_chat_completion(
-                messages=[
-                    {"role": "system", "content": "Суммируй контекст. Не делай рассуждений, Не давай коментариев, Не делай анализа и не делай выводов. Максимум 1-2 коротких предложения. Ответ дай на русском языке"},
-                    {"role": "user", "content": text}
-                ]
-            )
-            return response["choices"][0]["message"]["content"]
+                # No model on this host: key sentences beat a blind cut
+                return extractive_summarizer.summarize(text, *TIER_LIMITS[tier])
+            return self.summarize_llama_cpp_raw(text, tier)
         except Exception as e:
             print(f"llama_cpp summarization error: {e}")
             return text[:200] + "..."
 
+    def summarize_api_raw(self, text: str, tier: str = DEFAULT_TIER) -> str:
+        """OpenAI summarization that raises on failure instead of falling back"""
+        return self._summarize_chunked(
+            text,
+            backend="api",
+            complete=self._complete_with_api,
+            count_tokens=self._estimate_tokens,
+            n_ctx=SUMMARY_API_N_CTX,
+            system_prompt=API_TIER_PROMPTS[tier],
+            max_workers=SUMMARIZATION_MAX_WORKERS
+        )
+
+    def summarize_llama_cpp_raw(self, text: str, tier: str = DEFAULT_TIER) -> str:
+        """llama_cpp summarization that raises on failure instead of falling back"""
+        if not _get_llama_cpp_client():
+            raise RuntimeError("llama_cpp model is not available")
+        # A single Llama instance is not thread-safe, so chunks run sequentially
+        return self._summarize_chunked(
+            text,
+            backend="llama_cpp",
+            complete=self._complete_with_llama_cpp,
+            count_tokens=self._count_llama_cpp_tokens,
+            n_ctx=LLAMA_CPP_N_CTX,
+            system_prompt=LLAMA_CPP_TIER_PROMPTS[tier],
+            max_workers=1
+        )
+
+    def summarize_gemini_raw(self, text: str, tier: str = DEFAULT_TIER) -> str:
+        """Gemini summarization that raises on failure instead of falling back"""
+        return self._summarize_chunked(
+            text,
+            backend="gemini",
+            complete=self._complete_with_gemini,
+            count_tokens=self._estimate_tokens,
+            n_ctx=GEMINI_N_CTX,
+            system_prompt=API_TIER_PROMPTS[tier],
+            max_workers=SUMMARIZATION_MAX_WORKERS
+        )
+
+    def _complete_with_gemini(self, system_prompt: str, text: str) -> str:
+        """Run one generation against the Gemini API"""
+        model = _get_gemini_client()
+        # This SDK version has no system role, so the instruction leads the prompt
+        response = model.generate_content(
+            f"{system_prompt}\n\n{text}",
+            generation_config={
+                "max_output_tokens": SUMMARY_MAX_OUTPUT_TOKENS,
+                "temperature": 0.7
+            }
+        )
+        return response.text
+
+    def _complete_with_api(self, system_prompt: str, text: str) -> str:
+        """Run one chat completion against the OpenAI API"""
+        client = _get_openai_client()
+        response = client.chat.completions.create(
+            model="gpt-3.5-turbo",
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": text}
+            ],
+            max_tokens=min(150, SUMMARY_MAX_OUTPUT_TOKENS),
+            temperature=0.7
+        )
+        return response.choices[0].message.content
+
+    def _complete_with_llama_cpp(self, system_prompt: str, text: str) -> str:
+        """Run one chat completion against the local llama_cpp model"""
+        client = _get_llama_cpp_client()
+        response = client.create_chat_completion(
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": text}
+            ],
+            max_tokens=SUMMARY_MAX_OUTPUT_TOKENS
+        )
+        return response["choices"][0]["message"]["content"]
+
+    @staticmethod
+    def _estimate_tokens(text: str) -> int:
+        """Approximate token count when no tokenizer is available"""
+        return int(len(text) / SUMMARY_CHARS_PER_TOKEN) + 1
+
+    def _count_llama_cpp_tokens(self, text: str) -> int:
+        """Exact token count using the loaded model's tokenizer"""
+        client = _get_llama_cpp_client()
+        if not client:
+            return self._estimate_tokens(text)
+        return len(client.tokenize(text.encode('utf-8'), add_bos=False))
+
+    def _input_budget(self, n_ctx: int, system_prompt: str, count_tokens) -> int:
+        """Tokens left for user text after the prompt and the reserved output"""
+        reserved = SUMMARY_MAX_OUTPUT_TOKENS + PROMPT_OVERHEAD_TOKENS
+        longest_prompt = max(
+            (system_prompt, MAP_SYSTEM_PROMPT, REDUCE_SYSTEM_PROMPT),
+            key=len
+        )
+        return max(n_ctx - reserved - count_tokens(longest_prompt), 64)
+
+    def _cached_complete(self, stage: str, backend: str, complete, system_prompt: str, text: str) -> str:
+        """Run a completion through the per-stage cache"""
+        key = SummaryCache.make_key(stage, backend, system_prompt, text)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        with SUMMARIZE_SECONDS.labels(backend, stage).time():
+            result = complete(system_prompt, text).strip()
+        self.cache.put(key, result)
+        return result
+
+    def _summarize_chunked(
+        self,
+        text: str,
+        backend: str,
+        complete,
+        count_tokens,
+        n_ctx: int,
+        system_prompt: str,
+        max_workers: int = 1
+    ) -> str:
+        """
+        Summarize text in one pass if it fits the context, map-reduce otherwise
+
+        Args:
+            text: Text to summarize
+            backend: Backend name, part of the cache key
+            complete: Callable (system_prompt, text) -> completion text
+            count_tokens: Callable returning the token count of a string
+            n_ctx: Backend context size in tokens
+            system_prompt: Prompt used for the single-pass case
+            max_workers: Number of chunks summarized in parallel
+
+        Returns:
+            Final summary
+        """
+        budget = self._input_budget(n_ctx, system_prompt, count_tokens)
+
+        if count_tokens(text) <= budget:
+            return self._cached_complete("single", backend, complete, system_prompt, text)
+
+        if SUMMARY_EXTRACTIVE_PREPASS:
+            # Keep the highest-ranked sentences that fit, then refine in one LLM pass
+            text = self._extractive_prepass(text, budget, count_tokens)
+            return self._cached_complete("single", backend, complete, system_prompt, text)
+
+        stage_prompt = MAP_SYSTEM_PROMPT
+        for depth in range(MAX_REDUCE_DEPTH):
+            chunks = split_into_chunks(text, budget, count_tokens)
+
+            def summarize_chunk(chunk, prompt=stage_prompt, stage=f"map{depth}"):
+                return self._cached_complete(stage, backend, complete, prompt, chunk)
+
+            if max_workers > 1 and len(chunks) > 1:
+                with ThreadPoolExecutor(max_workers=min(max_workers, len(chunks))) as pool:
+                    partials = list(pool.map(summarize_chunk, chunks))
+            else:
+                partials = [summarize_chunk(chunk) for chunk in chunks]
+
+            text = "\n".join(partials)
+            if count_tokens(text) <= budget:
+                # The final reduce uses the caller's prompt so tier length rules apply
+                return self._cached_complete("reduce", backend, complete, system_prompt, text)
+
+            # Partial summaries still do not fit: reduce them again
+            stage_prompt = REDUCE_SYSTEM_PROMPT
+
+        # Give up on further rounds and reduce whatever fits
+        while count_tokens(text) > budget:
+            text = text[:int(len(text) * 0.8)]
+        return self._cached_complete("reduce", backend, complete, system_prompt, text)
+
+    def _extractive_prepass(self, text: str, budget: int, count_tokens) -> str:
+        """Compress text to its most important sentences within the token budget"""
+        ranked = extractive_summarizer.rank_sentences(text)
+        order = {sentence: i for i, sentence in enumerate(split_key_sentences(text))}
+        kept = []
+        used = 0
+        for sentence in ranked:
+            position = order.get(sentence, 0)
+            tokens = count_tokens(sentence)
+            if tokens > budget:
+                # One sentence longer than the whole budget (e.g. an unpunctuated post): keep its beginning
+                sentence = split_into_chunks(sentence, budget, count_tokens)[0]
+                tokens = count_tokens(sentence)
+            if used + tokens > budget:
+                continue
+            kept.append((position, sentence))
+            used += tokens
+        if not kept:
+            chunks = split_into_chunks(text, budget, count_tokens)
+            return chunks[0] if chunks else text[:budget]
+        kept.sort(key=lambda item: item[0])
+        return " ".join(sentence for _, sentence in kept)
+
     def process_image(self, image_path: str) -> str:
         """Process image"""
         try:
@@ -118,14 +701,36 @@ class Summarizer:
             return f"[Изображение: {img.size[0]}x{img.size[1]} пикселей]"
         except Exception as e:
             return "[Изображение]"
-    
+
+    def summarize_story(self, members: list, tier: str = DEFAULT_TIER) -> str:
+        """
+        Summarize one story (messages about the same event) once
+
+        A single message keeps its stored summary. Several messages are
+        summarized together from their combined text; the result is cached by
+        content, so every user who sees the same story reuses it.
+        """
+        if len(members) == 1:
+            msg = members[0]
+            return msg.get('summary') or (msg.get('text') or '')[:200]
+        text = story_clusterer.story_text(members)
+        return self.summarize_tiers(text, [tier])[normalize_tier(tier)]
+
     def create_digest(self, messages: list) -> str:
-        """Create digest from multiple messages"""
+        """Create digest from multiple messages, one entry per story with its source links"""
+        if all('id' in msg for msg in messages):
+            stories = story_clusterer.group(messages)
+        else:
+            stories = [[msg] for msg in messages]
+
         digest_parts = []
-        for i, msg in enumerate(messages, 1):
-            summary = msg.get('summary', msg.get('text', '')[:200])
+        for i, members in enumerate(stories, 1):
+            summary = self.summarize_story(members)
             digest_parts.append(f"{i}. {summary}")
+            links = [msg['link'] for msg in members if msg.get('link')]
+            if links:
+                digest_parts.append("   🔗 " + " | ".join(links))
         return "\n".join(digest_parts)
 
 
-summarizer = Summarizer()
\ No newline at end of file
+summarizer = Summarizer()
@@ -0,0 +1,203 @@
+"""
+Priority queue in front of the summarizer
+
+Summarization jobs are ordered so that fresh work for active users does not
+wait behind a backlog of stale posts:
+
+- interactive jobs (a user waiting on /digest) always go first
+- channels share the summarizer fairly: start-time fair queueing gives each
+  backlogged channel a virtual finish tag, so one noisy channel cannot
+  monopolize the model, while channels with more subscribers get a larger share
+- within a channel, fresher posts and posts with more subscribers go first
+
+Every job has a deadline. A job picked up after its deadline runs its cheap
+fallback (extractive/short summary) instead of the model.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import math
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+from config import (
+    SUMMARY_QUEUE_WORKERS, SUMMARY_DEADLINE_SECONDS,
+    SUMMARY_INTERACTIVE_DEADLINE_SECONDS, SUMMARY_SUBSCRIBER_WEIGHT_SECONDS
+)
+from metrics import REGISTRY, QUEUE_DEPTH
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class SummaryJob:
+    """One unit of summarization work"""
+    work: Callable[[], Any]
+    fallback: Callable[[], Any]
+    channel_id: str
+    posted_at: float
+    subscribers: int
+    interactive: bool
+    deadline: float
+    future: asyncio.Future
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+    @property
+    def rank(self) -> float:
+        """Within-channel order: fresher first, each e-fold of subscribers counts as fresher"""
+        return -(self.posted_at + SUMMARY_SUBSCRIBER_WEIGHT_SECONDS * math.log1p(self.subscribers))
+
+
+class SummaryQueue:
+    """Deadline-aware, channel-fair priority queue executed by worker tasks"""
+
+    def __init__(self, workers: int = SUMMARY_QUEUE_WORKERS):
+        self.workers = workers
+        self._seq = itertools.count()
+        self._interactive: List = []
+        self._channel_jobs: Dict[str, List] = {}
+        self._channel_heap: List = []
+        self._channel_finish: Dict[str, float] = {}
+        self._virtual_time = 0.0
+        self._available: Optional[asyncio.Condition] = None
+        self._tasks: List[asyncio.Task] = []
+        self.completed = 0
+        self.degraded = 0
+
+    def depth(self) -> int:
+        return len(self._interactive) + sum(len(jobs) for jobs in self._channel_jobs.values())
+
+    def start(self):
+        """Start worker tasks in the running event loop"""
+        if self._tasks:
+            return
+        self._available = asyncio.Condition()
+        self._tasks = [
+            asyncio.create_task(self._worker(i)) for i in range(self.workers)
+        ]
+        logger.info(f"Summary queue started with {self.workers} worker(s)")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(
+        self,
+        work: Callable[[], Any],
+        fallback: Callable[[], Any],
+        channel_id: str = "",
+        posted_at: Optional[datetime] = None,
+        subscribers: int = 1,
+        interactive: bool = False,
+        deadline_seconds: Optional[float] = None
+    ):
+        """
+        Queue a job and wait for its result
+
+        Args:
+            work: Blocking callable doing the full summarization
+            fallback: Cheap blocking callable used once the deadline has passed
+            channel_id: Channel the job belongs to, for fair sharing
+            posted_at: When the post was published (fresher goes first)
+            subscribers: Number of users waiting for this result
+            interactive: A user is waiting on a command right now
+            deadline_seconds: Override of the default deadline
+
+        Returns:
+            Whatever work (or fallback) returned
+        """
+        self.start()
+        if deadline_seconds is None:
+            deadline_seconds = SUMMARY_INTERACTIVE_DEADLINE_SECONDS if interactive else SUMMARY_DEADLINE_SECONDS
+
+        loop = asyncio.get_running_loop()
+        job = SummaryJob(
+            work=work,
+            fallback=fallback,
+            channel_id=channel_id,
+            posted_at=(posted_at or datetime.now(timezone.utc)).timestamp(),
+            subscribers=subscribers,
+            interactive=interactive,
+            deadline=time.monotonic() + deadline_seconds,
+            future=loop.create_future()
+        )
+
+        async with self._available:
+            self._push(job)
+            self._available.notify()
+
+        return await job.future
+
+    def _push(self, job: SummaryJob):
+        seq = next(self._seq)
+        if job.interactive:
+            heapq.heappush(self._interactive, (job.deadline, seq, job))
+            return
+
+        jobs = self._channel_jobs.setdefault(job.channel_id, [])
+        if not jobs:
+            # Channel becomes backlogged: start its tag at the current virtual time
+            start = max(self._virtual_time, self._channel_finish.get(job.channel_id, 0.0))
+            heapq.heappush(self._channel_heap, (start, seq, job.channel_id))
+        heapq.heappush(jobs, (job.rank, seq, job))
+
+    def _pop(self) -> Optional[SummaryJob]:
+        if self._interactive:
+            return heapq.heappop(self._interactive)[2]
+        if not self._channel_heap:
+            return None
+
+        tag, _, channel_id = heapq.heappop(self._channel_heap)
+        jobs = self._channel_jobs[channel_id]
+        job = heapq.heappop(jobs)[2]
+
+        # Channels with more waiting subscribers get a proportionally larger share
+        finish = tag + 1.0 / (1.0 + math.log1p(job.subscribers))
+        self._virtual_time = tag
+        self._channel_finish[channel_id] = finish
+        if jobs:
+            heapq.heappush(self._channel_heap, (finish, next(self._seq), channel_id))
+        else:
+            del self._channel_jobs[channel_id]
+        return job
+
+    async def _worker(self, index: int):
+        while True:
+            async with self._available:
+                job = self._pop()
+                while job is None:
+                    await self._available.wait()
+                    job = self._pop()
+
+            if job.future.cancelled():
+                continue
+
+            late = time.monotonic() > job.deadline
+            func = job.fallback if late else job.work
+            if late:
+                self.degraded += 1
+                logger.info(f"Summary job for {job.channel_id or 'interactive'} missed its deadline, degrading")
+
+            try:
+                result = await asyncio.to_thread(func)
+            except Exception as e:
+                logger.error(f"Summary job failed: {e}")
+                try:
+                    result = await asyncio.to_thread(job.fallback)
+                except Exception as fallback_error:
+                    if not job.future.done():
+                        job.future.set_exception(fallback_error)
+                    continue
+
+            self.completed += 1
+            if not job.future.done():
+                job.future.set_result(result)
+
+
+summary_queue = SummaryQueue()
+REGISTRY.on_collect(lambda: QUEUE_DEPTH.labels("summary").set(summary_queue.depth()))
@@ -0,0 +1,314 @@
+"""
+Latency-budgeted router over several summarization backends
+
+Used when SUMMARIZATION_TYPE=router. Backends are tried in the configured
+order of preference (SUMMARY_BACKENDS). For each one the router keeps a
+rolling window of latencies and outcomes and a circuit breaker:
+
+- closed: requests flow normally
+- open: after repeated failures or timeouts the backend is skipped for
+  SUMMARY_BREAKER_COOLDOWN_SECONDS
+- half-open: after the cooldown a single trial request decides whether
+  the breaker closes again
+
+A request goes to the most preferred backend whose breaker lets it through,
+that is not busy, and whose recent p95 latency fits the remaining budget.
+A backend that overruns the budget is abandoned (its call finishes in the
+background) and counted as a failure; latency is measured from when the call
+starts running. The thread pool has a thread for every backend slot, so
+abandoned calls never make new ones wait. Extractive summarization is always
+the last resort, so every request gets an answer within its budget.
+"""
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Callable, Dict, List, Optional
+
+from config import (
+    SUMMARY_BACKENDS, SUMMARY_LATENCY_BUDGET_SECONDS,
+    SUMMARY_BREAKER_FAILURE_THRESHOLD, SUMMARY_BREAKER_COOLDOWN_SECONDS,
+    LLAMA_CPP_MODEL_PATH, OPENAI_API_KEY, GEMINI_API_KEY
+)
+
+logger = logging.getLogger(__name__)
+
+# Number of recent calls kept per backend
+STATS_WINDOW = 50
+# Calls needed before the rolling p95 replaces the prior latency estimate
+MIN_SAMPLES = 5
+# Error rate over the window that trips the breaker once MIN_SAMPLES are seen
+ERROR_RATE_THRESHOLD = 0.5
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class BackendStats:
+    """Rolling latency and error statistics of one backend"""
+
+    def __init__(self, prior_latency: float, window: int = STATS_WINDOW):
+        self.prior_latency = prior_latency
+        self._calls = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, latency: float, ok: bool):
+        with self._lock:
+            self._calls.append((latency, ok))
+
+    def p95_latency(self) -> float:
+        with self._lock:
+            if len(self._calls) < MIN_SAMPLES:
+                return self.prior_latency
+            latencies = sorted(latency for latency, _ in self._calls)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+
+    def error_rate(self) -> float:
+        with self._lock:
+            if not self._calls:
+                return 0.0
+            return sum(1 for _, ok in self._calls if not ok) / len(self._calls)
+
+    def sample_count(self) -> int:
+        with self._lock:
+            return len(self._calls)
+
+
+class CircuitBreaker:
+    """Closed / open / half-open breaker driven by consecutive failures and error rate"""
+
+    def __init__(
+        self,
+        failure_threshold: int = SUMMARY_BREAKER_FAILURE_THRESHOLD,
+        cooldown_seconds: float = SUMMARY_BREAKER_COOLDOWN_SECONDS
+    ):
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Whether a request may be sent now; in half-open state only one trial passes"""
+        with self._lock:
+            if self.state == OPEN:
+                if time.monotonic() - self.opened_at < self.cooldown_seconds:
+                    return False
+                self.state = HALF_OPEN
+                self._trial_in_flight = False
+            if self.state == HALF_OPEN:
+                if self._trial_in_flight:
+                    return False
+                self._trial_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.state = CLOSED
+            self.consecutive_failures = 0
+            self._trial_in_flight = False
+
+    def cancel_trial(self):
+        """The request that was let through never reached the backend"""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self, error_rate: float = 0.0, samples: int = 0):
+        with self._lock:
+            self.consecutive_failures += 1
+            self._trial_in_flight = False
+            too_many = self.consecutive_failures >= self.failure_threshold
+            too_often = samples >= MIN_SAMPLES and error_rate >= ERROR_RATE_THRESHOLD
+            if self.state == HALF_OPEN or too_many or too_often:
+                if self.state != OPEN:
+                    logger.warning(f"Circuit breaker opened after {self.consecutive_failures} failure(s)")
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+
+
+class Backend:
+    """A summarization backend with its health tracking"""
+
+    def __init__(
+        self,
+        name: str,
+        summarize: Callable[[str, str], str],
+        available: Callable[[], bool],
+        prior_latency: float,
+        max_concurrency: int = 1
+    ):
+        self.name = name
+        self.summarize = summarize
+        self.available = available
+        self.stats = BackendStats(prior_latency)
+        self.breaker = CircuitBreaker()
+        self.max_concurrency = max_concurrency
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self.last_attempt = 0.0
+
+    def try_acquire(self) -> bool:
+        return self._slots.acquire(blocking=False)
+
+    def release(self):
+        self._slots.release()
+
+    def snapshot(self) -> dict:
+        return {
+            'state': self.breaker.state,
+            'p95_latency': self.stats.p95_latency(),
+            'error_rate': self.stats.error_rate(),
+            'samples': self.stats.sample_count(),
+        }
+
+
+class SummaryRouter:
+    """Routes each request to the best backend that can meet its latency budget"""
+
+    def __init__(self, backends: List[Backend], fallback: Callable[[str, str], str]):
+        self.backends = backends
+        self.fallback = fallback
+        # A thread for every slot: abandoned calls keep theirs, so a call never queues behind them
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(1, sum(backend.max_concurrency for backend in backends)),
+            thread_name_prefix="summary-router"
+        )
+
+    def summarize(self, text: str, tier: str, budget_seconds: Optional[float] = None) -> str:
+        """
+        Summarize text with the first suitable backend in preference order
+
+        Args:
+            text: Text to summarize
+            tier: Summary length tier
+            budget_seconds: Latency budget for this request
+
+        Returns:
+            Summary from a backend, or from the extractive fallback
+        """
+        budget = SUMMARY_LATENCY_BUDGET_SECONDS if budget_seconds is None else budget_seconds
+        deadline = time.monotonic() + budget
+
+        for backend in self.backends:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            if not backend.available():
+                continue
+            too_slow = backend.stats.p95_latency() > remaining
+            # A slow backend still gets an occasional probe, or its p95 could never recover
+            if too_slow and time.monotonic() - backend.last_attempt < SUMMARY_BREAKER_COOLDOWN_SECONDS:
+                logger.debug(f"Skipping {backend.name}: p95 {backend.stats.p95_latency():.1f}s > {remaining:.1f}s left")
+                continue
+            if not backend.try_acquire():
+                continue
+            if not backend.breaker.allow():
+                backend.release()
+                continue
+
+            result = self._call(backend, text, tier, remaining)
+            if result is not None:
+                return result
+
+        return self.fallback(text, tier)
+
+    def _call(self, backend: Backend, text: str, tier: str, timeout: float) -> Optional[str]:
+        backend.last_attempt = time.monotonic()
+        run_started = []
+
+        def run():
+            run_started.append(time.monotonic())
+            return backend.summarize(text, tier)
+
+        def latency() -> float:
+            # Measured from when the call actually ran, not from when it was submitted
+            return time.monotonic() - run_started[0] if run_started else 0.0
+
+        future = self._executor.submit(run)
+        # The slot is held until the call really finishes, even if we stop waiting
+        future.add_done_callback(lambda _: backend.release())
+
+        try:
+            result = future.result(timeout=timeout)
+        except FutureTimeoutError:
+            if future.cancel():
+                # Never ran: the budget went on waiting for a thread, which says nothing about the backend
+                backend.breaker.cancel_trial()
+                logger.warning(f"Backend {backend.name} did not start within the {timeout:.1f}s budget")
+                return None
+            self._failure(backend, latency())
+            logger.warning(f"Backend {backend.name} exceeded the {timeout:.1f}s budget")
+            return None
+        except Exception as e:
+            self._failure(backend, latency())
+            logger.warning(f"Backend {backend.name} failed: {e}")
+            return None
+
+        backend.stats.record(latency(), True)
+        backend.breaker.record_success()
+        return result
+
+    @staticmethod
+    def _failure(backend: Backend, latency: float):
+        backend.stats.record(latency, False)
+        backend.breaker.record_failure(backend.stats.error_rate(), backend.stats.sample_count())
+
+    def snapshot(self) -> Dict[str, dict]:
+        return {backend.name: backend.snapshot() for backend in self.backends}
+
+
+def build_default_router() -> SummaryRouter:
+    """Router over the backends listed in SUMMARY_BACKENDS"""
+    # Imported here: summarizer imports this module lazily as well
+    from summarizer import summarizer, TIER_LIMITS, llm_state, LLM_LOADING, LLM_FAILED
+    from extractive import extractive_summarizer
+
+    def extractive(text, tier):
+        return extractive_summarizer.summarize(text, *TIER_LIMITS[tier])
+
+    factories = {
+        'llama_cpp': lambda: Backend(
+            'llama_cpp', summarizer.summarize_llama_cpp_raw,
+            # While the model is loading in the background other backends take over
+            lambda: os.path.exists(LLAMA_CPP_MODEL_PATH) and llm_state() not in (LLM_LOADING, LLM_FAILED),
+            prior_latency=10.0, max_concurrency=1
+        ),
+        'api': lambda: Backend(
+            'api', summarizer.summarize_api_raw,
+            lambda: bool(OPENAI_API_KEY),
+            prior_latency=3.0, max_concurrency=8
+        ),
+        'gemini': lambda: Backend(
+            'gemini', summarizer.summarize_gemini_raw,
+            lambda: bool(GEMINI_API_KEY),
+            prior_latency=3.0, max_concurrency=8
+        ),
+        'extractive': lambda: Backend(
+            'extractive', extractive,
+            lambda: True,
+            prior_latency=0.01, max_concurrency=64
+        ),
+    }
+
+    backends = []
+    for name in SUMMARY_BACKENDS:
+        if name in factories:
+            backends.append(factories[name]())
+        else:
+            logger.warning(f"Unknown summarization backend in SUMMARY_BACKENDS: {name}")
+    return SummaryRouter(backends, fallback=extractive)
+
+
+_summary_router = None
+
+
+def get_summary_router() -> SummaryRouter:
+    """Lazy initialization of the default router"""
+    global _summary_router
+    if _summary_router is None:
+        _summary_router = build_default_router()
+    return _summary_router
@@ -0,0 +1,146 @@
+"""
+Fixed-rate periodic tasks
+
+A PeriodicTask runs its callback on a fixed grid (start, start + interval,
+start + 2 × interval, ...) measured on the loop's monotonic clock, so the
+period does not stretch with the callback's duration. A run never overlaps
+the previous one; when a run overruns one or more ticks, the missed-tick
+policy decides what happens:
+
+- skip: drop the missed ticks and wait for the next grid point
+- coalesce: run once right away for all missed ticks, then stay on the grid
+
+stop() lets the running callback finish (up to a timeout) instead of
+cancelling it halfway, then returns.
+"""
+import asyncio
+import logging
+import zlib
+from typing import Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+MISSED_SKIP = "skip"
+MISSED_COALESCE = "coalesce"
+
+
+def jitter_offset(key: str, spread: float) -> float:
+    """
+    Stable offset in [0, spread) for a key
+
+    The same key always gets the same offset, so a job keeps a fixed phase
+    (and a fixed period) while different jobs spread over the window.
+    """
+    if spread <= 0:
+        return 0.0
+    return (zlib.crc32(key.encode()) / 2 ** 32) * spread
+
+
+class PeriodicTask:
+    """Runs `callback` every `interval` seconds on a fixed-rate schedule"""
+
+    def __init__(
+        self,
+        name: str,
+        interval: float,
+        callback: Callable[[], Awaitable[None]],
+        missed_ticks: str = MISSED_SKIP
+    ):
+        if missed_ticks not in (MISSED_SKIP, MISSED_COALESCE):
+            raise ValueError(f"Unknown missed tick policy: {missed_ticks}")
+        self.name = name
+        self.interval = interval
+        self.callback = callback
+        self.missed_ticks = missed_ticks
+        self._task: Optional[asyncio.Task] = None
+        self._stopping: Optional[asyncio.Event] = None
+        self.runs = 0
+        self.failures = 0
+        self.missed = 0
+        self.overruns = 0
+        self.last_duration = 0.0
+        self.max_duration = 0.0
+        self.total_duration = 0.0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        if self.running:
+            return
+        self._stopping = asyncio.Event()
+        self._task = asyncio.create_task(self._run(), name=f"periodic-{self.name}")
+
+    async def stop(self, timeout: float = 30):
+        """Stop ticking; a run in progress gets `timeout` seconds to finish"""
+        if not self._task:
+            return
+        self._stopping.set()
+        try:
+            await asyncio.wait_for(asyncio.shield(self._task), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"{self.name}: run did not finish within {timeout}s, cancelling")
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time()
+
+        while not self._stopping.is_set():
+            delay = next_tick - loop.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), delay)
+                    break
+                except asyncio.TimeoutError:
+                    pass
+
+            started = loop.time()
+            try:
+                await self.callback()
+            except Exception as e:
+                self.failures += 1
+                logger.error(f"{self.name} failed: {e}")
+            finished = loop.time()
+            self._record(started - next_tick, finished - started)
+
+            next_tick += self.interval
+            if finished > next_tick:
+                # The run took longer than the interval: ticks were missed
+                missed = int((finished - next_tick) // self.interval) + 1
+                self.overruns += 1
+                if self.missed_ticks == MISSED_SKIP:
+                    next_tick += missed * self.interval
+                    self.missed += missed
+                else:
+                    next_tick += (missed - 1) * self.interval
+                    self.missed += missed - 1
+                logger.warning(f"{self.name} took {finished - started:.1f}s "
+                               f"(interval {self.interval}s), {self.missed_ticks} {missed} tick(s)")
+
+    def _record(self, lag: float, duration: float):
+        self.runs += 1
+        self.last_lag = lag
+        self.max_lag = max(self.max_lag, lag)
+        self.last_duration = duration
+        self.max_duration = max(self.max_duration, duration)
+        self.total_duration += duration
+
+    def stats(self) -> dict:
+        return {
+            'interval': self.interval,
+            'runs': self.runs,
+            'failures': self.failures,
+            'overruns': self.overruns,
+            'missed_ticks': self.missed,
+            'last_duration': round(self.last_duration, 3),
+            'max_duration': round(self.max_duration, 3),
+            'avg_duration': round(self.total_duration / self.runs, 3) if self.runs else 0.0,
+            'last_lag': round(self.last_lag, 3),
+            'max_lag': round(self.max_lag, 3),
+        }
@@ -0,0 +1,93 @@
+"""
+Concurrent update processing with per-chat ordering
+
+Updates from different chats are handled in parallel, up to
+UPDATE_CONCURRENCY at a time, so one slow command does not block other
+users. Updates from the same chat (or user, for updates without a chat)
+are still handled one at a time and in arrival order, so settings
+callbacks of one user never race each other.
+"""
+import asyncio
+import logging
+from typing import Any, Awaitable, Dict, List
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from config import UPDATE_CONCURRENCY
+from profiling import profiler
+
+logger = logging.getLogger(__name__)
+
+# Updates admitted per running slot: the rest wait for their chat's turn
+# without holding a slot, so one user flooding the bot cannot starve others
+PENDING_PER_SLOT = 8
+
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """Runs updates of different chats concurrently and updates of one chat in order"""
+
+    __slots__ = ("_running", "_chat_locks")
+
+    def __init__(self, max_concurrent_updates: int = UPDATE_CONCURRENCY):
+        # The base class bounds admitted updates, our own semaphore bounds running ones
+        super().__init__(max_concurrent_updates * PENDING_PER_SLOT)
+        self._running = asyncio.BoundedSemaphore(max_concurrent_updates)
+        # chat key -> [lock, number of updates holding or waiting for it]
+        self._chat_locks: Dict[Any, List] = {}
+
+    @staticmethod
+    def _chat_key(update: object):
+        if not isinstance(update, Update):
+            return None
+        if update.effective_chat:
+            return ('chat', update.effective_chat.id)
+        if update.effective_user:
+            return ('user', update.effective_user.id)
+        return None
+
+    @staticmethod
+    def _handler_name(update: object) -> str:
+        """Profiling label: the command, the callback data prefix or the update kind"""
+        if not isinstance(update, Update):
+            return "handler.other"
+        if update.message and update.message.text and update.message.text.startswith('/'):
+            return "handler." + update.message.text.split()[0].split('@')[0]
+        if update.callback_query:
+            data = update.callback_query.data or ""
+            return "handler.callback:" + data.split(':')[0]
+        return "handler.message" if update.message else "handler.other"
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        key = self._chat_key(update)
+        phase = profiler.phase(self._handler_name(update)) if profiler.enabled else None
+        if key is None:
+            async with self._running:
+                await self._run(coroutine, phase)
+            return
+
+        entry = self._chat_locks.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                async with self._running:
+                    await self._run(coroutine, phase)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._chat_locks[key]
+
+    @staticmethod
+    async def _run(coroutine: Awaitable[Any], phase):
+        if phase is None:
+            await coroutine
+            return
+        # Timed from here, so waiting for the chat lock or a slot is not counted
+        with phase:
+            await coroutine
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
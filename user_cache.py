@@ -0,0 +1,229 @@
+"""
+In-process cache of users, their settings and subscriptions
+
+Bot handlers and the scheduler look users up on every command and every
+cycle. The cache keeps detached, read-only snapshots of those rows in a
+bounded LRU keyed by telegram_id, so hot paths only touch the database on
+a miss. Code that changes a user, their settings or subscriptions commits
+through the ORM as before and then calls invalidate(), so the next read
+reloads fresh rows.
+
+The list of all active subscriptions used by the scheduler is cached as a
+whole and dropped whenever any subscription changes.
+
+Invalidation only reaches the process that made the write. Processes that
+read users written by another one (scraper workers in multi-process mode)
+set a ttl so their snapshots expire on their own.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from database import User, UserSettings, Subscription
+from config import USER_CACHE_SIZE
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class CachedUser:
+    id: int
+    telegram_id: int
+    username: Optional[str]
+    is_active: bool
+
+
+@dataclass(frozen=True)
+class CachedSettings:
+    user_id: int
+    summary_length: str
+    include_media: bool
+    notification_time: str
+    daily_digest: bool
+    timezone: Optional[str]
+
+
+@dataclass(frozen=True)
+class CachedSubscription:
+    id: int
+    user_id: int
+    channel_id: str
+    channel_title: str
+
+
+@dataclass(frozen=True)
+class UserEntry:
+    """A user with settings and active subscriptions"""
+    user: CachedUser
+    settings: Optional[CachedSettings]
+    subscriptions: Tuple[CachedSubscription, ...]
+
+    @property
+    def channel_ids(self) -> set:
+        return {sub.channel_id for sub in self.subscriptions}
+
+
+def _snapshot_user(user) -> CachedUser:
+    return CachedUser(user.id, user.telegram_id, user.username, bool(user.is_active))
+
+
+def _snapshot_settings(settings) -> CachedSettings:
+    return CachedSettings(
+        settings.user_id, settings.summary_length, bool(settings.include_media),
+        settings.notification_time, bool(settings.daily_digest), settings.timezone
+    )
+
+
+def _snapshot_subscription(sub) -> CachedSubscription:
+    return CachedSubscription(sub.id, sub.user_id, str(sub.channel_id), sub.channel_title)
+
+
+class UserCache:
+    """Thread-safe LRU of UserEntry snapshots with explicit invalidation"""
+
+    def __init__(self, maxsize: int = USER_CACHE_SIZE, ttl: float = 0):
+        self.maxsize = maxsize
+        # Seconds a snapshot stays valid; 0 keeps it until invalidated
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._loaded_at: Dict[int, float] = {}
+        self._telegram_ids: Dict[int, int] = {}
+        self._active_subscriptions: Optional[List[CachedSubscription]] = None
+        self._subscriptions_loaded_at = 0.0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, db, telegram_id: int) -> Optional[UserEntry]:
+        """User entry by telegram_id, or None if the user does not exist"""
+        with self._lock:
+            entry = self._entries.get(telegram_id)
+            if entry is not None and not self._expired(self._loaded_at.get(telegram_id, 0)):
+                self._entries.move_to_end(telegram_id)
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        user = db.query(User).filter(User.telegram_id == telegram_id).first()
+        if not user:
+            return None
+        return self._load(db, [user])[user.id]
+
+    def get_many_by_id(self, db, user_ids: Iterable[int]) -> Dict[int, UserEntry]:
+        """Entries by internal user id; misses are loaded with batched queries"""
+        found = {}
+        missing = []
+        with self._lock:
+            for user_id in set(user_ids):
+                telegram_id = self._telegram_ids.get(user_id)
+                entry = self._entries.get(telegram_id) if telegram_id is not None else None
+                if entry is None or self._expired(self._loaded_at.get(telegram_id, 0)):
+                    missing.append(user_id)
+                    self.misses += 1
+                else:
+                    self._entries.move_to_end(telegram_id)
+                    found[user_id] = entry
+                    self.hits += 1
+
+        if missing:
+            users = db.query(User).filter(User.id.in_(missing)).all()
+            found.update(self._load(db, users))
+        return found
+
+    def active_subscriptions(self, db) -> List[CachedSubscription]:
+        """All active subscriptions of all users"""
+        with self._lock:
+            if self._active_subscriptions is not None and not self._expired(self._subscriptions_loaded_at):
+                return self._active_subscriptions
+
+        subscriptions = [
+            _snapshot_subscription(sub) for sub in db.query(Subscription).filter(
+                Subscription.is_active == True
+            ).all()
+        ]
+        with self._lock:
+            self._active_subscriptions = subscriptions
+            self._subscriptions_loaded_at = time.monotonic()
+        return subscriptions
+
+    def invalidate(self, telegram_id: Optional[int] = None, subscriptions: bool = False):
+        """
+        Drop cached rows after a write
+
+        Args:
+            telegram_id: User whose user, settings or subscription rows changed
+            subscriptions: Subscriptions changed, drop the scheduler's list too
+        """
+        with self._lock:
+            if telegram_id is not None:
+                entry = self._entries.pop(telegram_id, None)
+                self._loaded_at.pop(telegram_id, None)
+                if entry is not None:
+                    self._telegram_ids.pop(entry.user.id, None)
+            if subscriptions:
+                self._active_subscriptions = None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._loaded_at.clear()
+            self._telegram_ids.clear()
+            self._active_subscriptions = None
+
+    def _load(self, db, users) -> Dict[int, UserEntry]:
+        if not users:
+            return {}
+        user_ids = [user.id for user in users]
+        settings = {
+            row.user_id: _snapshot_settings(row)
+            for row in db.query(UserSettings).filter(UserSettings.user_id.in_(user_ids)).all()
+        }
+        subscriptions: Dict[int, List[CachedSubscription]] = {}
+        for sub in db.query(Subscription).filter(
+            Subscription.user_id.in_(user_ids),
+            Subscription.is_active == True
+        ).all():
+            subscriptions.setdefault(sub.user_id, []).append(_snapshot_subscription(sub))
+
+        entries = {
+            user.id: UserEntry(
+                _snapshot_user(user),
+                settings.get(user.id),
+                tuple(subscriptions.get(user.id, ()))
+            )
+            for user in users
+        }
+        if self.maxsize <= 0:
+            return entries
+
+        loaded_at = time.monotonic()
+        with self._lock:
+            for entry in entries.values():
+                self._entries[entry.user.telegram_id] = entry
+                self._entries.move_to_end(entry.user.telegram_id)
+                self._loaded_at[entry.user.telegram_id] = loaded_at
+                self._telegram_ids[entry.user.id] = entry.user.telegram_id
+            while len(self._entries) > self.maxsize:
+                telegram_id, evicted = self._entries.popitem(last=False)
+                self._loaded_at.pop(telegram_id, None)
+                self._telegram_ids.pop(evicted.user.id, None)
+        return entries
+
+    def _expired(self, loaded_at: float) -> bool:
+        return bool(self.ttl) and time.monotonic() - loaded_at > self.ttl
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+user_cache = UserCache()
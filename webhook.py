@@ -0,0 +1,135 @@
+"""
+Webhook mode: Telegram pushes updates to an embedded HTTP server
+
+Each POST to WEBHOOK_PATH is checked against the secret token that was
+registered with setWebhook (X-Telegram-Bot-Api-Secret-Token header),
+parsed into an Update and put on the application's update queue. The HTTP
+response goes out right away; handlers run asynchronously, so command
+latency is bounded by processing time instead of a polling interval.
+
+For local testing leave WEBHOOK_URL empty (no setWebhook call) and post
+recorded Update JSON:
+
+    curl -X POST localhost:8443/telegram \\
+         -H 'X-Telegram-Bot-Api-Secret-Token: <secret>' \\
+         -H 'Content-Type: application/json' -d @update.json
+"""
+import asyncio
+import hmac
+import json
+import logging
+import secrets
+import signal
+import ssl
+
+from telegram import Update
+
+from config import (
+    WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_URL,
+    WEBHOOK_SECRET_TOKEN, WEBHOOK_CERT, WEBHOOK_KEY
+)
+from httpd import HttpServer, HttpError, Request, Response
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "x-telegram-bot-api-secret-token"
+
+
+class WebhookServer:
+    """Receives updates over HTTP and feeds them to a telegram Application"""
+
+    def __init__(self, application, secret_token: str = WEBHOOK_SECRET_TOKEN, path: str = WEBHOOK_PATH):
+        self.application = application
+        self.secret_token = secret_token
+        self.path = path
+        self.http = HttpServer(WEBHOOK_LISTEN, WEBHOOK_PORT, ssl_context=_ssl_context())
+        self.http.route("POST", path, self.handle_update)
+        self.received = 0
+
+    async def handle_update(self, request: Request) -> Response:
+        if self.secret_token:
+            supplied = request.headers.get(SECRET_HEADER, "")
+            if not hmac.compare_digest(supplied.encode(), self.secret_token.encode()):
+                raise HttpError(403)
+
+        try:
+            data = json.loads(request.body)
+            update = Update.de_json(data, self.application.bot)
+        except (ValueError, TypeError, KeyError) as e:
+            logger.warning(f"Rejected malformed webhook update: {e}")
+            raise HttpError(400)
+        if update is None:
+            raise HttpError(400)
+
+        # Processing happens in the application's update loop, not in this request
+        self.received += 1
+        await self.application.update_queue.put(update)
+        return Response(200)
+
+    async def start(self):
+        await self.http.start()
+
+    async def stop(self):
+        await self.http.stop()
+
+
+def _ssl_context():
+    if not (WEBHOOK_CERT and WEBHOOK_KEY):
+        return None
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain(WEBHOOK_CERT, WEBHOOK_KEY)
+    return context
+
+
+async def run_webhook(application):
+    """
+    Serve the application in webhook mode until SIGINT/SIGTERM or cancellation
+
+    Registers the webhook with Telegram when WEBHOOK_URL is set; without it
+    the server only accepts locally posted updates. Either way of stopping
+    runs the application's shutdown, post_stop included.
+    """
+    secret_token = WEBHOOK_SECRET_TOKEN
+    if WEBHOOK_URL and not secret_token:
+        # Telegram sends back whatever we register, a random one is as good as any
+        secret_token = secrets.token_urlsafe(32)
+    if not secret_token:
+        logger.warning("WEBHOOK_SECRET_TOKEN is empty: webhook requests are not authenticated")
+
+    loop = asyncio.get_running_loop()
+    stop_event = asyncio.Event()
+    stop_signals = []
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+            stop_signals.append(sig)
+        except (NotImplementedError, RuntimeError):
+            # No signal handlers outside the main thread or on Windows: KeyboardInterrupt cancels us instead
+            pass
+
+    server = WebhookServer(application, secret_token=secret_token)
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+    await server.start()
+    try:
+        if WEBHOOK_URL:
+            await application.bot.set_webhook(
+                url=WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH,
+                secret_token=secret_token,
+                allowed_updates=Update.ALL_TYPES,
+                drop_pending_updates=True
+            )
+            logger.info(f"Webhook registered at {WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}")
+        # Serve until the process is stopped
+        await stop_event.wait()
+        logger.info("Stopping webhook server...")
+    finally:
+        for sig in stop_signals:
+            loop.remove_signal_handler(sig)
+        await server.stop()
+        await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()